@@ -2,3 +2,13 @@
 
 from .emailer import Emailer
 from .emailer import Message
+from .emailer import InlineImage
+from .transport import Transport
+from .transport import SMTPTransport
+from .transport import NullTransport
+from .transport import MemoryTransport
+from .transport import MaildirTransport
+from .transport import MboxTransport
+
+from . import profiling
+profiling.install_from_environment()
@@ -0,0 +1,146 @@
+"""Validation and normalization of recipient addresses.
+
+Addresses are checked for syntax and normalized before any message is built,
+so invalid ones never cost an SMTP RCPT round trip. Domains are case-folded
+and converted to their IDNA (ASCII) form; local parts are kept as given. The
+result for every domain is memoized, and since recipient lists share few
+distinct domains, most of the work on a large list is a cache hit.
+"""
+import functools
+import re
+from email.utils import parseaddr
+
+_LOCAL_PART = re.compile(r"^[\w!#$%&'*+/=?^`{|}~-]+(\.[\w!#$%&'*+/=?^`{|}~-]+)*$")
+_DOMAIN_LABEL = re.compile(r'^[a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?$')
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def normalize_domain(domain):
+    """Return the lower case IDNA form of a domain, or None if invalid.
+
+    Args:
+        domain (str): The domain part of an address.
+
+    Returns:
+        Optional[str]: The normalized domain.
+    """
+    domain = domain.lower().rstrip('.')
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+    labels = domain.split('.')
+    if len(domain) > 253 or len(labels) < 2:
+        return None
+    if not all(_DOMAIN_LABEL.match(label) for label in labels):
+        return None
+    return domain
+
+
+def _normalize(address):
+    """Return the normalized address, or None if it is invalid."""
+    address = address.strip()
+    if '<' in address:
+        address = parseaddr(address)[1]
+    local, at, domain = address.rpartition('@')
+    if not at or len(local) > 64 or not _LOCAL_PART.match(local):
+        return None
+    domain = normalize_domain(domain)
+    if domain is None:
+        return None
+    return '{}@{}'.format(local, domain)
+
+
+def normalize_address(address):
+    """Return an address in normalized form.
+
+    Args:
+        address (str): An address, optionally with a display name as in
+            `Friend <friend@gmail.com>`.
+
+    Returns:
+        str: The address as `local@domain`, the domain in lower case IDNA
+        form.
+
+    Raises:
+        ValueError: If the address is not syntactically valid.
+    """
+    normalized = _normalize(address)
+    if normalized is None:
+        raise ValueError('Invalid email address: {!r}'.format(address))
+    return normalized
+
+
+def normalize_many(addresses, seen=None):
+    """Normalize and deduplicate a batch of addresses.
+
+    Args:
+        addresses (Iterable[str]): The addresses.
+        seen (Optional[set]): Lower cased normalized addresses to treat as
+            duplicates. Updated with the accepted addresses.
+
+    Returns:
+        Tuple[List[str], List[str]]: The normalized addresses, unique
+        regardless of case, in input order, and the invalid input addresses.
+    """
+    seen = set() if seen is None else seen
+    valid = []
+    invalid = []
+    for address in addresses:
+        normalized = _normalize(address)
+        if normalized is None:
+            invalid.append(address)
+        elif normalized.lower() not in seen:
+            seen.add(normalized.lower())
+            valid.append(normalized)
+    return valid, invalid
+
+
+def validate_recipients(destinations, cc=None, bcc=None):
+    """Normalize the recipients of a message, dropping addresses repeated
+    in To, CC or BCC. An address is kept in the first of To, CC and BCC
+    it appears in.
+
+    Args:
+        destinations (Sequence[str]): The To addresses.
+        cc (Optional(Sequence[str])): The CC addresses.
+        bcc (Optional(Sequence[str])): The BCC addresses.
+
+    Returns:
+        Tuple[List[str], List[str], List[str], List[str]]: The To, CC and
+        BCC addresses, and the invalid input addresses.
+    """
+    seen = set()
+    to_valid, invalid = normalize_many(destinations, seen)
+    cc_valid, cc_invalid = normalize_many(cc or [], seen)
+    bcc_valid, bcc_invalid = normalize_many(bcc or [], seen)
+    return to_valid, cc_valid, bcc_valid, invalid + cc_invalid + bcc_invalid
+
+
+class AddressValidator:
+    """Row stream stage that normalizes recipient addresses and drops
+    invalid ones, for :func:`auto_emailer.bulk.send_bulk`.
+    """
+
+    def __init__(self):
+        self.rejected = 0
+
+    def filter(self, rows, address_key='email'):
+        """Normalize the recipient address of every row.
+
+        Args:
+            rows (Iterable[dict]): The recipient rows.
+            address_key (str): Key of the recipient address in each row.
+
+        Yields:
+            dict: The valid rows, copied if their address was normalized.
+        """
+        for row in rows:
+            normalized = _normalize(row[address_key])
+            if normalized is None:
+                self.rejected += 1
+                continue
+            if normalized != row[address_key]:
+                row = dict(row)
+                row[address_key] = normalized
+            yield row
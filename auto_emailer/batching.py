@@ -0,0 +1,110 @@
+"""Grouping of recipients by destination domain.
+
+Relays limit how fast they deliver to each destination domain, and receiving
+servers accept several recipients of the same domain in one transaction. A
+:class:`DomainBatcher` reads a bounded window of the recipient stream, groups
+the rows by domain and hands out batches of one domain at a time, taking the
+domains in turn so that no domain is hammered while the others wait::
+
+    batcher = DomainBatcher(window=10000, batch_size=50)
+    # personalized messages, sent in domain batches
+    send_bulk(transport, rows, sender, subject, text,
+              stages=[batcher.filter])
+    # one identical message, a single transaction per batch
+    send_batched(transport, rows, message, batcher=batcher)
+"""
+import collections
+
+
+def domain_of(address):
+    """Return: str: The lower case domain of an address."""
+    return address.rpartition('@')[2].strip().rstrip('>').lower()
+
+
+class DomainBatcher:
+    """Row stream stage grouping recipients by domain within a bounded
+    window and interleaving the domains fairly.
+    """
+
+    def __init__(self, window=10000, batch_size=50):
+        """
+        Args:
+            window (int): Most rows held at once while grouping. A larger
+                window makes fuller batches out of a shuffled stream.
+            batch_size (int): Most rows in a batch, for example the number
+                of recipients the relay accepts per transaction.
+
+        Raises:
+            ValueError: If window or batch_size is less than 1.
+        """
+        if window < 1 or batch_size < 1:
+            raise ValueError('window and batch_size must be at least 1.')
+        self.window = window
+        self.batch_size = batch_size
+        self.rows = 0
+        self.batches_made = 0
+
+    @property
+    def mean_batch_size(self):
+        """float: Average number of rows per batch made so far."""
+        if not self.batches_made:
+            return 0.0
+        return self.rows / self.batches_made
+
+    def batches(self, rows, address_key='email'):
+        """Group the recipient rows into batches of one domain.
+
+        Domains are served round robin, one batch per turn, in the order
+        they first appeared in the window.
+
+        Args:
+            rows (Iterable[dict]): The recipient rows.
+            address_key (str): Key of the recipient address in each row.
+
+        Yields:
+            List[dict]: Up to `batch_size` rows of the same domain.
+        """
+        rows = iter(rows)
+        queues = collections.OrderedDict()
+        held = 0
+        exhausted = False
+        while True:
+            # top the window up before every batch
+            while not exhausted and held < self.window:
+                row = next(rows, None)
+                if row is None:
+                    exhausted = True
+                    break
+                domain = domain_of(row[address_key])
+                queue = queues.get(domain)
+                if queue is None:
+                    queue = queues[domain] = collections.deque()
+                queue.append(row)
+                held += 1
+            if not queues:
+                return
+            domain, queue = next(iter(queues.items()))
+            size = min(self.batch_size, len(queue))
+            batch = [queue.popleft() for _ in range(size)]
+            held -= size
+            if queue:
+                queues.move_to_end(domain)
+            else:
+                del queues[domain]
+            self.rows += size
+            self.batches_made += 1
+            yield batch
+
+    def filter(self, rows, address_key='email'):
+        """Reorder the recipient rows in domain batches, as a stage of
+        :func:`auto_emailer.bulk.send_bulk`.
+
+        Args:
+            rows (Iterable[dict]): The recipient rows.
+            address_key (str): Key of the recipient address in each row.
+
+        Yields:
+            dict: The rows, batch after batch.
+        """
+        for batch in self.batches(rows, address_key):
+            yield from batch
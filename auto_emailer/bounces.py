@@ -0,0 +1,160 @@
+"""Extraction of failed recipients from bounce mailboxes.
+
+A :class:`BounceParser` scans mbox files of bounces through a memory map and
+extracts the failed recipients of every delivery status notification (RFC
+3464): a multipart/report whose message/delivery-status part lists, per
+recipient, a Final-Recipient, an Action and a Status. Only the top level
+headers and the delivery-status part are looked at; the returned original
+message and any other part are skipped over without being parsed, and
+messages that are not reports are skipped after their headers::
+
+    parser = BounceParser(hard_only=True)
+    parser.suppress(['/path/to/bounces.mbox'], '/path/to/suppressed.idx')
+"""
+import collections
+import mmap
+import os
+import re
+import time
+
+from .suppression import SuppressionIndex
+
+BounceRecord = collections.namedtuple(
+    'BounceRecord', 'recipient status action diagnostic offset')
+BounceRecord.__doc__ = """A failed recipient of a delivery status
+notification, with the byte offset of its message in the mbox file."""
+
+_FROM_LINE = re.compile(rb'^From ', re.MULTILINE)
+_HEADERS_END = re.compile(rb'\r?\n\r?\n')
+_REPORT = re.compile(rb'^Content-Type:[ \t]*multipart/report',
+                     re.IGNORECASE | re.MULTILINE)
+_STATUS_PART = re.compile(
+    rb'^Content-Type:[ \t]*message/(?:global-)?delivery-status',
+    re.IGNORECASE | re.MULTILINE)
+_PART_END = re.compile(rb'^--', re.MULTILINE)
+_FIELD = re.compile(rb'^(Final-Recipient|Original-Recipient|Action|Status|'
+                    rb'Diagnostic-Code):[ \t]*([^\r\n]*)',
+                    re.IGNORECASE | re.MULTILINE)
+
+
+def _recipient(value):
+    """Return the address of a `type; address` recipient field."""
+    address = value.partition(b';')[2] or value
+    return address.strip().strip(b'<>').decode('utf-8', 'replace')
+
+
+class BounceParser:
+    """Stream the failed recipients out of mbox files of bounces."""
+
+    def __init__(self, hard_only=False):
+        """
+        Args:
+            hard_only (bool): If True, only permanent failures, with a
+                5.x.x status, are reported. Otherwise transient 4.x.x
+                failures are reported as well.
+        """
+        self.hard_only = hard_only
+        self.messages = 0
+        self.reports = 0
+        self.records = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self):
+        """float: Megabytes scanned per second."""
+        if not self.seconds:
+            return 0.0
+        return self.bytes / self.seconds / 1e6
+
+    def as_dict(self):
+        """Return: dict: The counters, summed over every file parsed."""
+        return {'messages': self.messages,
+                'reports': self.reports,
+                'records': self.records,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'throughput': self.throughput}
+
+    def parse(self, path):
+        """Extract the failed recipients of an mbox file.
+
+        Args:
+            path (str): Path of the mbox file.
+
+        Yields:
+            auto_emailer.bounces.BounceRecord: Every failed recipient, in
+            file order.
+        """
+        if not os.path.getsize(path):
+            return
+        start = time.perf_counter()
+        with open(path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                offsets = [match.start()
+                           for match in _FROM_LINE.finditer(data)]
+                if not offsets or offsets[0]:
+                    offsets.insert(0, 0)
+                offsets.append(len(data))
+                for begin, end in zip(offsets, offsets[1:]):
+                    self.messages += 1
+                    for record in self._message(data, begin, end):
+                        self.records += 1
+                        # only the time spent here counts
+                        self.seconds += time.perf_counter() - start
+                        yield record
+                        start = time.perf_counter()
+                self.bytes += len(data)
+            finally:
+                self.seconds += time.perf_counter() - start
+
+    def _message(self, data, begin, end):
+        headers_end = _HEADERS_END.search(data, begin, end)
+        if headers_end is None:
+            return
+        if not _REPORT.search(data, begin, headers_end.start()):
+            return
+        part = _STATUS_PART.search(data, headers_end.end(), end)
+        if part is None:
+            return
+        self.reports += 1
+        body = _HEADERS_END.search(data, part.end(), end)
+        if body is None:
+            return
+        part_end = _PART_END.search(data, body.end(), end)
+        status_fields = data[body.end():part_end.start() if part_end else end]
+
+        # a block of per message fields, then one block per recipient
+        for block in _HEADERS_END.split(status_fields):
+            fields = {name.lower(): value for name, value
+                      in _FIELD.findall(block)}
+            recipient = (fields.get(b'final-recipient') or
+                         fields.get(b'original-recipient'))
+            action = fields.get(b'action', b'').strip().lower()
+            status = fields.get(b'status', b'').strip()
+            if recipient is None or action != b'failed':
+                continue
+            if self.hard_only and not status.startswith(b'5'):
+                continue
+            yield BounceRecord(_recipient(recipient),
+                               status.decode('ascii', 'replace'),
+                               action.decode('ascii'),
+                               fields.get(b'diagnostic-code', b'').strip()
+                               .decode('utf-8', 'replace'),
+                               begin)
+
+    def suppress(self, paths, index_path, merge=True):
+        """Add the failed recipients of mbox files to a suppression index.
+
+        Args:
+            paths (Iterable[str]): Paths of the mbox files.
+            index_path (str): Path of the suppression index.
+            merge (bool): If True, keep the entries of an existing index.
+
+        Returns:
+            auto_emailer.suppression.SuppressionIndex: The new index.
+        """
+        return SuppressionIndex.build(
+            index_path, (record.recipient for path in paths
+                         for record in self.parse(path)), merge=merge)
@@ -0,0 +1,479 @@
+"""Bulk rendering and sending of a recipient stream.
+
+Recipients are given as an iterable of rows, each row a dict holding the
+recipient address under `address_key` and the values used to format the
+message template. Rows are never collected in memory as a whole, so the
+stream may come straight from a large CSV or JSONL export.
+"""
+import collections
+import concurrent.futures
+import functools
+import itertools
+import os
+import smtplib
+import threading
+import time
+
+from . import metrics
+from .batching import DomainBatcher
+from .concurrency import SessionPool
+from .concurrency import is_congestion
+from .emailer import Message
+from .journal import idempotency_key
+from .transport import Envelope
+
+_REFUSED = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+            smtplib.SMTPDataError)
+
+
+class RenderReport:
+    """Aggregate outcome of rendering a recipient stream."""
+
+    def __init__(self):
+        self.rendered = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.missing_keys = collections.Counter()
+
+    @property
+    def throughput(self):
+        """float: Rendered messages per second."""
+        if not self.seconds:
+            return 0.0
+        return self.rendered / self.seconds
+
+    def as_dict(self):
+        """Return: dict: The report as plain data."""
+        return {'rendered': self.rendered,
+                'failed': self.failed,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'throughput': self.throughput,
+                'missing_keys': dict(self.missing_keys)}
+
+
+class SendReport:
+    """Aggregate outcome of sending a recipient stream."""
+
+    def __init__(self):
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.missing_keys = collections.Counter()
+        self.errors = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record_sent(self):
+        """Count a sent message."""
+        with self._lock:
+            self.sent += 1
+
+    def record_failure(self, error_type):
+        """Count a message that could not be sent.
+
+        Args:
+            error_type (type): Class of the exception that stopped it.
+        """
+        with self._lock:
+            self.failed += 1
+            self.errors[error_type.__name__] += 1
+
+    @property
+    def throughput(self):
+        """float: Sent messages per second."""
+        if not self.seconds:
+            return 0.0
+        return self.sent / self.seconds
+
+    def as_dict(self):
+        """Return: dict: The report as plain data."""
+        return {'sent': self.sent,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'seconds': self.seconds,
+                'throughput': self.throughput,
+                'missing_keys': dict(self.missing_keys),
+                'errors': dict(self.errors)}
+
+
+def render_row(row, sender, subject, text, attach_files=None,
+               address_key='email', signer=None):
+    """Build the message for a single recipient row.
+
+    Args:
+        row (dict): Recipient address and template values.
+        sender (str): Email address of the sender (from).
+        subject (str): Subject of the email message.
+        text (str): Body template, formatted with the row values.
+        attach_files (Optional(Sequence[str])): Files to attach.
+        address_key (str): Key of the recipient address in `row`.
+        signer (Optional(auto_emailer.dkim.DKIMSigner)): DKIM signer of
+            the message.
+
+    Returns:
+        auto_emailer.emailer.Message: The drafted message.
+
+    Raises:
+        KeyError: If the template references a value missing from `row`.
+    """
+    message = Message(sender, [row[address_key]], subject, signer=signer)
+    message.draft_message(text=text.format(**row))
+    return message.attach(attach_files)
+
+
+def _render_bytes(row, **kwargs):
+    """Render a row to an envelope tuple, or to the name of the missing
+    template key. Runs in worker processes, so only plain data is returned.
+    """
+    try:
+        message = render_row(row, **kwargs)
+    except KeyError as error:
+        return None, error.args[0] if error.args else None
+    return (message.as_bytes(), message.sender, message.recipients), None
+
+
+def _blocks(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        block = list(itertools.islice(iterator, size))
+        if not block:
+            return
+        yield block
+
+
+def render_stream(rows, render, workers=None, chunksize=64):
+    """Apply `render` to every row, in parallel worker processes.
+
+    Rows are consumed in bounded blocks so that memory stays flat no matter
+    how long the stream is. Results are yielded in row order.
+
+    Args:
+        rows (Iterable[dict]): The recipient rows.
+        render (Callable): Picklable callable applied to each row.
+        workers (Optional[int]): Number of worker processes. Defaults to
+            the number of CPUs; 1 renders in the calling process.
+        chunksize (int): Rows handed to a worker at a time.
+
+    Yields:
+        The result of `render` for each row.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for row in rows:
+            yield render(row)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for block in _blocks(rows, workers * chunksize * 4):
+            for result in executor.map(render, block, chunksize=chunksize):
+                yield result
+
+
+def dry_run(rows, sink, sender, subject, text=None, template_path=None,
+            attach_files=None, address_key='email', workers=None,
+            chunksize=64):
+    """Render every row of a recipient stream without sending it.
+
+    Messages are drafted exactly as :meth:`Message.draft_message` and
+    :meth:`Message.attach` would, serialized in parallel worker processes
+    and written to `sink`, typically an
+    :class:`auto_emailer.transport.MaildirTransport` or
+    :class:`auto_emailer.transport.MboxTransport`. Rows whose template
+    values are missing are counted in the report instead of aborting
+    the run.
+
+    Args:
+        rows (Iterable[dict]): The recipient rows.
+        sink (auto_emailer.transport.Transport): Where rendered messages
+            are written.
+        sender (str): Email address of the sender (from).
+        subject (str): Subject of the email messages.
+        text (Optional[str]): Body template, formatted with each row.
+        template_path (Optional[str]): File path of the body template,
+            used if `text` is None.
+        attach_files (Optional(Sequence[str])): Files to attach.
+        address_key (str): Key of the recipient address in each row.
+        workers (Optional[int]): Number of render processes.
+        chunksize (int): Rows handed to a worker at a time.
+
+    Returns:
+        auto_emailer.bulk.RenderReport: Throughput and template errors.
+    """
+    if text is None:
+        text = Message.body_template(template_path)
+    render = functools.partial(_render_bytes, sender=sender, subject=subject,
+                               text=text, attach_files=attach_files,
+                               address_key=address_key)
+    report = RenderReport()
+
+    def envelopes():
+        for envelope, missing in render_stream(rows, render, workers,
+                                               chunksize):
+            if envelope is None:
+                report.failed += 1
+                report.missing_keys[missing] += 1
+                continue
+            report.rendered += 1
+            report.bytes += len(envelope[0])
+            yield Envelope(*envelope)
+
+    start = time.perf_counter()
+    sink.send_many(envelopes())
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def deliver(transport, message, from_addr=None, to_addrs=None,
+            reconnect=True):
+    """Send a message, reopening the transport and trying once more on
+    connection errors, like :meth:`Emailer.send_email`. A Message is sent
+    as the cached bytes of :meth:`Message.as_bytes`, with CRLF line
+    endings; bytes are sent as given.
+
+    Args:
+        transport (auto_emailer.transport.Transport): The transport.
+        message (Union[auto_emailer.emailer.Message, bytes, str]): The
+            message.
+        from_addr (Optional[str]): The envelope sender. Defaults to the
+            sender of a Message.
+        to_addrs (Optional(Sequence[str])): The envelope recipients.
+            Default to every recipient of a Message.
+        reconnect (bool): If False, connection errors are raised instead,
+            for callers that treat them as congestion.
+
+    Returns:
+        int: Number of bytes delivered, 0 if unknown.
+    """
+    if isinstance(message, Message):
+        from_addr = from_addr or message.sender
+        to_addrs = to_addrs or message.recipients
+        message = message.as_bytes()
+    try:
+        return transport.send(message, from_addr, to_addrs)
+    except (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected):
+        if not reconnect:
+            raise
+        if metrics.ENABLED:
+            metrics.RECONNECTS.inc()
+        transport.close()
+        transport.open()
+        return transport.send(message, from_addr, to_addrs)
+
+
+def send_bulk(transport, rows, sender, subject, text=None, template_path=None,
+              attach_files=None, address_key='email', journal=None,
+              campaign='', stages=(), controller=None, signer=None):
+    """Render and send a message to every row of a recipient stream over
+    a single transport session.
+
+    If a `journal` is given, rows already recorded in it for `campaign`
+    are skipped and every delivered row is recorded, so an interrupted
+    run can simply be started again with the same arguments.
+
+    Rows with missing template values and messages refused by the server
+    are counted in the report; a connection that cannot be re-established
+    aborts the run.
+
+    Args:
+        transport (auto_emailer.transport.Transport): Where to send, for
+            example `Emailer.transport`.
+        rows (Iterable[dict]): The recipient rows.
+        sender (str): Email address of the sender (from).
+        subject (str): Subject of the email messages.
+        text (Optional[str]): Body template, formatted with each row.
+        template_path (Optional[str]): File path of the body template,
+            used if `text` is None.
+        attach_files (Optional(Sequence[str])): Files to attach.
+        address_key (str): Key of the recipient address in each row.
+        journal (Optional[auto_emailer.journal.SendJournal]): Journal of
+            completed sends.
+        campaign (str): Campaign name the idempotency keys derive from.
+        stages (Sequence[Callable]): Filters applied to the row stream
+            before any message is built. Each takes an iterable of rows
+            and the `address_key` keyword, and returns an iterable of rows.
+        controller (Optional[auto_emailer.concurrency.AIMDController]): If
+            given, messages are sent concurrently over a pool of sessions,
+            as many at once as the controller's window allows.
+        signer (Optional(auto_emailer.dkim.DKIMSigner)): If given, every
+            message is DKIM signed. Rows sharing a body share its hash.
+
+    Returns:
+        auto_emailer.bulk.SendReport: Counts of sent, skipped and failed
+        rows.
+    """
+    if text is None:
+        text = Message.body_template(template_path)
+    for stage in stages:
+        rows = stage(rows, address_key=address_key)
+
+    report = SendReport()
+    messages = _messages(rows, report, sender, subject, text, attach_files,
+                         address_key, journal, campaign, signer)
+    start = time.perf_counter()
+    try:
+        if controller is None:
+            _send_serially(transport, messages, report, journal)
+        else:
+            _send_concurrently(transport, messages, report, journal,
+                               controller)
+    finally:
+        report.seconds = time.perf_counter() - start
+    return report
+
+
+def send_batched(transport, rows, message, address_key='email',
+                 batcher=None, journal=None, campaign=''):
+    """Send one identical message to every row of a recipient stream, with
+    a single SMTP transaction per batch of recipients of the same domain.
+
+    The message is serialized once. Its headers are sent as they are, so
+    its To header should not name the individual recipients, which are
+    only given in the envelope.
+
+    Args:
+        transport (auto_emailer.transport.Transport): Where to send.
+        rows (Iterable[dict]): The recipient rows.
+        message (auto_emailer.emailer.Message): The drafted message.
+        address_key (str): Key of the recipient address in each row.
+        batcher (Optional[auto_emailer.batching.DomainBatcher]): How to
+            group the recipients. Defaults to a DomainBatcher().
+        journal (Optional[auto_emailer.journal.SendJournal]): Journal of
+            completed sends, checked and updated per recipient.
+        campaign (str): Campaign name the idempotency keys derive from.
+
+    Returns:
+        auto_emailer.bulk.SendReport: Counts of sent, skipped and failed
+        recipients.
+    """
+    batcher = batcher or DomainBatcher()
+    data = message.as_bytes()
+    report = SendReport()
+    opened = not transport.connected
+    transport.open()
+    start = time.perf_counter()
+    try:
+        for batch in batcher.batches(rows, address_key):
+            keys = {}
+            for row in batch:
+                address = row[address_key]
+                key = None
+                if journal is not None:
+                    key = idempotency_key(address, campaign)
+                    if key in journal:
+                        report.skipped += 1
+                        continue
+                if address in keys:
+                    report.skipped += 1
+                    continue
+                keys[address] = key
+            if not keys:
+                continue
+            try:
+                deliver(transport, data, message.sender, list(keys))
+            except _REFUSED as error:
+                for _ in keys:
+                    report.record_failure(type(error))
+                continue
+            refused = getattr(transport, 'refused', None) or {}
+            for address, key in keys.items():
+                if address in refused:
+                    report.record_failure(smtplib.SMTPRecipientsRefused)
+                    continue
+                report.record_sent()
+                if key is not None:
+                    journal.record(key)
+    finally:
+        report.seconds = time.perf_counter() - start
+        if opened:
+            transport.close()
+    return report
+
+
+def _messages(rows, report, sender, subject, text, attach_files, address_key,
+              journal, campaign, signer=None):
+    """Yield the idempotency key and message of every row still to send."""
+    for row in rows:
+        key = None
+        if journal is not None:
+            key = idempotency_key(row[address_key], campaign)
+            if key in journal:
+                report.skipped += 1
+                continue
+
+        try:
+            message = render_row(row, sender, subject, text, attach_files,
+                                 address_key, signer)
+        except KeyError as error:
+            report.record_failure(KeyError)
+            report.missing_keys[error.args[0] if error.args else None] += 1
+            continue
+        yield key, message
+
+
+def _send_one(session, key, message, report, journal, congestion=False):
+    """Deliver a message, counting refusals instead of raising them. If
+    `congestion` is True, refusals asking to try again later and dropped
+    connections are raised, for the controller to see them.
+    """
+    try:
+        deliver(session, message, reconnect=not congestion)
+    except _REFUSED as error:
+        if congestion and is_congestion(error):
+            raise
+        report.record_failure(type(error))
+        return
+    report.record_sent()
+    if key is not None:
+        journal.record(key)
+
+
+def _send_serially(transport, messages, report, journal):
+    opened = not transport.connected
+    transport.open()
+    try:
+        for key, message in messages:
+            _send_one(transport, key, message, report, journal)
+    finally:
+        if opened:
+            transport.close()
+
+
+def _send_concurrently(transport, messages, report, journal, controller,
+                       attempts=3):
+    """Send from a pool of sessions, as many at once as `controller`
+    allows. A send pushed back by the server is retried once the window
+    was cut; any other error stops the run and is raised.
+    """
+    pool = SessionPool(transport)
+    errors = []
+
+    def send(key, message):
+        for attempt in range(attempts):
+            if attempt:
+                controller.acquire()
+            try:
+                with controller.measure():
+                    with pool.session() as session:
+                        _send_one(session, key, message, report, journal,
+                                  congestion=True)
+                return
+            except Exception as error:
+                if not is_congestion(error) or attempt == attempts - 1:
+                    errors.append(error)
+                    return
+
+    executor = concurrent.futures.ThreadPoolExecutor(controller.maximum)
+    try:
+        for key, message in messages:
+            if errors:
+                break
+            controller.acquire()
+            executor.submit(send, key, message)
+    finally:
+        executor.shutdown(wait=True)
+        pool.close()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,613 @@
+"""Command line tools.
+
+``auto-emailer send`` sends a campaign: it streams the rows of a CSV or JSONL
+recipients file through a :class:`~auto_emailer.pipeline.Pipeline`, formats
+the template with each row and shows a progress line with the rate and the
+time left. Every delivered recipient is recorded in a journal next to the
+recipients file, so an interrupted campaign resumes where it stopped when
+the same command is run again::
+
+    EMAILER_CREDS=creds.json auto-emailer send template.txt recipients.csv \\
+        --subject 'Spring news' --attach flyer.pdf
+
+``auto-emailer-load``, also available as ``auto-emailer load``, drives
+synthetic messages at an SMTP server, at a target rate and concurrency, to
+find out how much a relay can take. It prints the throughput and latency
+percentiles every second on standard error and a JSON summary at the end::
+
+    auto-emailer-load --host localhost --port 1025 --no-tls --no-auth \\
+        --count 10000 --concurrency 16 --rate 500 --body-size 20000 \\
+        --attachment-size 1000000
+
+Without ``--host`` the server and credentials come from the environment, as
+for :func:`auto_emailer.config.default_credentials`. ``--null`` serializes
+and discards the messages instead, to measure the client alone.
+"""
+import argparse
+import array
+import collections
+import concurrent.futures
+import csv
+import json
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+
+from .bulk import deliver
+from .concurrency import SessionPool
+from .config import Credentials
+from .config import default_credentials
+from .config import environment_vars
+from .emailer import Message
+from .journal import SendJournal
+from .pipeline import Pipeline
+from .transport import NullTransport
+from .transport import SMTPTransport
+
+
+_SEND_DESCRIPTION = ('Send a message formatted with each row of a '
+                     'recipients file, resuming an interrupted campaign.')
+
+_LOAD_DESCRIPTION = ('Send synthetic messages to an SMTP server and report '
+                     'throughput and latency.')
+
+
+def percentile(values, fraction):
+    """Return the value below which `fraction` of sorted `values` lie.
+
+    Args:
+        values (Sequence[float]): Sorted values.
+        fraction (float): Between 0 and 1.
+
+    Returns:
+        Optional[float]: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, int(fraction * len(values)))
+    return values[index]
+
+
+class LoadStats:
+    """Outcome of a load test, updated from the sending threads."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.errors = collections.Counter()
+        self.latencies = array.array('d')
+        self._window = []
+        self._lock = threading.Lock()
+
+    def record(self, size, latency):
+        """Record a delivered message.
+
+        Args:
+            size (int): Bytes delivered.
+            latency (float): Seconds the delivery took.
+        """
+        with self._lock:
+            self.sent += 1
+            self.bytes += size
+            self.latencies.append(latency)
+            self._window.append(latency)
+
+    def record_failure(self, error):
+        """Record a message that could not be delivered.
+
+        Args:
+            error (Exception): What stopped it.
+        """
+        with self._lock:
+            self.failed += 1
+            self.errors[type(error).__name__] += 1
+
+    def window(self):
+        """Return and forget the latencies recorded since the last call.
+
+        Returns:
+            List[float]: The latencies, sorted.
+        """
+        with self._lock:
+            window, self._window = self._window, []
+        return sorted(window)
+
+    @property
+    def throughput(self):
+        """float: Delivered messages per second."""
+        if not self.seconds:
+            return 0.0
+        return self.sent / self.seconds
+
+    def as_dict(self):
+        """Return: dict: The summary, latencies in milliseconds."""
+        latencies = sorted(self.latencies)
+
+        def milliseconds(value):
+            return None if value is None else round(value * 1000, 3)
+
+        mean = sum(latencies) / len(latencies) if latencies else None
+        return {'sent': self.sent,
+                'failed': self.failed,
+                'bytes': self.bytes,
+                'seconds': round(self.seconds, 3),
+                'throughput': round(self.throughput, 3),
+                'errors': dict(self.errors),
+                'latency_ms': {
+                    'mean': milliseconds(mean),
+                    'p50': milliseconds(percentile(latencies, 0.5)),
+                    'p90': milliseconds(percentile(latencies, 0.9)),
+                    'p99': milliseconds(percentile(latencies, 0.99)),
+                    'max': milliseconds(latencies[-1] if latencies
+                                        else None)}}
+
+
+def _add_transport_arguments(parser):
+    group = parser.add_argument_group('server')
+    group.add_argument('--host', help='SMTP server. Defaults to the '
+                       'credentials of the environment.')
+    group.add_argument('--port', type=int, default=587,
+                       help='SMTP port with --host (default: %(default)s).')
+    group.add_argument('--user', help='User name to log in with --host. '
+                       'Defaults to the sender.')
+    group.add_argument('--password', default=os.environ.get(
+                           environment_vars.EMAILER_PASSWORD),
+                       help='Password with --host. Defaults to '
+                       '${}.'.format(environment_vars.EMAILER_PASSWORD))
+    group.add_argument('--no-tls', action='store_true',
+                       help='Do not start TLS.')
+    group.add_argument('--no-auth', action='store_true',
+                       help='Do not log in.')
+    group.add_argument('--null', action='store_true',
+                       help='Serialize and discard the messages instead of '
+                       'sending them.')
+
+
+def read_recipients(path, fmt=None):
+    """Stream the rows of a recipients file.
+
+    Args:
+        path (str): Path of the file.
+        fmt (Optional[str]): 'csv', with a header line, or 'jsonl', one
+            JSON object per line. Guessed from the file extension if None.
+
+    Yields:
+        dict: The rows.
+    """
+    fmt = fmt or _format(path)
+    with open(path, newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            yield from csv.DictReader(file)
+            return
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _format(path):
+    if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def _count_rows(path, fmt=None):
+    """Count the rows of a recipients file from its non blank lines, which
+    is exact unless CSV values span several lines.
+    """
+    count = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                count += 1
+    if (fmt or _format(path)) == 'csv':
+        count -= 1
+    return max(count, 0)
+
+
+def _transport(args, sender):
+    """Return the transport described by the command line arguments."""
+    if args.null:
+        return NullTransport()
+    if args.host:
+        config = Credentials(sender_email=args.user or sender,
+                             password=args.password, host=args.host,
+                             port=args.port)
+    else:
+        config = default_credentials()
+    return SMTPTransport(config, starttls=not args.no_tls,
+                         authenticate=not args.no_auth)
+
+
+def load_parser():
+    """Return: argparse.ArgumentParser: The parser of auto-emailer-load."""
+    parser = argparse.ArgumentParser(prog='auto-emailer-load',
+                                     description=_LOAD_DESCRIPTION)
+    _add_load_arguments(parser)
+    return parser
+
+
+def _add_load_arguments(parser):
+    _add_transport_arguments(parser)
+    group = parser.add_argument_group('load')
+    group.add_argument('--count', type=int, default=1000,
+                       help='Messages to send (default: %(default)s).')
+    group.add_argument('--duration', type=float,
+                       help='Stop after this many seconds instead.')
+    group.add_argument('--rate', type=float, default=0.0,
+                       help='Target messages per second, 0 for as fast as '
+                       'possible (default: %(default)s).')
+    group.add_argument('--concurrency', type=int, default=4,
+                       help='Sessions sending at once (default: '
+                       '%(default)s).')
+    group = parser.add_argument_group('messages')
+    group.add_argument('--sender', default='load@example.com',
+                       help='Sender address (default: %(default)s).')
+    group.add_argument('--domain', default='example.com',
+                       help='Domain of the synthetic recipients (default: '
+                       '%(default)s).')
+    group.add_argument('--recipients', type=int, default=1,
+                       help='Recipients per message (default: %(default)s).')
+    group.add_argument('--body-size', type=int, default=2000,
+                       help='Bytes of body text (default: %(default)s).')
+    group.add_argument('--attachment-size', type=int, action='append',
+                       default=[], metavar='BYTES',
+                       help='Attach a file of this size; may be repeated.')
+    group = parser.add_argument_group('output')
+    group.add_argument('--interval', type=float, default=1.0,
+                       help='Seconds between progress lines, 0 for none '
+                       '(default: %(default)s).')
+    group.add_argument('--json', metavar='PATH',
+                       help='Write the summary to PATH instead of standard '
+                       'output.')
+
+
+def _attachments(directory, sizes):
+    """Write files of random bytes of the given sizes into `directory`."""
+    paths = []
+    for index, size in enumerate(sizes):
+        path = os.path.join(directory, 'attachment{}.bin'.format(index))
+        with open(path, 'wb') as file:
+            file.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def _report(stats, start, interval, stop, out):
+    """Print a progress line every `interval` seconds until `stop` is set."""
+    previous = 0
+    while not stop.wait(interval):
+        window = stats.window()
+        sent = stats.sent
+        line = '{:8.1f}s sent {} failed {} | {:.1f} msg/s'.format(
+            time.perf_counter() - start, sent, stats.failed,
+            (sent - previous) / interval)
+        previous = sent
+        if window:
+            line += ' | p50 {:.1f}ms p90 {:.1f}ms p99 {:.1f}ms'.format(
+                *(percentile(window, fraction) * 1000
+                  for fraction in (0.5, 0.9, 0.99)))
+        print(line, file=out, flush=True)
+
+
+def run_load(args, out=None):
+    """Run a load test.
+
+    Args:
+        args (argparse.Namespace): Arguments parsed by :func:`load_parser`.
+        out (Optional[file]): Where progress lines are printed. Defaults
+            to standard error.
+
+    Returns:
+        auto_emailer.cli.LoadStats: The outcome.
+    """
+    out = out or sys.stderr
+    transport = _transport(args, args.sender)
+    directory = tempfile.mkdtemp(prefix='auto-emailer-load-')
+    attach_files = _attachments(directory, args.attachment_size)
+    # one body, the cost of building it is not part of the test
+    body = ''.join(random.choice(string.ascii_letters + ' \n')
+                   for _ in range(args.body_size))
+    stats = LoadStats()
+    pool = SessionPool(transport)
+    slots = threading.BoundedSemaphore(args.concurrency)
+    executor = concurrent.futures.ThreadPoolExecutor(args.concurrency)
+    stop = threading.Event()
+
+    def send(index):
+        try:
+            recipients = ['load{}.{}@{}'.format(index, number, args.domain)
+                          for number in range(args.recipients)]
+            message = Message(args.sender, recipients,
+                              'Load test {}'.format(index))
+            data = message.draft_message(text=body).attach(
+                attach_files).as_bytes()
+            begin = time.perf_counter()
+            with pool.session() as session:
+                deliver(session, data, args.sender, recipients)
+            stats.record(len(data), time.perf_counter() - begin)
+        except Exception as error:
+            stats.record_failure(error)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    reporter = None
+    if args.interval > 0:
+        reporter = threading.Thread(
+            target=_report, args=(stats, start, args.interval, stop, out),
+            daemon=True)
+        reporter.start()
+    try:
+        index = 0
+        while True:
+            now = time.perf_counter()
+            if args.duration is not None:
+                if now - start >= args.duration:
+                    break
+            elif index >= args.count:
+                break
+            if args.rate > 0:
+                # pace against the schedule, not the previous send
+                due = start + index / args.rate
+                if due > now:
+                    time.sleep(due - now)
+            slots.acquire()
+            executor.submit(send, index)
+            index += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=True)
+        stats.seconds = time.perf_counter() - start
+        stop.set()
+        if reporter is not None:
+            reporter.join()
+        pool.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return stats
+
+
+def load_main(argv=None):
+    """Entry point of the auto-emailer-load command.
+
+    Args:
+        argv (Optional[Sequence[str]]): The arguments, without the program
+            name. Defaults to sys.argv.
+
+    Returns:
+        int: Exit status, 1 if any message failed.
+    """
+    return _load(load_parser().parse_args(argv))
+
+
+def _load(args):
+    stats = run_load(args)
+    summary = stats.as_dict()
+    summary['options'] = {'count': args.count,
+                          'duration': args.duration,
+                          'rate': args.rate,
+                          'concurrency': args.concurrency,
+                          'recipients': args.recipients,
+                          'body_size': args.body_size,
+                          'attachment_sizes': args.attachment_size}
+    text = json.dumps(summary, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    return 1 if stats.failed else 0
+
+
+def _duration(seconds):
+    """Format seconds as H:MM:SS."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+def progress_line(report, total, elapsed):
+    """Describe the progress of a campaign.
+
+    Args:
+        report (auto_emailer.bulk.SendReport): The report of the run.
+        total (int): Number of rows of the campaign.
+        elapsed (float): Seconds since the start.
+
+    Returns:
+        str: Rows done, outcome counts, rate and estimated time left.
+    """
+    done = report.sent + report.failed + report.skipped
+    # skipped rows cost nothing, they would make the estimate optimistic
+    rate = (report.sent + report.failed) / elapsed if elapsed else 0.0
+    eta = '-:--:--'
+    if rate:
+        eta = _duration(max(total - done, 0) / rate)
+    return '{}/{} sent {} skipped {} failed {} | {:.1f} msg/s | ETA {}'.format(
+        done, total, report.sent, report.skipped, report.failed, rate, eta)
+
+
+def send_parser(parser=None):
+    """Return the parser of auto-emailer send.
+
+    Args:
+        parser (Optional[argparse.ArgumentParser]): Parser to add the
+            arguments to. A new one is created if None.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='auto-emailer send',
+                                         description=_SEND_DESCRIPTION)
+    parser.add_argument('template', help='Body template, formatted with '
+                        'the values of each row.')
+    parser.add_argument('recipients', help='CSV file with a header line, or '
+                        'JSONL file, with a row per recipient.')
+    parser.add_argument('--subject', required=True, help='Subject.')
+    parser.add_argument('--sender', help='Sender address. Defaults to the '
+                        'user of the credentials.')
+    parser.add_argument('--attach', action='append', default=[],
+                        metavar='PATH', help='Attach a file; may be '
+                        'repeated.')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='Format of the recipients file. Guessed from '
+                        'its extension by default.')
+    parser.add_argument('--address-key', default='email',
+                        help='Column of the recipient addresses (default: '
+                        '%(default)s).')
+    parser.add_argument('--campaign', help='Name of the campaign in the '
+                        'journal. Defaults to the subject.')
+    parser.add_argument('--journal', metavar='PATH', help='Journal of the '
+                        'delivered recipients. Defaults to the recipients '
+                        'file with a .journal suffix.')
+    parser.add_argument('--workers', type=int, help='Render processes. '
+                        'Defaults to the number of CPUs.')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Sessions sending at once (default: '
+                        '%(default)s).')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between progress updates, 0 for none '
+                        '(default: %(default)s).')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the summary to PATH as JSON.')
+    _add_transport_arguments(parser)
+    return parser
+
+
+def run_send(args, out=None):
+    """Send a campaign.
+
+    Ctrl-C stops reading the recipients; the messages already rendered are
+    still sent and journaled. A second Ctrl-C exits at once.
+
+    Args:
+        args (argparse.Namespace): Arguments parsed by :func:`send_parser`.
+        out (Optional[file]): Where progress and the summary are printed.
+            Defaults to standard error.
+
+    Returns:
+        int: Exit status: 0 if every row was sent or skipped, 1 if some
+        failed or the run stopped on an error, 130 if interrupted.
+    """
+    out = out or sys.stderr
+    transport = _transport(args, args.sender)
+    sender = args.sender
+    if sender is None and not args.null:
+        sender = transport.config.sender_email
+    if sender is None:
+        print('auto-emailer send: --sender is required', file=out)
+        return 2
+    total = _count_rows(args.recipients, args.format)
+    journal_path = args.journal or args.recipients + '.journal'
+    pipeline = Pipeline(transport, workers=args.workers,
+                        senders=args.concurrency)
+    outcome = {}
+    interrupted = False
+    overwrite = out.isatty() if hasattr(out, 'isatty') else False
+
+    with SendJournal(journal_path) as journal:
+        def run():
+            try:
+                outcome['report'] = pipeline.run(
+                    read_recipients(args.recipients, args.format), sender,
+                    args.subject, template_path=args.template,
+                    attach_files=args.attach or None,
+                    address_key=args.address_key, journal=journal,
+                    campaign=args.campaign or args.subject)
+            except Exception as error:
+                outcome['error'] = error
+            finally:
+                finished.set()
+
+        # waiting on an event, an interrupted Thread.join may leave the
+        # thread looking finished
+        finished = threading.Event()
+        start = time.perf_counter()
+        threading.Thread(target=run, daemon=True).start()
+        while not finished.is_set():
+            try:
+                finished.wait(args.interval or None)
+            except KeyboardInterrupt:
+                if interrupted:
+                    raise
+                interrupted = True
+                pipeline.stop()
+                print('\nInterrupted, sending the messages in flight. '
+                      'Press Ctrl-C again to quit at once.', file=out)
+                continue
+            if args.interval and pipeline.report is not None:
+                line = progress_line(pipeline.report, total,
+                                     time.perf_counter() - start)
+                print(line, end='\r' if overwrite else '\n', file=out,
+                      flush=True)
+    if overwrite:
+        print(file=out)
+
+    report = outcome.get('report') or pipeline.report
+    error = outcome.get('error')
+    if report is None:
+        # stopped before the first row, for example without a template
+        print('auto-emailer send: {}'.format(error), file=out)
+        return 1
+    _summary(report, error, journal_path,
+             interrupted or error is not None or report.failed, out)
+    if args.json:
+        summary = report.as_dict()
+        summary['interrupted'] = interrupted
+        summary['error'] = None if error is None else repr(error)
+        with open(args.json, 'w') as file:
+            json.dump(summary, file, indent=2, sort_keys=True)
+            file.write('\n')
+    if interrupted:
+        return 130
+    return 1 if report.failed or error is not None else 0
+
+
+def _summary(report, error, journal_path, unfinished, out):
+    print('Sent {}, skipped {}, failed {} in {} ({:.1f} msg/s)'.format(
+        report.sent, report.skipped, report.failed,
+        _duration(report.seconds), report.throughput), file=out)
+    for name, count in sorted(report.errors.items()):
+        print('  {}: {}'.format(name, count), file=out)
+    if report.missing_keys:
+        print('  missing template values: {}'.format(', '.join(
+            '{} ({})'.format(key, count)
+            for key, count in sorted(report.missing_keys.items()))),
+            file=out)
+    if error is not None:
+        print('Stopped by {}: {}'.format(type(error).__name__, error),
+              file=out)
+    if unfinished:
+        print('Delivered recipients are recorded in {}; run the same '
+              'command again to resume.'.format(journal_path), file=out)
+
+
+def main(argv=None):
+    """Entry point of the auto-emailer command and its subcommands.
+
+    Args:
+        argv (Optional[Sequence[str]]): The arguments, without the program
+            name. Defaults to sys.argv.
+
+    Returns:
+        int: Exit status of the subcommand.
+    """
+    parser = argparse.ArgumentParser(prog='auto-emailer')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    send_parser(commands.add_parser('send', help=_SEND_DESCRIPTION,
+                                    description=_SEND_DESCRIPTION))
+    _add_load_arguments(commands.add_parser('load', help=_LOAD_DESCRIPTION,
+                                            description=_LOAD_DESCRIPTION))
+    args = parser.parse_args(argv)
+    if args.command == 'send':
+        return run_send(args)
+    return _load(args)
@@ -0,0 +1,244 @@
+"""Adaptive control of the number of concurrent SMTP sessions.
+
+:class:`AIMDController` behaves like TCP congestion control: the window of
+in-flight sends grows additively while the send latency stays close to the
+best latency seen, and is cut multiplicatively as soon as the server pushes
+back with a 421 or 451 reply or drops the connection. :class:`SessionPool`
+keeps the open sessions those sends run on.
+"""
+import contextlib
+import smtplib
+import threading
+import time
+
+from . import metrics
+
+CONGESTION_CODES = (421, 451)
+"""SMTP reply codes telling the client to back off and try again later."""
+
+
+def is_congestion(error):
+    """Return True if an exception means the server is overloaded.
+
+    Args:
+        error (Exception): An exception raised while sending.
+
+    Returns:
+        bool: If the sender should slow down.
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in CONGESTION_CODES
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code in CONGESTION_CODES
+                   for code, _ in error.recipients.values())
+    return False
+
+
+class AIMDController:
+    """Additive increase, multiplicative decrease concurrency window."""
+
+    def __init__(self, initial=1, minimum=1, maximum=32, increase=1.0,
+                 decrease=0.5, latency_tolerance=1.5, smoothing=0.2):
+        """
+        Args:
+            initial (int): Window to start with.
+            minimum (int): Smallest window.
+            maximum (int): Largest window.
+            increase (float): Window growth per window's worth of fast
+                sends, so about `increase` per round trip.
+            decrease (float): Factor applied to the window on congestion.
+            latency_tolerance (float): How many times the best latency the
+                smoothed latency may reach and still let the window grow.
+            smoothing (float): Weight of a new sample in the moving average
+                of the latency.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.congestion_events = 0
+        self._window = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._latency = None
+        self._baseline = None
+        self._last_cut = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def window(self):
+        """int: Number of sends currently allowed in flight."""
+        return int(self._window)
+
+    @property
+    def in_flight(self):
+        """int: Number of sends currently in flight."""
+        return self._in_flight
+
+    @property
+    def latency(self):
+        """Optional[float]: Moving average of the send latency, seconds."""
+        return self._latency
+
+    def acquire(self):
+        """Block until the window has room for one more send."""
+        with self._condition:
+            while self._in_flight >= int(self._window):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        """Give back a slot taken with :meth:`acquire`."""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def record_success(self, latency):
+        """Feed the latency of a completed send to the controller.
+
+        Args:
+            latency (float): Seconds the send took.
+        """
+        with self._condition:
+            if self._latency is None:
+                self._latency = self._baseline = latency
+            else:
+                self._latency += self.smoothing * (latency - self._latency)
+                # let the baseline drift up so a lasting shift is accepted
+                self._baseline = min(self._latency, self._baseline * 1.01)
+            if self._latency <= self._baseline * self.latency_tolerance:
+                self._window = min(self.maximum,
+                                   self._window + self.increase / self._window)
+                self._condition.notify_all()
+
+    def record_congestion(self):
+        """Cut the window after a congestion signal from the server.
+
+        Signals arriving within one latency period of the previous cut
+        belong to the same event and are ignored.
+        """
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_cut < (self._latency or 0.0):
+                return
+            self._last_cut = now
+            self.congestion_events += 1
+            self._window = max(self.minimum, self._window * self.decrease)
+
+    @contextlib.contextmanager
+    def measure(self):
+        """Time the body as one send, feed its outcome to the controller and
+        release the slot taken with :meth:`acquire`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as error:
+            if is_congestion(error):
+                self.record_congestion()
+            raise
+        else:
+            self.record_success(time.perf_counter() - start)
+        finally:
+            self.release()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Acquire a slot and :meth:`measure` the body."""
+        self.acquire()
+        with self.measure():
+            yield
+
+
+# refusals of a message that leave its session usable for the next one
+_MESSAGE_REFUSED = (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                    smtplib.SMTPSenderRefused)
+
+
+class SessionPool:
+    """Open sessions spawned from a transport, reused across sends.
+
+    Transports that are safe to share (whose
+    :meth:`~auto_emailer.transport.Transport.spawn` returns themselves)
+    are handed out to every caller as is.
+    """
+
+    def __init__(self, transport):
+        """
+        Args:
+            transport (auto_emailer.transport.Transport): Transport sessions
+                are spawned from.
+        """
+        self._transport = transport
+        self._idle = []
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.created = 0
+        metrics.SESSIONS.track(self)
+
+    @contextlib.contextmanager
+    def session(self):
+        """Borrow an open session.
+
+        A session that failed to open, or whose send failed with anything
+        but a definitive refusal of the message, is closed instead of being
+        returned to the pool.
+
+        Yields:
+            auto_emailer.transport.Transport: The session.
+        """
+        with self._lock:
+            session = self._idle.pop() if self._idle else None
+        if session is None:
+            session = self._transport.spawn()
+            if session is not self._transport:
+                with self._lock:
+                    self.sessions += 1
+                    self.created += 1
+                if metrics.ENABLED:
+                    metrics.SESSIONS_CREATED.inc()
+        try:
+            session.open()
+        except Exception:
+            # a refused login or EHLO, the session is not usable
+            self._discard(session)
+            raise
+        try:
+            yield session
+        except Exception as error:
+            refused = (isinstance(error, _MESSAGE_REFUSED) and
+                       not is_congestion(error))
+            if refused:
+                self._put(session)
+            else:
+                self._discard(session)
+            raise
+        else:
+            self._put(session)
+
+    def _put(self, session):
+        if session is not self._transport:
+            with self._lock:
+                self._idle.append(session)
+
+    def _discard(self, session):
+        if session is self._transport:
+            return
+        with self._lock:
+            self.sessions -= 1
+        try:
+            session.close()
+        except (OSError, smtplib.SMTPException):
+            pass
+
+    def close(self):
+        """Close every idle session, and the shared transport if used."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.sessions -= len(idle)
+        for session in idle:
+            session.close()
+        self._transport.close()
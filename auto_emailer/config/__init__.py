@@ -1,5 +1,7 @@
 """AutoEmailer Config Library for Python."""
 
 from .credentials import Credentials
+from .rotation import CredentialSource
+from .rotation import FileCredentialSource
 from auto_emailer.config import environment_vars
 from .default import default_credentials
@@ -45,9 +45,13 @@ def _get_explicit_environ_credentials():
             set to None. Specifically checks, `EMAILER_SENDER` and
             `EMAILER_PASSWORD`.
     """
-    #  check if there are ANY environment variables set
-    if not any(env_vars.startswith('EMAILER') for env_vars
-               in os.environ.keys()):
+    #  check if there are ANY credentials environment variables set, other
+    #  EMAILER_ variables such as EMAILER_PROFILE do not count
+    if not any(env_var in os.environ for env_var
+               in (environment_vars.EMAILER_SENDER,
+                   environment_vars.EMAILER_PASSWORD,
+                   environment_vars.EMAILER_HOST,
+                   environment_vars.EMAILER_PORT)):
         return None
 
     # build environment variables into dict
@@ -27,3 +27,15 @@ EMAILER_PORT = 'EMAILER_PORT'
 """Environment variable providing the value of auto-emailer's config 
 attribute `EMAILER_PORT`.
 """
+
+EMAILER_PROFILE = 'EMAILER_PROFILE'
+"""Environment variable enabling the profiling mode of auto-emailer.
+
+Set it to the file path the profiling report is written to at exit, or to
+`-` for standard error. See :mod:`auto_emailer.profiling`.
+"""
+
+EMAILER_PROFILE_RATE = 'EMAILER_PROFILE_RATE'
+"""Environment variable providing the fraction of calls profiled with
+cProfile when `EMAILER_PROFILE` is set. Defaults to 0.01.
+"""
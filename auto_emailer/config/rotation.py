@@ -0,0 +1,157 @@
+"""Credentials that can be rotated while messages are being sent.
+
+A :class:`CredentialSource` stands in for a
+:class:`auto_emailer.config.credentials.Credentials` wherever a transport
+is configured. It asks a provider for the credentials at most once per
+`interval`, and every new SMTP session logs in with the credentials current
+at the time. Sessions that are already logged in keep sending until they are
+closed, so a rotated password takes effect without stopping the workers::
+
+    source = FileCredentialSource()  # the EMAILER_CREDS file
+    emailer = Emailer(config=source)
+"""
+import os
+import threading
+import time
+
+from auto_emailer.config import environment_vars
+from auto_emailer.config.credentials import Credentials
+
+
+def _fields(credentials):
+    return (credentials.sender_email, credentials.password,
+            credentials.host, credentials.port)
+
+
+class CredentialSource:
+    """Credentials polled from a provider callable."""
+
+    def __init__(self, provider, interval=60.0):
+        """
+        Args:
+            provider (Callable[[], Credentials]): Returns the credentials to
+                use from now on.
+            interval (float): Seconds between two calls of `provider`.
+
+        Raises:
+            Exception: Whatever `provider` raises on the first call.
+        """
+        self._provider = provider
+        self.interval = interval
+        self.rotations = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._credentials = provider()
+        self._next_poll = time.monotonic() + interval
+
+    def current(self):
+        """Return the credentials new sessions should log in with.
+
+        The provider is polled if the interval elapsed. While a poll is in
+        progress other threads get the previous credentials instead of
+        waiting, and if the provider raises they are kept until the next
+        poll, whatever the error.
+
+        Returns:
+            auto_emailer.config.credentials.Credentials: The credentials.
+        """
+        if time.monotonic() >= self._next_poll:
+            self._poll(blocking=False)
+        return self._credentials
+
+    def refresh(self):
+        """Poll the provider now, for example after a login was refused.
+
+        Returns:
+            bool: If the credentials changed.
+        """
+        return self._poll(blocking=True)
+
+    def _poll(self, blocking):
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            self._next_poll = time.monotonic() + self.interval
+            try:
+                credentials = self._load()
+            except Exception:
+                # a provider may fail in any way, sending goes on with the
+                # last good credentials
+                self.errors += 1
+                return False
+            if (credentials is None or
+                    _fields(credentials) == _fields(self._credentials)):
+                return False
+            self._credentials = credentials
+            self.rotations += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        """Return the latest credentials, or None if they did not change."""
+        return self._provider()
+
+    # the attributes of the current credentials, so that a source can be
+    # used wherever Credentials are read
+
+    @property
+    def sender_email(self):
+        """User name for SMTP client."""
+        return self.current().sender_email
+
+    @property
+    def password(self):
+        """Password for SMTP client."""
+        return self.current().password
+
+    @property
+    def port(self):
+        """Port where SMTP server is listening."""
+        return self.current().port
+
+    @property
+    def host(self):
+        """SMTP server host name."""
+        return self.current().host
+
+
+class FileCredentialSource(CredentialSource):
+    """Credentials read from a JSON file, reloaded when it is modified."""
+
+    def __init__(self, path=None, interval=5.0):
+        """
+        Args:
+            path (Optional[str]): Path of the credentials JSON file, in the
+                format of Credentials.from_authorized_user_file. Defaults to
+                the `EMAILER_CREDS` environment variable.
+            interval (float): Seconds between two checks of the file
+                modification time.
+
+        Raises:
+            EnvironmentError: If `path` is None and `EMAILER_CREDS` is not
+                set.
+            ValueError: If the file is not valid credentials.
+        """
+        if path is None:
+            path = os.environ.get(environment_vars.EMAILER_CREDS)
+            if path is None:
+                raise EnvironmentError('FileCredentialSource needs a path or '
+                                       'the {} environment variable.'
+                                       .format(environment_vars.EMAILER_CREDS))
+        self.path = path
+        self._mtime = None
+        super().__init__(self._read, interval)
+
+    def _read(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        credentials = Credentials.from_authorized_user_file(self.path)
+        self._mtime = mtime
+        return credentials
+
+    def _load(self):
+        if os.stat(self.path).st_mtime_ns == self._mtime:
+            return None
+        # a file caught half written fails to parse and is read again at
+        # the next poll, its modification time is only kept once parsed
+        return self._read()
@@ -0,0 +1,299 @@
+"""Priority lanes for sending urgent mail ahead of bulk campaigns.
+
+A :class:`Dispatcher` runs a few worker threads over a shared
+:class:`~auto_emailer.concurrency.SessionPool`. Messages are queued in named
+lanes and workers pick the next message with stride scheduling, so that each
+lane gets a share of the sessions proportional to its weight while it has
+work queued. A password reset queued behind a 100k campaign therefore waits
+for about one send, not for the whole campaign::
+
+    dispatcher = Dispatcher(emailer.transport)
+    dispatcher.submit(reset_message, lane=TRANSACTIONAL)
+    for message in campaign:
+        dispatcher.submit(message, lane=BULK)
+
+Every lane measures the time from submission to delivery; a lane with a
+latency SLO also reports how often it was met. Both are exported as
+:mod:`~auto_emailer.metrics` labelled with the lane name, once the metrics
+are enabled. With `max_queue`, the number
+of queued messages is bounded and :meth:`Dispatcher.submit` either blocks
+until there is room or raises :class:`queue.Full`.
+"""
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+
+from . import metrics
+from .bulk import deliver
+from .concurrency import SessionPool
+
+TRANSACTIONAL = 'transactional'
+"""Name of the default high priority lane."""
+
+BULK = 'bulk'
+"""Name of the default low priority lane."""
+
+_Item = collections.namedtuple('_Item',
+                               'message from_addr to_addrs future enqueued')
+
+
+class Lane:
+    """A queue of messages with a scheduling weight and a latency SLO."""
+
+    def __init__(self, name, weight=1, slo=None, samples=1024):
+        """
+        Args:
+            name (str): Name messages are submitted to the lane with.
+            weight (float): Share of the sessions relative to other lanes.
+            slo (Optional[float]): Target seconds from submission to
+                delivery.
+            samples (int): Number of recent latencies kept for percentiles.
+        """
+        self.name = name
+        self.weight = weight
+        self.slo = slo
+        self.queue = collections.deque()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.slo_met = 0
+        self.latencies = collections.deque(maxlen=samples)
+        self._pass = 0.0
+
+    def record(self, latency):
+        """Record the submission to delivery latency of a message.
+
+        Args:
+            latency (float): Seconds.
+        """
+        self.completed += 1
+        self.latencies.append(latency)
+        met = self.slo is not None and latency <= self.slo
+        if met:
+            self.slo_met += 1
+        if metrics.ENABLED:
+            metrics.LANE_SECONDS.labels(self.name).observe(latency)
+            if met:
+                metrics.LANE_SLO_MET.labels(self.name).inc()
+
+    def record_failure(self):
+        """Record a message that could not be delivered."""
+        self.failed += 1
+        if metrics.ENABLED:
+            metrics.LANE_FAILED.labels(self.name).inc()
+
+    def percentile(self, fraction):
+        """Return the latency below which `fraction` of the recent
+        messages were delivered, or None before any delivery.
+
+        Args:
+            fraction (float): Between 0 and 1.
+
+        Returns:
+            Optional[float]: Seconds.
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(fraction * len(ordered)))
+        return ordered[index]
+
+    def metrics(self):
+        """Return: dict: Queue depth, counts, latency percentiles and SLO
+        attainment of the lane.
+        """
+        return {'queued': len(self.queue),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99),
+                'slo': self.slo,
+                'slo_attainment': (self.slo_met / self.completed
+                                   if self.slo is not None and self.completed
+                                   else None)}
+
+
+class Dispatcher:
+    """Send messages from prioritized lanes over a shared session pool."""
+
+    def __init__(self, transport, lanes=None, workers=4, max_queue=None,
+                 overflow='block'):
+        """
+        Args:
+            transport (auto_emailer.transport.Transport): Transport sessions
+                are spawned from.
+            lanes (Optional(Sequence[Lane])): The lanes, the first one being
+                the default. Defaults to a TRANSACTIONAL lane with weight 8
+                and a 1 second SLO, and a BULK lane with weight 1.
+            workers (int): Number of sending threads, and so of sessions.
+            max_queue (Optional[int]): Most messages queued across every
+                lane. Unbounded if None.
+            overflow (str): What :meth:`submit` does when the queue is
+                full, either 'block' until a worker takes a message or
+                'raise' :class:`queue.Full`.
+
+        Raises:
+            ValueError: If overflow is neither 'block' nor 'raise'.
+        """
+        if overflow not in ('block', 'raise'):
+            raise ValueError("overflow must be 'block' or 'raise', not {!r}."
+                             .format(overflow))
+        if lanes is None:
+            lanes = [Lane(TRANSACTIONAL, weight=8, slo=1.0),
+                     Lane(BULK, weight=1)]
+        self.lanes = collections.OrderedDict((lane.name, lane)
+                                             for lane in lanes)
+        self.pool = SessionPool(transport)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self._queued = 0
+        lock = threading.Lock()
+        self._condition = threading.Condition(lock)
+        self._space = threading.Condition(lock)
+        self._shutdown = False
+        self._virtual_time = 0.0
+        self._threads = [threading.Thread(target=self._work,
+                                          name='auto_emailer-dispatch-{}'
+                                          .format(index),
+                                          daemon=True)
+                         for index in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        metrics.QUEUE_DEPTH.track(self)
+
+    def submit(self, message, from_addr=None, to_addrs=None, lane=None,
+               timeout=None):
+        """Queue a message for delivery.
+
+        Args:
+            message (Union[auto_emailer.emailer.Message, bytes, str]): The
+                message.
+            from_addr (Optional[str]): The envelope sender.
+            to_addrs (Optional(Sequence[str])): The envelope recipients.
+            lane (Optional[str]): Name of the lane. Defaults to the first.
+            timeout (Optional[float]): Most seconds to block for room in a
+                full queue. Forever if None.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the number of bytes
+            delivered, or to the exception that stopped the delivery.
+
+        Raises:
+            ValueError: If the lane does not exist.
+            RuntimeError: If the dispatcher was shut down.
+            queue.Full: If the queue is full and overflow is 'raise', or
+                stayed full for `timeout` seconds.
+        """
+        target = self._lane(lane)
+        future = concurrent.futures.Future()
+        with self._condition:
+            if not self._space.wait_for(self._has_space, timeout):
+                raise queue.Full('{} messages are already queued.'
+                                 .format(self._queued))
+            if self._shutdown:
+                raise RuntimeError('Cannot submit after shutdown.')
+            if not target.queue:
+                # an idle lane does not bank credit while it has no work
+                target._pass = max(target._pass, self._virtual_time)
+            target.queue.append(_Item(message, from_addr, to_addrs, future,
+                                      time.perf_counter()))
+            target.submitted += 1
+            self._queued += 1
+            self._condition.notify()
+        return future
+
+    def _has_space(self):
+        """Return True if a message may be queued now, raising queue.Full
+        if it may not and overflow is 'raise'. Called with the lock held.
+        """
+        if (self._shutdown or self.max_queue is None or
+                self._queued < self.max_queue):
+            return True
+        if self.overflow == 'raise':
+            raise queue.Full('{} messages are already queued.'
+                             .format(self._queued))
+        return False
+
+    def _lane(self, name):
+        if name is None:
+            return next(iter(self.lanes.values()))
+        try:
+            return self.lanes[name]
+        except KeyError:
+            raise ValueError('Unknown lane {!r}, expected one of {}.'
+                             .format(name, ', '.join(self.lanes)))
+
+    def _next(self):
+        """Pop the next item with stride scheduling, or return None once
+        shut down and drained. Called with the condition held.
+        """
+        while True:
+            ready = [lane for lane in self.lanes.values() if lane.queue]
+            if ready:
+                lane = min(ready, key=lambda lane: lane._pass)
+                self._virtual_time = lane._pass
+                lane._pass += 1.0 / lane.weight
+                self._queued -= 1
+                self._space.notify()
+                return lane, lane.queue.popleft()
+            if self._shutdown:
+                return None
+            self._condition.wait()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                picked = self._next()
+            if picked is None:
+                return
+            lane, item = picked
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.pool.session() as session:
+                    size = deliver(session, item.message, item.from_addr,
+                                   item.to_addrs)
+            except Exception as error:
+                with self._condition:
+                    lane.record_failure()
+                item.future.set_exception(error)
+            else:
+                with self._condition:
+                    lane.record(time.perf_counter() - item.enqueued)
+                item.future.set_result(size)
+
+    def queue_depth(self):
+        """Return: int: Messages queued across every lane."""
+        with self._condition:
+            return self._queued
+
+    def metrics(self):
+        """Return: dict: :meth:`Lane.metrics` of every lane by name."""
+        with self._condition:
+            return {name: lane.metrics() for name, lane in self.lanes.items()}
+
+    def shutdown(self, wait=True, cancel=False):
+        """Stop accepting messages, deliver the queued ones and close the
+        sessions.
+
+        Args:
+            wait (bool): If True, block until the queues are drained.
+            cancel (bool): If True, cancel the queued messages instead of
+                delivering them. Messages being sent are still completed.
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel:
+                for lane in self.lanes.values():
+                    while lane.queue:
+                        lane.queue.popleft().future.cancel()
+                self._queued = 0
+            self._condition.notify_all()
+            self._space.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            self.pool.close()
@@ -0,0 +1,475 @@
+"""DKIM signing (RFC 6376) of serialized messages.
+
+A :class:`DKIMSigner` signs with rsa-sha256 and relaxed/relaxed
+canonicalization, in pure Python. The private key is parsed once per file,
+and the hash of the canonicalized body is cached by the body content, so a
+campaign sending the same body to many recipients canonicalizes and hashes
+it once; per recipient only the signed headers are hashed and signed::
+
+    signer = DKIMSigner('example.com', 'mail', '/path/to/private.pem')
+    message = Message(sender, destinations, subject, signer=signer)
+    message.draft_message(text='Hello')
+    message.as_bytes()  # starts with the DKIM-Signature header
+
+Publish :meth:`DKIMSigner.dns_record` as the TXT record of
+``<selector>._domainkey.<domain>``. :func:`verify` checks a signature
+against such a record.
+"""
+import base64
+import binascii
+import collections
+import functools
+import hashlib
+import os
+import re
+import threading
+import time
+
+DEFAULT_HEADERS = ('from', 'sender', 'reply-to', 'subject', 'date',
+                   'message-id', 'to', 'cc', 'mime-version', 'content-type',
+                   'content-transfer-encoding', 'in-reply-to', 'references')
+"""Header fields signed when present, lower case."""
+
+# DER encoding of the SHA-256 AlgorithmIdentifier for EMSA-PKCS1-v1_5
+_SHA256_PREFIX = binascii.unhexlify('3031300d060960864801650304020105000420')
+_RSA_OID = binascii.unhexlify('06092a864886f70d0101010500')
+
+_PEM = re.compile(rb'-----BEGIN ([A-Z ]+)-----(.*?)-----END \1-----',
+                  re.DOTALL)
+_LINE_ENDS = re.compile(rb'\r\n|\r|\n')
+_WSP = re.compile(rb'[ \t]+')
+_FWS = re.compile(rb'\s+')
+_BODY_SPLIT = re.compile(rb'\r?\n\r?\n')
+_B_TAG = re.compile(rb'(^|;)(\s*b\s*=)[^;]*')
+
+RSAKey = collections.namedtuple('RSAKey', 'n e d p q dp dq qinv')
+RSAKey.__doc__ = """The numbers of an RSA private key. Public keys only
+carry `n` and `e`, the other fields are None."""
+
+
+# DER ------------------------------------------------------------------------
+
+def _der_read(data, offset=0):
+    """Return the tag, contents and end offset of the DER element at
+    `offset`.
+    """
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = int.from_bytes(data[offset:offset + count], 'big')
+            offset += count
+    except IndexError:
+        raise ValueError('Truncated DER data.')
+    end = offset + length
+    if end > len(data):
+        raise ValueError('Truncated DER data.')
+    return tag, data[offset:end], end
+
+
+def _der_sequence(data):
+    """Return the contents of the elements of a DER SEQUENCE."""
+    tag, contents, _ = _der_read(data)
+    if tag != 0x30:
+        raise ValueError('Expected a DER SEQUENCE.')
+    elements = []
+    offset = 0
+    while offset < len(contents):
+        tag, value, offset = _der_read(contents, offset)
+        elements.append((tag, value))
+    return elements
+
+
+def _der_integers(data):
+    return [int.from_bytes(value, 'big') for tag, value
+            in _der_sequence(data) if tag == 0x02]
+
+
+def _der(tag, contents):
+    length = len(contents)
+    if length < 0x80:
+        header = bytes([tag, length])
+    else:
+        size = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+        header = bytes([tag, 0x80 | len(size)]) + size
+    return header + contents
+
+
+def _der_integer(value):
+    return _der(0x02, value.to_bytes(value.bit_length() // 8 + 1, 'big'))
+
+
+def parse_private_key(pem):
+    """Parse an unencrypted RSA private key in PEM form.
+
+    Args:
+        pem (Union[bytes, str]): A PKCS#1 (`RSA PRIVATE KEY`) or PKCS#8
+            (`PRIVATE KEY`) key.
+
+    Returns:
+        auto_emailer.dkim.RSAKey: The key.
+
+    Raises:
+        ValueError: If the key is not an unencrypted RSA key.
+    """
+    if isinstance(pem, str):
+        pem = pem.encode('ascii')
+    match = _PEM.search(pem)
+    if match is None:
+        raise ValueError('No PEM private key found.')
+    label, der = match.group(1), base64.b64decode(match.group(2))
+    if label == b'PRIVATE KEY':
+        # PrivateKeyInfo: version, algorithm, OCTET STRING of the key
+        elements = _der_sequence(der)
+        if len(elements) < 3 or _RSA_OID not in _der(0x30, elements[1][1]):
+            raise ValueError('Only RSA private keys are supported.')
+        der = elements[2][1]
+    elif label != b'RSA PRIVATE KEY':
+        raise ValueError('Unsupported PEM key type: {}.'
+                         .format(label.decode('ascii')))
+    numbers = _der_integers(der)
+    if len(numbers) < 9:
+        raise ValueError('Malformed RSA private key.')
+    return RSAKey(*numbers[1:9])
+
+
+@functools.lru_cache(maxsize=32)
+def _load_private_key(path, mtime):
+    with open(path, 'rb') as file:
+        return parse_private_key(file.read())
+
+
+def load_private_key(path):
+    """Return the RSA private key of a PEM file, parsed again only if the
+    file was modified since the last call.
+
+    Args:
+        path (str): File path of the key.
+
+    Returns:
+        auto_emailer.dkim.RSAKey: The key.
+    """
+    path = str(path)
+    return _load_private_key(path, os.stat(path).st_mtime_ns)
+
+
+def public_key_der(key):
+    """Return: bytes: The SubjectPublicKeyInfo DER of an RSA key."""
+    public = _der(0x30, _der_integer(key.n) + _der_integer(key.e))
+    return _der(0x30, _der(0x30, _RSA_OID) + _der(0x03, b'\x00' + public))
+
+
+def parse_public_key(der):
+    """Parse an RSA public key in SubjectPublicKeyInfo or PKCS#1 DER form.
+
+    Args:
+        der (bytes): The key.
+
+    Returns:
+        auto_emailer.dkim.RSAKey: The key, with only `n` and `e`.
+    """
+    elements = _der_sequence(der)
+    if elements and elements[0][0] == 0x30:
+        # SubjectPublicKeyInfo: algorithm, BIT STRING of the key
+        der = elements[1][1][1:]
+    n, e = _der_integers(der)[:2]
+    return RSAKey(n, e, None, None, None, None, None, None)
+
+
+def _size(key):
+    return (key.n.bit_length() + 7) // 8
+
+
+def rsa_sign(key, digest):
+    """Sign a SHA-256 digest with RSASSA-PKCS1-v1_5.
+
+    Args:
+        key (auto_emailer.dkim.RSAKey): The private key.
+        digest (bytes): The SHA-256 digest.
+
+    Returns:
+        bytes: The signature.
+    """
+    size = _size(key)
+    info = _SHA256_PREFIX + digest
+    encoded = (b'\x00\x01' + b'\xff' * (size - len(info) - 3) + b'\x00' +
+               info)
+    message = int.from_bytes(encoded, 'big')
+    # Chinese remainder theorem, about 3 times faster than pow(m, d, n)
+    m1 = pow(message, key.dp, key.p)
+    m2 = pow(message, key.dq, key.q)
+    h = (key.qinv * (m1 - m2)) % key.p
+    return (m2 + h * key.q).to_bytes(size, 'big')
+
+
+def rsa_verify(key, digest, signature):
+    """Return: bool: If `signature` is the RSASSA-PKCS1-v1_5 signature of
+    the SHA-256 `digest` by the private key of `key`.
+    """
+    size = _size(key)
+    if len(signature) != size:
+        return False
+    encoded = pow(int.from_bytes(signature, 'big'), key.e,
+                  key.n).to_bytes(size, 'big')
+    info = _SHA256_PREFIX + digest
+    return encoded == (b'\x00\x01' + b'\xff' * (size - len(info) - 3) +
+                       b'\x00' + info)
+
+
+def canonicalize_body(body):
+    """Return the relaxed canonical form of a message body.
+
+    Args:
+        body (bytes): The body, with any line endings.
+
+    Returns:
+        bytes: The canonical body.
+    """
+    body = _LINE_ENDS.sub(b'\r\n', body)
+    if body and not body.endswith(b'\r\n'):
+        body += b'\r\n'
+    body = _WSP.sub(b' ', body).replace(b' \r\n', b'\r\n')
+    body = body.rstrip(b'\r\n')
+    return body + b'\r\n' if body else b''
+
+
+def canonicalize_header(field):
+    """Return the relaxed canonical form of a header field.
+
+    Args:
+        field (bytes): The field, `Name: value`, possibly folded.
+
+    Returns:
+        bytes: The canonical field, with a trailing CRLF.
+    """
+    name, _, value = field.partition(b':')
+    value = _WSP.sub(b' ', _LINE_ENDS.sub(b'', value)).strip(b' ')
+    return name.strip().lower() + b':' + value + b'\r\n'
+
+
+def split_message(data):
+    """Split a serialized message into its header fields and body.
+
+    Args:
+        data (bytes): The message.
+
+    Returns:
+        Tuple[List[bytes], bytes, bytes]: The header fields, folding kept,
+        the body, and the line ending of the headers.
+    """
+    match = _BODY_SPLIT.search(data)
+    if match is None:
+        head, body = data, b''
+    else:
+        head, body = data[:match.start()], data[match.end():]
+    linesep = b'\r\n' if b'\r\n' in head else b'\n'
+    fields = []
+    for line in _LINE_ENDS.split(head):
+        if line[:1] in (b' ', b'\t') and fields:
+            fields[-1] += b'\r\n' + line
+        elif line:
+            fields.append(line)
+    return fields, body, linesep
+
+
+def _select(fields, names):
+    """Return the fields to hash for the `names` of an h= tag. Repeated
+    names take the instances of a field from the bottom up.
+    """
+    instances = collections.defaultdict(list)
+    for field in fields:
+        instances[field.partition(b':')[0].strip().lower()].append(field)
+    selected = []
+    for name in names:
+        found = instances.get(name.lower().encode('ascii'))
+        if found:
+            selected.append(found.pop())
+    return selected
+
+
+def _header_hash(selected, signature_field):
+    hasher = hashlib.sha256()
+    for field in selected:
+        hasher.update(canonicalize_header(field))
+    # the signature field itself, with an empty b= and no trailing CRLF
+    hasher.update(canonicalize_header(signature_field)[:-2])
+    return hasher.digest()
+
+
+def _tags(value):
+    tags = collections.OrderedDict()
+    for tag in value.split(b';'):
+        name, _, content = tag.partition(b'=')
+        if name.strip():
+            tags[name.strip().decode('ascii')] = content.strip()
+    return tags
+
+
+class DKIMSigner:
+    """Sign serialized messages for a domain and selector."""
+
+    def __init__(self, domain, selector, private_key, headers=DEFAULT_HEADERS,
+                 cache_size=256):
+        """
+        Args:
+            domain (str): Signing domain, the d= tag.
+            selector (str): Selector of the key, the s= tag.
+            private_key (Union[str, bytes, RSAKey]): File path of the PEM
+                private key, PEM bytes, or a parsed key.
+            headers (Sequence[str]): Header fields to sign when present.
+            cache_size (int): Most body hashes kept.
+
+        Raises:
+            ValueError: If the private key cannot be parsed.
+        """
+        self.domain = domain
+        self.selector = selector
+        if isinstance(private_key, RSAKey):
+            self.key = private_key
+        elif isinstance(private_key, bytes):
+            self.key = parse_private_key(private_key)
+        else:
+            self.key = load_private_key(private_key)
+        self.headers = tuple(name.lower() for name in headers)
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self._body_hashes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock cannot be pickled; worker processes start a fresh cache
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_body_hashes'] = collections.OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def dns_record(self):
+        """Return: str: The TXT record to publish at
+        `<selector>._domainkey.<domain>`.
+        """
+        return 'v=DKIM1; k=rsa; p={}'.format(
+            base64.b64encode(public_key_der(self.key)).decode('ascii'))
+
+    def body_hash(self, body):
+        """Return the base64 hash of the canonical body, cached by the
+        body content.
+
+        Args:
+            body (bytes): The body as serialized.
+
+        Returns:
+            bytes: The bh= value.
+        """
+        key = hashlib.blake2b(body, digest_size=16).digest()
+        with self._lock:
+            cached = self._body_hashes.get(key)
+            if cached is not None:
+                self._body_hashes.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+        digest = hashlib.sha256(canonicalize_body(body)).digest()
+        cached = base64.b64encode(digest)
+        with self._lock:
+            self._body_hashes[key] = cached
+            if len(self._body_hashes) > self.cache_size:
+                self._body_hashes.popitem(last=False)
+        return cached
+
+    def signature_field(self, data, timestamp=None):
+        """Return the DKIM-Signature header field of a message.
+
+        Args:
+            data (bytes): The serialized message.
+            timestamp (Optional[int]): The t= tag. Defaults to now.
+
+        Returns:
+            bytes: The folded field, without a trailing line ending, using
+            the line ending of the message headers.
+
+        Raises:
+            ValueError: If the message has no From header.
+        """
+        fields, body, linesep = split_message(data)
+        present = {field.partition(b':')[0].strip().lower().decode('ascii')
+                   for field in fields}
+        if 'from' not in present:
+            raise ValueError('DKIM signed messages need a From header.')
+        names = [name for name in self.headers if name in present]
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        field = ('DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed; '
+                 'd={}; s={};{} t={}; h={};{} bh={};{} b='
+                 .format(self.domain, self.selector, linesep.decode(),
+                         timestamp, ':'.join(names), linesep.decode(),
+                         self.body_hash(body).decode('ascii'),
+                         linesep.decode())).encode('ascii')
+        field = field.replace(linesep + b' ', linesep + b'\t')
+        digest = _header_hash(_select(fields, names), field)
+        signature = base64.b64encode(rsa_sign(self.key, digest))
+        folded = (linesep + b'\t').join(signature[index:index + 72]
+                                        for index in range(0, len(signature),
+                                                           72))
+        return field + folded
+
+    def sign(self, data, timestamp=None):
+        """Return a message with its DKIM-Signature header prepended.
+
+        Args:
+            data (bytes): The serialized message.
+            timestamp (Optional[int]): The t= tag. Defaults to now.
+
+        Returns:
+            bytes: The signed message.
+        """
+        linesep = split_message(data)[2]
+        return self.signature_field(data, timestamp) + linesep + data
+
+
+def verify(data, dns_record):
+    """Check the first DKIM signature of a message.
+
+    Args:
+        data (bytes): The signed message.
+        dns_record (Union[str, bytes]): The TXT record of the signing key,
+            as returned by :meth:`DKIMSigner.dns_record`.
+
+    Returns:
+        bool: If the body hash and the signature are valid.
+
+    Raises:
+        ValueError: If the message is not signed, or the signature uses an
+            unsupported algorithm or canonicalization.
+    """
+    if isinstance(dns_record, str):
+        dns_record = dns_record.encode('ascii')
+    fields, body, _ = split_message(data)
+    signatures = [field for field in fields
+                  if field.lower().startswith(b'dkim-signature:')]
+    if not signatures:
+        raise ValueError('The message has no DKIM-Signature header.')
+    field = signatures[0]
+    tags = _tags(_LINE_ENDS.sub(b'', field.partition(b':')[2]))
+    if (tags.get('a') != b'rsa-sha256' or
+            tags.get('c') != b'relaxed/relaxed'):
+        raise ValueError('Only rsa-sha256 with relaxed/relaxed '
+                         'canonicalization is supported.')
+
+    digest = hashlib.sha256(canonicalize_body(body)).digest()
+    if base64.b64decode(_FWS.sub(b'', tags['bh'])) != digest:
+        return False
+
+    names = [name.strip().decode('ascii')
+             for name in tags['h'].split(b':')]
+    others = [other for other in fields if other is not field]
+    name, _, value = field.partition(b':')
+    unsigned = name + b':' + _B_TAG.sub(rb'\1\2', value)
+    digest = _header_hash(_select(others, names), unsigned)
+    key = parse_public_key(base64.b64decode(
+        _FWS.sub(b'', _tags(dns_record)['p'])))
+    return rsa_verify(key, digest,
+                      base64.b64decode(_FWS.sub(b'', tags['b'])))
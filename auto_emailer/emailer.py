@@ -1,29 +1,102 @@
+import collections
+import copy
+import gzip
+import hashlib
+import binascii
+import io
+import mimetypes
+import mmap
 import os
+import re
+import threading
 import time
+import weakref
 
 import smtplib
 from pathlib import Path
 
-from email import encoders
+from email.generator import BytesGenerator
 from email.mime.base import MIMEBase
+from email.mime.image import MIMEImage
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from . import addresses
+from . import metrics
+from . import template
 from .config import credentials
 from .config import default_credentials
+from .config.rotation import CredentialSource
+from .transport import SMTPTransport
+from .transport import _wire_size
+
+# file types that are compressed already and gain nothing from gzip
+_COMPRESSED_EXTENSIONS = frozenset((
+    '.7z', '.bz2', '.docx', '.gif', '.gz', '.jpeg', '.jpg', '.mp3', '.mp4',
+    '.pdf', '.png', '.pptx', '.xlsx', '.xz', '.zip'))
+
+# base64 encodes 57 bytes per 76 character line; slices of whole lines and
+# whole pages can be encoded, and released from the mapping, one at a time
+_ENCODE_STEP = 57 * mmap.PAGESIZE * 16
+
+
+def _base64_lines(data):
+    """Return `data` base64 encoded in lines of 76 characters, as
+    `email.encoders.encode_base64` does, without copying it first.
+
+    The output is written into a buffer of its exact final size, one slice
+    of the input at a time. Slices of a memory map are dropped from the
+    mapping once encoded, where the platform allows it.
+
+    Args:
+        data (Union[bytes, mmap.mmap]): The raw content.
+
+    Returns:
+        str: The encoded content.
+    """
+    size = len(data)
+    lines, rest = divmod(size, 57)
+    output = bytearray(lines * 77 + ((rest + 2) // 3 * 4 + 1 if rest else 0))
+    view = memoryview(data)
+    written = 0
+    try:
+        for offset in range(0, size, _ENCODE_STEP):
+            end = min(offset + _ENCODE_STEP, size)
+            for start in range(offset, end, 57):
+                line = binascii.b2a_base64(view[start:min(start + 57, end)])
+                output[written:written + len(line)] = line
+                written += len(line)
+            if isinstance(data, mmap.mmap) and hasattr(data, 'madvise'):
+                data.madvise(mmap.MADV_DONTNEED, offset, end - offset)
+    finally:
+        view.release()
+    return output.decode('ascii')
 
 
 class Emailer:
     """Welcome to the auto-emailer to send all of your emails!"""
-    def __init__(self, config=None, delay_login=True):
+    def __init__(self, config=None, delay_login=True, transport=None,
+                 workers=4, max_queue=None, overflow='block'):
         """
         Args:
             config (Optional(config.credentials.Credentials)): The constructed
                 credentials. Can be None if environment variables are
-                configured.
+                configured, or if a `transport` is given. A
+                `config.rotation.CredentialSource` lets the credentials
+                rotate: new sessions log in with the current ones while
+                logged in sessions carry on.
             delay_login (bool): If True, no login attempt will be made until
                 send_mail is called. Otherwise, a login attempt will be made at
                 class initialization.
+            transport (Optional(auto_emailer.transport.Transport)): Where to
+                deliver messages. Defaults to an
+                `auto_emailer.transport.SMTPTransport` using `config`.
+            workers (int): Number of background sessions used by
+                Emailer.submit.
+            max_queue (Optional[int]): Most messages Emailer.submit may
+                queue. Unbounded if None.
+            overflow (str): Either 'block' or 'raise' `queue.Full` when
+                Emailer.submit finds the queue full.
 
         Raises:
             ValueError: If config is not in the expected format.
@@ -31,13 +104,14 @@ class Emailer:
                 variables are not found.
         """
         if (config is not None and
-                not isinstance(config, credentials.Credentials)):
+                not isinstance(config, (credentials.Credentials,
+                                        CredentialSource))):
             raise ValueError('Emailer class only supports credentials from '
                              'auto_emailer.config. See '
                              'auto_emailer.config.credentials and '
                              'auto_emailer.config.environment_vars for help on '
                              'authentication with auto-emailer library.')
-        elif config is None:
+        elif config is None and transport is None:
             try:
                 self._config = default_credentials()
             except EnvironmentError:
@@ -48,7 +122,13 @@ class Emailer:
         else:
             self._config = config
 
-        self._connected = False
+        if transport is None:
+            transport = SMTPTransport(self._config)
+        self._transport = transport
+        self._dispatch_options = {'workers': workers,
+                                  'max_queue': max_queue,
+                                  'overflow': overflow}
+        self._dispatcher = None
         if not delay_login:
             self._login()
 
@@ -56,29 +136,25 @@ class Emailer:
     def connected(self):
         """Return: bool: If SMTP client is logged in or not.
         """
-        return self._connected
+        return self._transport.connected
+
+    @property
+    def transport(self):
+        """Return: auto_emailer.transport.Transport: The delivery backend.
+        """
+        return self._transport
 
     def _logout(self):
         """Quits the connection to the smtp client."""
-        if self.connected:
-            try:
-                self._smtp.quit()
-            except smtplib.SMTPServerDisconnected:
-                pass
-        self._connected = False
+        self._transport.close()
 
     def _login(self):
-        """Uses the class attribute Emailer._config to connect
-        to SMTP client.
+        """(Re)opens the transport, which for the default
+        `auto_emailer.transport.SMTPTransport` connects and logs in
+        to the SMTP client with Emailer._config.
         """
-        self._smtp = smtplib.SMTP(host=self._config.host,
-                                  port=self._config.port)
-        # send 'hello' to SMTP server
-        self._smtp.ehlo()
-        # start TLS encryption
-        self._smtp.starttls()
-        self._smtp.login(self._config.sender_email, self._config.password)
-        self._connected = True
+        self._transport.close()
+        self._transport.open()
 
     def send_email(self, message, from_addr=None, to_addrs=None,
                    delay_send=0):
@@ -90,14 +166,11 @@ class Emailer:
         If the message is a string, the smtplib delivery method will
         use `smtplib.sendmail`.
 
-        If the message is an `auto_emailer.emailer.Message` object, the smtplib
-        delivery method will use `smtplib.send_message`. The message is
-        then converted to a bytestring and passes it to `smtplib.sendmail`.
-        The arguments are the same as for sendmail, except that message is
-        an `auto_emailer.emailer.Message` object. If from_addr is None or
-        to_addrs is None, these arguments are taken from the headers of the
-        message as described in RFC 2822 (a ValueError is raised if there is
-        more than one set of 'Resent-' headers).
+        If the message is an `auto_emailer.emailer.Message` object, it is
+        converted to a bytestring with Message.as_bytes, which is cached,
+        and passed to `smtplib.sendmail`. If from_addr is None or to_addrs
+        is None, these arguments are taken from the sender and recipients
+        of the message.
 
         Args:
             message (Union[auto_emailer.emailer.Message, str]): The message may
@@ -116,46 +189,271 @@ class Emailer:
             ValueError: If the message is not an auto_emailer.emailer.Message
                 object or a string.
         """
-        if not isinstance(message, Message) and isinstance(message, str):
-            smtp_meth = 'sendmail'
-            if (from_addr is None) or (to_addrs is None):
-                raise ValueError('If sending string email, please provide '
-                                 'from_addr and to_addrs.')
-        elif isinstance(message, Message):
-            smtp_meth = 'send_message'
-            message = message.message
-        else:
-            raise ValueError('The message argument must either be an '
-                             'auto_emailer.emailer.Message object or a string.')
+        self._check_message(message, from_addr, to_addrs)
+        if isinstance(message, Message):
+            # the bytes are cached, a retry does not serialize them again,
+            # and a DKIM signature only survives if the signed bytes are sent
+            from_addr = from_addr or message.sender
+            to_addrs = to_addrs or message.recipients
+            message = message.as_bytes()
+
+        # fail before connecting if the server is known to refuse the size;
+        # the transport keeps the size for its check before DATA
+        self._transport.check_size(message, from_addr)
 
         # delay sending by input value
         if delay_send:
             time.sleep(delay_send)
 
         # log in to email client if not already
-        if not self._connected:
+        if not self.connected:
             self._login()
 
         # handle disconnect and connection errors by
         # quick login and attempt to send again
         try:
-            delivery_meth = getattr(self._smtp, smtp_meth)
-            delivery_meth(msg=message, from_addr=from_addr,
-                          to_addrs=to_addrs)
+            self._transport.send(message, from_addr, to_addrs)
         except (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected):
+            if metrics.ENABLED:
+                metrics.RECONNECTS.inc()
             self._login()
-            # needs to call getattr() again once it hits
-            # here otherwise it will fail
-            delivery_meth = getattr(self._smtp, smtp_meth)
-            delivery_meth(msg=message, from_addr=from_addr,
-                          to_addrs=to_addrs)
+            self._transport.send(message, from_addr, to_addrs)
         finally:
             self._logout()
 
+    @staticmethod
+    def _check_message(message, from_addr, to_addrs):
+        """Raise ValueError if `message` cannot be sent as given."""
+        if not isinstance(message, Message) and isinstance(message, str):
+            if (from_addr is None) or (to_addrs is None):
+                raise ValueError('If sending string email, please provide '
+                                 'from_addr and to_addrs.')
+        elif not isinstance(message, Message):
+            raise ValueError('The message argument must either be an '
+                             'auto_emailer.emailer.Message object or a string.')
+
+    def submit(self, message, from_addr=None, to_addrs=None, callback=None,
+               lane=None):
+        """Queue an email message for delivery in the background and return
+        at once.
+
+        Messages are sent by a pool of worker threads over sessions that
+        stay logged in between messages, see
+        `auto_emailer.dispatch.Dispatcher`. The pool is started by the first
+        call and stopped by Emailer.shutdown.
+
+        Args:
+            message (Union[auto_emailer.emailer.Message, str]): The message,
+                as for Emailer.send_email.
+            from_addr (Optional[str]): The address sending the mail.
+            to_addrs (Optional(Sequence[str])): A list of addresses to
+                send the email to.
+            callback (Optional[Callable]): Called with the future once the
+                message is sent or failed.
+            lane (Optional[str]): Priority lane, `dispatch.TRANSACTIONAL`
+                (the default) or `dispatch.BULK`.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the number of bytes
+            sent, or to the exception that stopped the delivery.
+
+        Raises:
+            ValueError: If the message is not an auto_emailer.emailer.Message
+                object or a string with from_addr and to_addrs.
+            queue.Full: If the queue is full and overflow is 'raise'.
+            RuntimeError: If Emailer.shutdown was called.
+        """
+        self._check_message(message, from_addr, to_addrs)
+        if self._dispatcher is None:
+            # imported here, dispatch builds on this module through bulk
+            from . import dispatch
+            self._dispatcher = dispatch.Dispatcher(self._transport,
+                                                   **self._dispatch_options)
+        future = self._dispatcher.submit(message, from_addr, to_addrs,
+                                         lane=lane)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def shutdown(self, wait=True, cancel=False):
+        """Stop the background workers of Emailer.submit, after sending
+        the queued messages unless `cancel` is True.
+
+        Args:
+            wait (bool): If True, block until the queue is drained.
+            cancel (bool): If True, cancel the queued messages instead.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.shutdown(wait=wait, cancel=cancel)
+
+
+class _StableBoundaryGenerator(BytesGenerator):
+    """BytesGenerator deriving multipart boundaries from the content of
+    the parts, so that identical bodies serialize to identical bytes.
+    """
+
+    @classmethod
+    def _make_boundary(cls, text=None):
+        if isinstance(text, str):
+            text = text.encode('utf-8', 'surrogateescape')
+        boundary = '=' * 15 + hashlib.sha1(text or b'').hexdigest()[:20] + '=='
+        if text is None:
+            return boundary
+        candidate = boundary
+        counter = 0
+        while cls._compile_re('^--' + re.escape(candidate) + '(--)?$',
+                              re.MULTILINE).search(text):
+            candidate = '{}.{}'.format(boundary, counter)
+            counter += 1
+        return candidate
+
+
+class RenderCache:
+    """Serialized messages kept up to a memory budget, least recently used
+    first out.
+
+    Entries are keyed by message and hold a fingerprint of its headers and
+    parts; a message changed since it was serialized misses the cache. An
+    entry goes away with its message.
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        """
+        Args:
+            max_bytes (int): Most bytes of serialized messages kept.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        # reentrant, a collected message may drop its entry at any time
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, message, fingerprint):
+        """Return the cached bytes of `message`, or None.
+
+        Args:
+            message (auto_emailer.emailer.Message): The message.
+            fingerprint (tuple): Its current fingerprint.
+
+        Returns:
+            Optional[bytes]: The bytes, if serialized with this fingerprint.
+        """
+        key = weakref.ref(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, message, fingerprint, data):
+        """Cache the bytes of `message`, evicting the least recently used
+        entries beyond the budget. Messages larger than the budget are not
+        cached.
+
+        Args:
+            message (auto_emailer.emailer.Message): The message.
+            fingerprint (tuple): Its fingerprint when serialized.
+            data (bytes): The serialized message.
+        """
+        key = weakref.ref(message, self._discard)
+        with self._lock:
+            self._pop(key)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = (fingerprint, data)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    def _discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def as_dict(self):
+        """Return: dict: The counters as plain data."""
+        return {'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class InlineImage:
+    """An image shown inside HTML bodies, referenced as `cid:<cid>`.
+
+    The image is read and base64 encoded once, and the same MIME part is
+    shared by every message it is attached to, so a logo repeated across a
+    campaign costs nothing per recipient.
+    """
+    _cache = {}
+
+    def __init__(self, path, cid=None):
+        """
+        Args:
+            path (str): File path of the image.
+            cid (Optional[str]): Content-ID to reference the image with.
+                Defaults to the file name.
+        """
+        self.path = path
+        filename = os.path.basename(path)
+        self.cid = cid or filename
+        content_type = mimetypes.guess_type(filename)[0] or ''
+        subtype = (content_type.split('/')[1]
+                   if content_type.startswith('image/') else None)
+        self.part = MIMEImage(Path(path).read_bytes(), _subtype=subtype)
+        self.part.add_header('Content-ID', '<{}>'.format(self.cid))
+        self.part.add_header('Content-Disposition', 'inline',
+                             filename=filename)
+
+    @classmethod
+    def cached(cls, path):
+        """Return the InlineImage of `path`, encoded again only if the file
+        was modified since the last call.
+
+        Args:
+            path (str): File path of the image.
+
+        Returns:
+            auto_emailer.emailer.InlineImage: The shared image.
+        """
+        key = str(path)
+        mtime = os.stat(key).st_mtime_ns
+        cached = cls._cache.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = cls._cache[key] = (mtime, cls(key))
+        return cached[1]
+
 
 class Message:
     """Class representing an email message."""
-    def __init__(self, sender, destinations, subject=None, cc=None, bcc=None):
+    render_cache = RenderCache()
+    """auto_emailer.emailer.RenderCache: Cache of Message.as_bytes shared
+    by every message, or None to serialize on every call."""
+
+    def __init__(self, sender, destinations, subject=None, cc=None, bcc=None,
+                 validate=False, signer=None):
         """
         Args:
             sender (str): Email address of the sender (from).
@@ -166,12 +464,27 @@ class Message:
                 addresses to CC the email message to.
             bcc (Optional(Sequence[str])): List of string email
                 addresses to BCC on the email message.
+            validate (bool): If True, normalize the destinations, cc and bcc
+                addresses and drop the ones repeated across them. See
+                `auto_emailer.addresses.validate_recipients`.
+            signer (Optional(auto_emailer.dkim.DKIMSigner)): If given, the
+                message is DKIM signed when serialized with as_bytes.
+
+        Raises:
+            ValueError: If validate is True and an address is invalid.
         """
+        if validate:
+            destinations, cc, bcc, invalid = addresses.validate_recipients(
+                destinations, cc, bcc)
+            if invalid:
+                raise ValueError('Invalid email addresses: {}'
+                                 .format(', '.join(invalid)))
         self.sender = sender
         self.destinations = destinations
         self.subject = subject
         self.cc = cc or []
         self.bcc = bcc or []
+        self.signer = signer
         # create multi-part message
         self.message = MIMEMultipart()
 
@@ -179,6 +492,65 @@ class Message:
         """Override __str__ method to return message as string"""
         return self.message.as_string()
 
+    @property
+    def recipients(self):
+        """Return: list: Every envelope recipient, destinations, cc and bcc.
+        """
+        return list(self.destinations) + list(self.cc) + list(self.bcc)
+
+    def as_bytes(self):
+        """Return the message as the bytes that are sent on the wire. Like
+        `smtplib.SMTP.send_message`, lines end with CRLF and the BCC header
+        is left out. A message with a signer gets a DKIM-Signature header;
+        its multipart boundaries are derived from the content so that
+        messages sharing a body share its cached body hash.
+
+        The bytes are kept in Message.render_cache until a header or part
+        of the message changes, so sending the message again, for example
+        after a dropped connection, does not serialize it again.
+
+        Returns:
+            bytes: The serialized message.
+        """
+        cache = self.render_cache
+        if cache is None:
+            return self._serialize()
+        fingerprint = self._fingerprint()
+        data = cache.get(self, fingerprint)
+        if data is None:
+            data = self._serialize()
+            # serializing sets the boundaries of nested multiparts, which
+            # the copy shares with the message; fingerprint them as set
+            cache.put(self, self._fingerprint(), data)
+        return data
+
+    def _fingerprint(self):
+        """Return what the serialized bytes depend on: the signer and, for
+        every part, the part itself, its headers and its payload. Payloads
+        are immutable strings, compared by identity first.
+        """
+        return (self.signer,) + tuple(
+            (part, tuple(part.items()),
+             None if part.is_multipart() else part.get_payload())
+            for part in self.message.walk())
+
+    def _serialize(self):
+        message = copy.copy(self.message)
+        # deleting rebinds the header list, the original is untouched
+        del message['BCC']
+        generator = (BytesGenerator if self.signer is None
+                     else _StableBoundaryGenerator)
+        buffer = io.BytesIO()
+        # CRLF line endings, as smtplib.SMTP.send_message writes them;
+        # sendmail puts the bytes on the wire unchanged
+        generator(buffer, mangle_from_=False,
+                  policy=message.policy).flatten(message, linesep='\r\n')
+        data = buffer.getvalue()
+        if self.signer is None:
+            return data
+        # the signature covers exactly these bytes, which are sent as is
+        return self.signer.sign(data)
+
     @staticmethod
     def body_template(template_path):
         """Opens, reads, and returns the given template text file
@@ -201,7 +573,8 @@ class Message:
                                     .format(template_path))
         return template_text
 
-    def draft_message(self, text=None, template_path=None, template_args=None):
+    def draft_message(self, text=None, template_path=None, template_args=None,
+                      compiled=False, html=None, inline_images=None):
         """Create, or draft, the `self.message` instance attribute with
         string text or text file templates. Return self from the instance
         to allow method chaining of `auto_emailer.emailer.Message.attach`.
@@ -212,6 +585,17 @@ class Message:
                 template to use for the email message body.
             template_args (Optional[dict]): Keyword arguments to format
                 the email message template text.
+            compiled (bool): If True, `text` or the file at `template_path`
+                is rendered with `auto_emailer.template` instead of
+                `str.format`, allowing conditionals and loops. The compiled
+                template is cached. An `html` body is then rendered the same
+                way, with HTML escaping.
+            html (Optional[str]): HTML body of your email message, sent
+                as a multipart/alternative of the text body.
+            inline_images (Optional(Sequence[Union[InlineImage, str]])):
+                Images the HTML body references as `cid:<cid>`. Paths are
+                turned into `auto_emailer.emailer.InlineImage` through
+                `InlineImage.cached`.
 
         Returns:
             auto_emailer.emailer.Message: The instance of
@@ -224,23 +608,57 @@ class Message:
         self.message['Subject'] = self.subject
 
         # check if email template is used
-        if template_path:
+        if compiled:
+            body = None
+            if template_path:
+                body = template.load_template(template_path)
+            elif text is not None:
+                body = template.compile_string(text)
+            if body is not None:
+                text = body.render(template_args or {})
+            if html is not None:
+                html = template.compile_string(html, autoescape=True).render(
+                    template_args or {})
+        elif template_path:
             text = self.body_template(template_path)
             text = text.format(**template_args)
 
-        # attach text part of message
-        self.message.attach(MIMEText(text))
+        if html is None:
+            # attach text part of message
+            self.message.attach(MIMEText(text))
+            return self
+
+        # text and html alternatives, wrapped with the images they show
+        body = MIMEMultipart('alternative')
+        if text is not None:
+            body.attach(MIMEText(text, 'plain'))
+        body.attach(MIMEText(html, 'html'))
+        if inline_images:
+            related = MIMEMultipart('related')
+            related.attach(body)
+            for image in inline_images:
+                if not isinstance(image, InlineImage):
+                    image = InlineImage.cached(image)
+                related.attach(image.part)
+            body = related
+        self.message.attach(body)
 
         # return self to encourage method chaining
         return self
 
-    def attach(self, attach_files=None):
+    def attach(self, attach_files=None, compress_threshold=None,
+               compress_level=6):
         """Add a sequence of files as attachments to the
         email message.
 
         Args:
             attach_files (Optional(Sequence[str])): List of string file
                 paths to attached to message.
+            compress_threshold (Optional[int]): If given, files larger
+                than this many bytes are attached gzip compressed, as
+                `<name>.gz`, unless they are of an already compressed
+                type or would shrink by less than a tenth.
+            compress_level (int): gzip compression level, 1 to 9.
 
         Returns:
             auto_emailer.emailer.Message: The instance of
@@ -248,16 +666,57 @@ class Message:
         """
         # iterate through files to attach
         for path in attach_files or []:
+            filename = os.path.basename(path)
             part = MIMEBase('application', "octet-stream")
+            # the file is mapped rather than read, so that only its
+            # encoded form is held in memory
             with open(path, 'rb') as file:
-                part.set_payload(file.read())
-
-            # encode file in ASCII characters to send by email
-            encoders.encode_base64(part)
+                data = b''
+                if os.fstat(file.fileno()).st_size:
+                    data = mmap.mmap(file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                try:
+                    if (compress_threshold is not None and
+                            len(data) > compress_threshold and
+                            os.path.splitext(filename)[1].lower()
+                            not in _COMPRESSED_EXTENSIONS):
+                        compressed = self._gzip(data, filename,
+                                                compress_level)
+                        if len(compressed) < len(data) * 0.9:
+                            part = MIMEBase('application', 'gzip')
+                            filename += '.gz'
+                            data.close()
+                            data = compressed
+                    # encode file in ASCII characters to send by email
+                    part.set_payload(_base64_lines(data))
+                finally:
+                    if isinstance(data, mmap.mmap):
+                        data.close()
+            part['Content-Transfer-Encoding'] = 'base64'
             # add header to attachment part
             part.add_header('Content-Disposition',
                             'attachment',
-                            filename=os.path.basename(path))
+                            filename=filename)
             self.message.attach(part)
 
         return self
+
+    @staticmethod
+    def _gzip(data, filename, level):
+        """Return `data` gzip compressed, with a fixed timestamp so that
+        the same file always compresses to the same bytes.
+        """
+        buffer = io.BytesIO()
+        with gzip.GzipFile(filename=filename, mode='wb', compresslevel=level,
+                           fileobj=buffer, mtime=0) as file:
+            file.write(data)
+        return buffer.getvalue()
+
+    def encoded_size(self):
+        """Return the size of the message on the wire, with CRLF line
+        endings, to compare against the SIZE limit of a server.
+
+        Returns:
+            int: Number of bytes.
+        """
+        return _wire_size(self.as_bytes())
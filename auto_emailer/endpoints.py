@@ -0,0 +1,259 @@
+"""Failover across several SMTP relay endpoints.
+
+An :class:`EndpointSet` holds the relays a
+:class:`~auto_emailer.transport.SMTPTransport` may connect to. Each endpoint
+keeps a moving average of its connect and EHLO latency; new sessions go to
+the endpoint with the best latency for its weight, or to the first healthy
+one in order. Endpoints that fail repeatedly are ejected for a while, and
+optional background probes (connect plus EHLO) re-admit them once they
+answer again::
+
+    relays = EndpointSet([('relay1.example.com', 587),
+                          ('relay2.example.com', 587)])
+    relays.start()
+    emailer = Emailer(config=creds,
+                      transport=SMTPTransport(creds, endpoints=relays))
+"""
+import smtplib
+import socket
+import threading
+import time
+
+
+def _close(smtp):
+    """Close a connection whose EHLO failed, if it was opened at all."""
+    if smtp is not None:
+        smtp.close()
+
+
+class Endpoint:
+    """An SMTP relay and its health."""
+
+    def __init__(self, host, port=587, weight=1):
+        """
+        Args:
+            host (str): Host name of the relay.
+            port (int): Port where the relay is listening.
+            weight (float): Relative capacity; a higher weight tolerates a
+                proportionally higher latency.
+        """
+        self.host = host
+        self.port = int(port)
+        self.weight = weight
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def __repr__(self):
+        return 'Endpoint({!r}, {!r})'.format(self.host, self.port)
+
+    @property
+    def score(self):
+        """float: Latency for the weight, lower is better. Endpoints never
+        measured score 0 so that they get tried.
+        """
+        return (self.latency or 0.0) / self.weight
+
+
+class EndpointSet:
+    """Pick healthy relays by latency, eject and re-admit failing ones."""
+
+    def __init__(self, endpoints, ordered=False, smoothing=0.3,
+                 max_failures=3, eject_seconds=60.0, probe_interval=30.0,
+                 probe_timeout=5.0, connect_timeout=10.0):
+        """
+        Args:
+            endpoints (Sequence[Union[Endpoint, Tuple[str, int], str]]):
+                The relays, as Endpoint, `(host, port)` or `'host:port'`.
+            ordered (bool): If True, always prefer the first healthy
+                endpoint in the given order instead of the best score.
+            smoothing (float): Weight of a new latency sample in the
+                moving average.
+            max_failures (int): Consecutive failures that eject an
+                endpoint.
+            eject_seconds (float): How long an ejected endpoint is skipped
+                if no probe re-admits it earlier.
+            probe_interval (float): Seconds between background probes.
+            probe_timeout (float): Connect timeout of a probe.
+            connect_timeout (float): Seconds a new session waits for an
+                endpoint to connect and answer EHLO before failing over to
+                the next one.
+
+        Raises:
+            ValueError: If no endpoints are given.
+        """
+        if not endpoints:
+            raise ValueError('EndpointSet needs at least one endpoint.')
+        self.endpoints = [self._endpoint(endpoint) for endpoint in endpoints]
+        self.ordered = ordered
+        self.smoothing = smoothing
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _endpoint(endpoint):
+        if isinstance(endpoint, Endpoint):
+            return endpoint
+        if isinstance(endpoint, str):
+            host, _, port = endpoint.rpartition(':')
+            return Endpoint(host, port) if host else Endpoint(endpoint)
+        return Endpoint(*endpoint)
+
+    def healthy(self, now=None):
+        """Return: list: The endpoints that are not ejected."""
+        now = time.monotonic() if now is None else now
+        return [endpoint for endpoint in self.endpoints
+                if endpoint.ejected_until <= now]
+
+    def select(self, exclude=()):
+        """Pick the endpoint for a new session.
+
+        Args:
+            exclude (Container[Endpoint]): Endpoints already tried.
+
+        Returns:
+            Optional[auto_emailer.endpoints.Endpoint]: The endpoint, or the
+            ejected endpoint closest to re-admission if every endpoint is
+            ejected, or None if every endpoint is excluded.
+        """
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude]
+            if not candidates:
+                return None
+            now = time.monotonic()
+            healthy = [endpoint for endpoint in candidates
+                       if endpoint.ejected_until <= now]
+            if not healthy:
+                return min(candidates,
+                           key=lambda endpoint: endpoint.ejected_until)
+            if self.ordered:
+                return healthy[0]
+            return min(healthy, key=lambda endpoint: endpoint.score)
+
+    def record_success(self, endpoint, latency):
+        """Record a successful connection and re-admit the endpoint.
+
+        Args:
+            endpoint (auto_emailer.endpoints.Endpoint): The endpoint.
+            latency (float): Seconds the connect and EHLO took.
+        """
+        with self._lock:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.smoothing * (latency -
+                                                      endpoint.latency)
+            endpoint.failures = 0
+            endpoint.ejected_until = 0.0
+
+    def record_failure(self, endpoint):
+        """Record a failed connection, ejecting the endpoint after
+        `max_failures` in a row.
+
+        Args:
+            endpoint (auto_emailer.endpoints.Endpoint): The endpoint.
+        """
+        with self._lock:
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+
+    def connect(self, timeout=None):
+        """Open an SMTP connection and say EHLO, trying endpoints in order
+        of preference until one answers.
+
+        Connecting and EHLO are bounded by `connect_timeout`, so that an
+        endpoint that does not answer fails over quickly.
+
+        Args:
+            timeout (Optional[float]): Socket timeout of the connection
+                once it answered. Defaults to the socket module default.
+
+        Returns:
+            Tuple[smtplib.SMTP, Endpoint]: The connection and its endpoint.
+
+        Raises:
+            smtplib.SMTPConnectError: If no endpoint answers.
+        """
+        tried = []
+        while True:
+            endpoint = self.select(exclude=tried)
+            if endpoint is None:
+                raise smtplib.SMTPConnectError(
+                    421, 'No SMTP endpoint answered: {}'.format(tried))
+            tried.append(endpoint)
+            start = time.perf_counter()
+            smtp = None
+            try:
+                smtp = smtplib.SMTP(host=endpoint.host, port=endpoint.port,
+                                    timeout=self.connect_timeout)
+                smtp.ehlo()
+            except (OSError, smtplib.SMTPException):
+                _close(smtp)
+                self.record_failure(endpoint)
+                continue
+            self.record_success(endpoint, time.perf_counter() - start)
+            smtp.sock.settimeout(socket.getdefaulttimeout()
+                                 if timeout is None else timeout)
+            return smtp, endpoint
+
+    def probe(self, endpoint):
+        """Connect to an endpoint, say EHLO and record the outcome.
+
+        Args:
+            endpoint (auto_emailer.endpoints.Endpoint): The endpoint.
+
+        Returns:
+            bool: If the endpoint answered.
+        """
+        start = time.perf_counter()
+        smtp = None
+        try:
+            smtp = smtplib.SMTP(host=endpoint.host, port=endpoint.port,
+                                timeout=self.probe_timeout)
+            smtp.ehlo()
+        except (OSError, smtplib.SMTPException):
+            _close(smtp)
+            self.record_failure(endpoint)
+            return False
+        self.record_success(endpoint, time.perf_counter() - start)
+        try:
+            smtp.quit()
+        except (OSError, smtplib.SMTPException):
+            pass
+        return True
+
+    def probe_all(self):
+        """Probe every endpoint once."""
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+
+    def start(self):
+        """Start probing every endpoint in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='auto_emailer-probes',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background probes."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.probe_interval)
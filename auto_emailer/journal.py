@@ -0,0 +1,113 @@
+"""Append-only journal of completed sends, used to resume bulk sends.
+
+Each delivered message is recorded as a fixed size idempotency key derived
+from the recipient and the campaign name, one key per line. The whole
+journal is loaded into a set when it is opened, so a restarted batch checks
+every recipient with a single hash lookup.
+"""
+import hashlib
+import os
+import threading
+import time
+
+
+def idempotency_key(recipient, campaign=''):
+    """Return the idempotency key of a message.
+
+    Args:
+        recipient (str): Email address of the recipient. Surrounding
+            whitespace and case are ignored.
+        campaign (str): Name of the campaign the message belongs to.
+
+    Returns:
+        str: 32 hexadecimal characters.
+    """
+    data = '{}\0{}'.format(campaign, recipient.strip().lower())
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class SendJournal:
+    """Record of the idempotency keys of delivered messages.
+
+    Writes are buffered and only forced to disk with `os.fsync` every
+    `fsync_every` records or `fsync_interval` seconds. After a crash, at most
+    that many messages are sent a second time.
+    """
+
+    def __init__(self, path, fsync_every=1000, fsync_interval=1.0):
+        """
+        Args:
+            path (str): Path of the journal file. Created if missing.
+            fsync_every (int): Records written between two fsync calls.
+            fsync_interval (float): Maximum seconds between two fsync calls.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._keys = self._load(path)
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    @staticmethod
+    def _load(path):
+        """Read every complete key of the journal at `path`. A partial
+        last line, left by a crash in the middle of a write, is cut off so
+        that new records start on a fresh line.
+        """
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return set()
+
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            with open(path, 'r+b') as file:
+                file.truncate(end)
+        return set(data[:end].decode('ascii').split())
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, key):
+        """Append a delivered message's key to the journal.
+
+        Args:
+            key (str): The key from
+                :func:`auto_emailer.journal.idempotency_key`.
+        """
+        with self._lock:
+            self._file.write(key.encode('ascii') + b'\n')
+            self._keys.add(key)
+            self._pending += 1
+            if (self._pending >= self.fsync_every or
+                    time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def sync(self):
+        """Force every recorded key to disk."""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Sync and close the journal file."""
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
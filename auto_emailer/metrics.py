@@ -0,0 +1,446 @@
+"""Prometheus metrics of the sending engine.
+
+Metrics are off by default. Once enabled, every transport counts the messages
+it sends and fails, the bytes it sends and the latency of each send, the
+retry paths count reconnects, dispatchers and session pools report their
+queue depth and open sessions, and every dispatcher lane its latency and how
+many messages met its SLO, labelled with the lane name::
+
+    from auto_emailer import metrics
+
+    metrics.start_http_server(9464)  # also enables the metrics
+
+and ``http://localhost:9464/metrics`` serves the Prometheus text format.
+
+Counters and histograms are aggregated per thread: each thread updates its
+own shard without taking a lock, and the shards are only summed when the
+metrics are collected, so the metrics can stay on under full load. The
+shard of a thread that exits is folded into a base total, so threads that
+come and go do not add up. Gauges are read from the tracked dispatchers and
+pools at collection time.
+"""
+import bisect
+import http.server
+import socketserver
+import threading
+import weakref
+
+ENABLED = False
+"""bool: If the sending engine records metrics. See :func:`enable`."""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""Content type of the Prometheus text exposition format."""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+"""Default upper bounds, in seconds, of the histogram buckets."""
+
+
+def enable():
+    """Start recording metrics."""
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    """Stop recording metrics. Values recorded so far are kept."""
+    global ENABLED
+    ENABLED = False
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _Owner:
+    """Held by the thread-local storage of a thread, and dropped with it
+    when the thread exits.
+    """
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class _Sharded:
+    """Base class of metrics aggregated over per-thread shards."""
+
+    type = None
+
+    def __init__(self, name, documentation, size):
+        self.name = name
+        self.documentation = documentation
+        self._size = size
+        self._local = threading.local()
+        self._shards = []
+        self._base = [0] * size
+        # reentrant, dropping the thread-local storage in reset retires
+        # the shards of the other threads
+        self._lock = threading.RLock()
+
+    def _shard(self):
+        """Return the shard of the calling thread, creating it on first
+        use. Only the owning thread ever writes to a shard.
+        """
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            shard = [0] * self._size
+            owner = self._local.owner = _Owner(shard)
+            weakref.finalize(owner, self._retire, shard).atexit = False
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _retire(self, shard):
+        """Fold the shard of an exited thread into the base total."""
+        with self._lock:
+            for index, other in enumerate(self._shards):
+                if other is shard:
+                    del self._shards[index]
+                    self._base = [total + value for total, value
+                                  in zip(self._base, shard)]
+                    return
+
+    def _totals(self):
+        with self._lock:
+            shards = self._shards + [self._base]
+        return [sum(column) for column in zip(*shards)]
+
+    def reset(self):
+        """Set the metric back to zero."""
+        with self._lock:
+            self._shards = []
+            self._base = [0] * self._size
+            self._local = threading.local()
+
+
+class Counter(_Sharded):
+    """A value that only goes up, such as a number of messages."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        """
+        Args:
+            name (str): Name of the metric.
+            documentation (str): Help text of the metric.
+        """
+        super().__init__(name, documentation, 1)
+
+    def inc(self, amount=1):
+        """Add `amount` to the counter.
+
+        Args:
+            amount (Union[int, float]): Non negative increment.
+        """
+        self._shard()[0] += amount
+
+    @property
+    def value(self):
+        """Union[int, float]: Current value of the counter."""
+        return self._totals()[0]
+
+    def samples(self):
+        """Return: list: `(name, labels, value)` tuples to expose."""
+        return [(self.name, '', self.value)]
+
+
+class Histogram(_Sharded):
+    """Observations, such as latencies, counted in buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            name (str): Name of the metric.
+            documentation (str): Help text of the metric.
+            buckets (Sequence[float]): Sorted upper bounds of the buckets.
+                An unbounded bucket is added last.
+        """
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # a count per bucket, then the sum and the count of observations
+        super().__init__(name, documentation, len(self.buckets) + 2)
+
+    def observe(self, value):
+        """Count an observation in its bucket.
+
+        Args:
+            value (float): The observation.
+        """
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    @property
+    def count(self):
+        """int: Number of observations."""
+        return self._totals()[-1]
+
+    def samples(self):
+        totals = self._totals()
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, totals):
+            cumulative += count
+            samples.append((self.name + '_bucket',
+                            '{{le="{}"}}'.format(_format(bound)), cumulative))
+        samples.append((self.name + '_sum', '', totals[-2]))
+        samples.append((self.name + '_count', '', totals[-1]))
+        return samples
+
+
+class Gauge:
+    """A value that goes up and down, such as a queue depth.
+
+    A gauge either holds a value that is set, or sums `getter` over every
+    tracked object still alive when it is collected.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, getter=None):
+        """
+        Args:
+            name (str): Name of the metric.
+            documentation (str): Help text of the metric.
+            getter (Optional[Callable]): Reads the value of a tracked
+                object.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.getter = getter
+        self._value = 0
+        self._objects = weakref.WeakSet()
+
+    def set(self, value):
+        """Set the gauge to `value`."""
+        self._value = value
+
+    def track(self, obj):
+        """Add `obj` to the objects summed with `getter`. It is dropped
+        once garbage collected.
+        """
+        self._objects.add(obj)
+
+    @property
+    def value(self):
+        """Union[int, float]: Current value of the gauge."""
+        if self.getter is None:
+            return self._value
+        return sum(self.getter(obj) for obj in list(self._objects))
+
+    def reset(self):
+        """Set the gauge back to zero. Tracked objects are kept."""
+        self._value = 0
+
+    def samples(self):
+        return [(self.name, '', self.value)]
+
+
+class Family:
+    """Metrics of one name told apart by the value of a label, such as the
+    latency of every dispatcher lane.
+    """
+
+    def __init__(self, metric, name, documentation, label, **kwargs):
+        """
+        Args:
+            metric (type): Counter or Histogram, the class of the metrics.
+            name (str): Name of the metrics.
+            documentation (str): Help text of the metrics.
+            label (str): Name of the label.
+            **kwargs: More arguments of `metric`, such as buckets.
+        """
+        self.type = metric.type
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._metric = metric
+        self._kwargs = kwargs
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        """Return the metric of a label value, created on first use.
+
+        Args:
+            value (str): Value of the label.
+
+        Returns:
+            Union[Counter, Histogram]: The metric.
+        """
+        try:
+            return self._children[value]
+        except KeyError:
+            with self._lock:
+                if value not in self._children:
+                    self._children[value] = self._metric(
+                        self.name, self.documentation, **self._kwargs)
+                return self._children[value]
+
+    def reset(self):
+        """Set the metric of every label value back to zero."""
+        with self._lock:
+            children = list(self._children.values())
+        for child in children:
+            child.reset()
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        samples = []
+        for value, child in children:
+            label = '{}="{}"'.format(self.label, value)
+            for name, labels, sample in child.samples():
+                labels = '{{{}}}'.format(
+                    ','.join(filter(None, (label, labels[1:-1]))))
+                samples.append((name, labels, sample))
+        return samples
+
+
+class Registry:
+    """A set of metrics exposed together."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric to the registry.
+
+        Args:
+            metric (Union[Counter, Gauge, Histogram, Family]): The metric.
+
+        Returns:
+            Union[Counter, Gauge, Histogram, Family]: The metric.
+
+        Raises:
+            ValueError: If a metric with the same name is registered.
+        """
+        with self._lock:
+            if any(other.name == metric.name for other in self._metrics):
+                raise ValueError('Metric {} is already registered.'
+                                 .format(metric.name))
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        """Register and return a new Counter."""
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, getter=None):
+        """Register and return a new Gauge."""
+        return self.register(Gauge(name, documentation, getter))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        """Register and return a new Histogram."""
+        return self.register(Histogram(name, documentation, buckets))
+
+    def family(self, metric, name, documentation, label, **kwargs):
+        """Register and return a new Family of `metric`."""
+        return self.register(Family(metric, name, documentation, label,
+                                    **kwargs))
+
+    def reset(self):
+        """Set every metric back to zero."""
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.reset()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+"""The registry of the sending engine metrics."""
+
+MESSAGES_SENT = REGISTRY.counter('auto_emailer_messages_sent_total',
+                                 'Messages delivered by transports.')
+MESSAGES_FAILED = REGISTRY.counter('auto_emailer_messages_failed_total',
+                                   'Failed delivery attempts.')
+BYTES_SENT = REGISTRY.counter('auto_emailer_bytes_sent_total',
+                              'Bytes of the delivered messages.')
+SEND_SECONDS = REGISTRY.histogram('auto_emailer_send_seconds',
+                                  'Latency of a single delivery.')
+RECONNECTS = REGISTRY.counter('auto_emailer_reconnects_total',
+                              'Sends retried after a connection error.')
+SESSIONS_CREATED = REGISTRY.counter('auto_emailer_sessions_created_total',
+                                    'Sessions spawned by session pools.')
+QUEUE_DEPTH = REGISTRY.gauge('auto_emailer_queue_depth',
+                             'Messages queued in dispatchers.',
+                             lambda dispatcher: dispatcher.queue_depth())
+SESSIONS = REGISTRY.gauge('auto_emailer_sessions',
+                          'Sessions held by session pools.',
+                          lambda pool: pool.sessions)
+LANE_SECONDS = REGISTRY.family(Histogram, 'auto_emailer_lane_seconds',
+                               'Time from submission to delivery, by '
+                               'dispatcher lane.', 'lane')
+LANE_FAILED = REGISTRY.family(Counter, 'auto_emailer_lane_failed_total',
+                              'Messages of a dispatcher lane that failed.',
+                              'lane')
+LANE_SLO_MET = REGISTRY.family(Counter, 'auto_emailer_lane_slo_met_total',
+                               'Messages of a dispatcher lane delivered '
+                               'within its SLO.', 'lane')
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port=9464, addr='', registry=REGISTRY):
+    """Enable the metrics and serve them over HTTP from a daemon thread.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port.
+        addr (str): Address to listen on. Defaults to every interface.
+        registry (auto_emailer.metrics.Registry): The metrics to serve.
+
+    Returns:
+        http.server.HTTPServer: The server, stopped with `shutdown()`. Its
+        `server_port` attribute is the port listened on.
+    """
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = _Server((addr, port), handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='auto_emailer-metrics', daemon=True)
+    thread.start()
+    enable()
+    return server
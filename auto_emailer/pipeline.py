@@ -0,0 +1,360 @@
+"""Staged rendering and sending of a recipient stream.
+
+:func:`auto_emailer.bulk.send_bulk` builds and sends each message in turn,
+so the CPU spent rendering and the time spent waiting on the server never
+overlap. A :class:`Pipeline` runs the two apart::
+
+    source --> render (processes) --> send (threads) --> server
+          queue                 queue
+
+A source thread reads the rows and hands them in blocks to a pool of render
+processes, which return the serialized messages. Send threads take the
+rendered messages and deliver them over sessions borrowed from a
+:class:`~auto_emailer.concurrency.SessionPool`. Both queues are bounded, so
+a slow stage holds the stages before it back instead of letting rendered
+messages pile up in memory. Every stage keeps statistics telling how busy it
+was and how long it waited, and :attr:`Pipeline.bottleneck` names the stage
+that limited the run::
+
+    pipeline = Pipeline(emailer.transport, workers=4, senders=8)
+    report = pipeline.run(rows, sender, subject, text='Hello {name}')
+    print(pipeline.bottleneck, pipeline.as_dict())
+"""
+import concurrent.futures
+import functools
+import os
+import queue
+import signal
+import threading
+import time
+
+from .bulk import SendReport
+from .bulk import _REFUSED
+from .bulk import _render_bytes
+from .bulk import deliver
+from .concurrency import SessionPool
+from .emailer import Message
+from .journal import idempotency_key
+
+_DONE = object()
+
+
+class StageStats:
+    """Activity of one pipeline stage and of the queue feeding it."""
+
+    def __init__(self, name, workers=1):
+        """
+        Args:
+            name (str): Name of the stage.
+            workers (int): Number of threads or processes of the stage.
+        """
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.starved = 0.0
+        self.seconds = 0.0
+        self.max_depth = 0
+        self._depths = 0
+        self._samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, busy=0.0, blocked=0.0, starved=0.0, items=0):
+        """Add the time spent on work and waiting.
+
+        Args:
+            busy (float): Seconds spent working.
+            blocked (float): Seconds waiting for room in the next queue.
+            starved (float): Seconds waiting for input.
+            items (int): Number of items completed.
+        """
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.blocked += blocked
+            self.starved += starved
+
+    def sample(self, depth):
+        """Record the depth of the input queue.
+
+        Args:
+            depth (int): Number of items queued.
+        """
+        with self._lock:
+            self._depths += depth
+            self._samples += 1
+            self.max_depth = max(self.max_depth, depth)
+
+    @property
+    def mean_depth(self):
+        """float: Average depth of the input queue when sampled."""
+        if not self._samples:
+            return 0.0
+        return self._depths / self._samples
+
+    @property
+    def throughput(self):
+        """float: Items completed per second of the run."""
+        if not self.seconds:
+            return 0.0
+        return self.items / self.seconds
+
+    @property
+    def utilization(self):
+        """float: Fraction of the run the workers of the stage were busy."""
+        if not self.seconds:
+            return 0.0
+        return min(1.0, self.busy / (self.seconds * self.workers))
+
+    def as_dict(self):
+        """Return: dict: The statistics as plain data."""
+        return {'items': self.items,
+                'workers': self.workers,
+                'busy': self.busy,
+                'blocked': self.blocked,
+                'starved': self.starved,
+                'seconds': self.seconds,
+                'throughput': self.throughput,
+                'utilization': self.utilization,
+                'mean_depth': self.mean_depth,
+                'max_depth': self.max_depth}
+
+
+def _render_block(rows, **kwargs):
+    """Render a block of rows with :func:`auto_emailer.bulk._render_bytes`
+    and time it. Runs in worker processes.
+    """
+    start = time.perf_counter()
+    results = [_render_bytes(row, **kwargs) for row in rows]
+    return results, time.perf_counter() - start
+
+
+def _ignore_interrupts():
+    """Leave Ctrl-C to the parent process, which stops the pipeline."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _put(stage, target, item):
+    """Put an item in a bounded queue, counting the wait as blocked."""
+    start = time.perf_counter()
+    target.put(item)
+    stage.record(blocked=time.perf_counter() - start)
+
+
+def _get(stage, source):
+    """Take an item from a queue, counting the wait as starved."""
+    stage.sample(source.qsize())
+    start = time.perf_counter()
+    item = source.get()
+    stage.record(starved=time.perf_counter() - start)
+    return item
+
+
+class Pipeline:
+    """Render messages in worker processes while threads send them."""
+
+    def __init__(self, transport, workers=None, senders=4, queue_size=1024,
+                 chunksize=16):
+        """
+        Args:
+            transport (auto_emailer.transport.Transport): Transport the
+                send sessions are spawned from.
+            workers (Optional[int]): Number of render processes. Defaults
+                to the number of CPUs; 1 renders in a thread of the
+                calling process.
+            senders (int): Number of send threads, each with its session.
+            queue_size (int): Most messages waiting in each queue.
+            chunksize (int): Rows handed to a render process at a time.
+
+        Raises:
+            ValueError: If senders, queue_size or chunksize is less than 1.
+        """
+        if senders < 1 or queue_size < 1 or chunksize < 1:
+            raise ValueError(
+                'senders, queue_size and chunksize must be at least 1.')
+        self.transport = transport
+        self.workers = workers or os.cpu_count() or 1
+        self.senders = senders
+        self.queue_size = queue_size
+        self.chunksize = chunksize
+        self.stages = []
+        self.report = None
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stop reading rows, from any thread. The rows already read are
+        still rendered and sent before :meth:`run` returns.
+        """
+        self._stop.set()
+
+    @property
+    def bottleneck(self):
+        """Optional[str]: Name of the busiest stage of the last run."""
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda stage: stage.utilization).name
+
+    def as_dict(self):
+        """Return: dict: The statistics of every stage of the last run."""
+        return {stage.name: stage.as_dict() for stage in self.stages}
+
+    def run(self, rows, sender, subject, text=None, template_path=None,
+            attach_files=None, address_key='email', journal=None,
+            campaign='', signer=None):
+        """Render and send a message to every row of a recipient stream.
+
+        Rows are handled as by :func:`auto_emailer.bulk.send_bulk`: rows
+        recorded in `journal` are skipped, rows with missing template
+        values and refused messages are counted as failed, and any other
+        error stops the run and is raised once the stages have drained.
+        Messages are not necessarily sent in row order.
+
+        Args:
+            rows (Iterable[dict]): The recipient rows.
+            sender (str): Email address of the sender (from).
+            subject (str): Subject of the email messages.
+            text (Optional[str]): Body template, formatted with each row.
+            template_path (Optional[str]): File path of the body template,
+                used if `text` is None.
+            attach_files (Optional(Sequence[str])): Files to attach.
+            address_key (str): Key of the recipient address in each row.
+            journal (Optional[auto_emailer.journal.SendJournal]): Journal
+                of completed sends.
+            campaign (str): Campaign name the idempotency keys derive from.
+            signer (Optional(auto_emailer.dkim.DKIMSigner)): DKIM signer
+                of the messages.
+
+        Returns:
+            auto_emailer.bulk.SendReport: Counts of sent, skipped and
+            failed rows. It is also available as :attr:`report` while the
+            run is in progress.
+        """
+        if text is None:
+            text = Message.body_template(template_path)
+        render = functools.partial(_render_block, sender=sender,
+                                   subject=subject, text=text,
+                                   attach_files=attach_files,
+                                   address_key=address_key, signer=signer)
+        source_stage = StageStats('source')
+        render_stage = StageStats('render', self.workers)
+        send_stage = StageStats('send', self.senders)
+        self.stages = [source_stage, render_stage, send_stage]
+
+        # blocks of rows being rendered, and messages ready to send
+        pending = queue.Queue(max(1, self.queue_size // self.chunksize))
+        ready = queue.Queue(self.queue_size)
+        report = self.report = SendReport()
+        self._stop.clear()
+        errors = []
+        failed = threading.Event()
+        pool = SessionPool(self.transport)
+        if self.workers == 1:
+            executor = concurrent.futures.ThreadPoolExecutor(1)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=_ignore_interrupts)
+
+        def fail(error):
+            errors.append(error)
+            failed.set()
+
+        def read():
+            iterator = iter(rows)
+            try:
+                while not failed.is_set() and not self._stop.is_set():
+                    start = time.perf_counter()
+                    keys, block = [], []
+                    for row in iterator:
+                        key = None
+                        if journal is not None:
+                            key = idempotency_key(row[address_key], campaign)
+                            if key in journal:
+                                report.skipped += 1
+                                continue
+                        keys.append(key)
+                        block.append(row)
+                        if len(block) == self.chunksize:
+                            break
+                    if not block:
+                        break
+                    future = executor.submit(render, block)
+                    source_stage.record(busy=time.perf_counter() - start,
+                                        items=len(block))
+                    _put(source_stage, pending, (keys, future))
+            except Exception as error:
+                fail(error)
+            finally:
+                pending.put(_DONE)
+
+        def collect():
+            try:
+                while True:
+                    item = _get(render_stage, pending)
+                    if item is _DONE:
+                        break
+                    keys, future = item
+                    try:
+                        results, seconds = future.result()
+                    except Exception as error:
+                        fail(error)
+                        continue
+                    render_stage.record(busy=seconds, items=len(results))
+                    if failed.is_set():
+                        continue
+                    for key, (envelope, missing) in zip(keys, results):
+                        if envelope is None:
+                            report.record_failure(KeyError)
+                            report.missing_keys[missing] += 1
+                            continue
+                        _put(render_stage, ready, (key, envelope))
+            finally:
+                for _ in range(self.senders):
+                    ready.put(_DONE)
+
+        def send():
+            while True:
+                item = _get(send_stage, ready)
+                if item is _DONE:
+                    return
+                if failed.is_set():
+                    # keep draining so that the other stages can finish
+                    continue
+                key, (data, from_addr, to_addrs) = item
+                start = time.perf_counter()
+                try:
+                    with pool.session() as session:
+                        deliver(session, data, from_addr, to_addrs)
+                except _REFUSED as error:
+                    report.record_failure(type(error))
+                except Exception as error:
+                    fail(error)
+                else:
+                    report.record_sent()
+                    if key is not None:
+                        try:
+                            journal.record(key)
+                        except Exception as error:
+                            # stop rather than resend unrecorded rows later
+                            fail(error)
+                send_stage.record(busy=time.perf_counter() - start, items=1)
+
+        threads = [threading.Thread(target=read, daemon=True),
+                   threading.Thread(target=collect, daemon=True)]
+        threads += [threading.Thread(target=send, daemon=True)
+                    for _ in range(self.senders)]
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            executor.shutdown(wait=True)
+            pool.close()
+            report.seconds = time.perf_counter() - start
+            for stage in self.stages:
+                stage.seconds = report.seconds
+        if errors:
+            raise errors[0]
+        return report
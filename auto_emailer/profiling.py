@@ -0,0 +1,242 @@
+"""Opt-in profiling of the send pipeline.
+
+Setting the `EMAILER_PROFILE` environment variable to a file path (or to `-`
+for standard error) before importing auto_emailer wraps
+:meth:`Message.draft_message <auto_emailer.emailer.Message.draft_message>`,
+:meth:`Message.attach <auto_emailer.emailer.Message.attach>`,
+:meth:`Message.as_bytes <auto_emailer.emailer.Message.as_bytes>` and
+:meth:`Emailer.send_email <auto_emailer.emailer.Emailer.send_email>`::
+
+    $ EMAILER_PROFILE=/tmp/emailer.prof.txt python send_campaign.py
+
+Every call is timed. A sample of the calls, `EMAILER_PROFILE_RATE` of them,
+also runs under cProfile, and the profiles of each function are merged.
+tracemalloc traces allocations from the start. At exit, the report lists the
+call counts and times, the hot spots of every profiled function and the
+lines that allocated the most memory since profiling started.
+"""
+import atexit
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from .config import environment_vars
+
+DEFAULT_SAMPLE_RATE = 0.01
+"""Fraction of calls profiled with cProfile if not configured."""
+
+# only one cProfile profiler may be active at a time since Python 3.12
+_SAMPLING = threading.Lock()
+
+_profiler = None
+
+
+class _Target:
+    """Timings and merged profiles of one wrapped function."""
+
+    def __init__(self, label):
+        self.label = label
+        self.calls = 0
+        self.seconds = 0.0
+        self.sampled = 0
+        self.stats = None
+
+
+class Profiler:
+    """Wrap functions to time every call and cProfile a sample of them."""
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, top=20,
+                 trace_frames=1):
+        """
+        Args:
+            sample_rate (float): Fraction of the calls run under cProfile.
+            top (int): Number of entries in each section of the report.
+            trace_frames (int): Frames tracemalloc keeps per allocation.
+                0 disables allocation tracing.
+        """
+        self.sample_rate = sample_rate
+        self.top = top
+        self.trace_frames = trace_frames
+        self.targets = {}
+        self._originals = []
+        self._lock = threading.Lock()
+        self._baseline = None
+        self._started_tracing = False
+
+    def wrap(self, owner, name, label=None):
+        """Replace the function `owner.name` by a profiled wrapper.
+
+        Args:
+            owner (type): Class or module holding the function.
+            name (str): Attribute name of the function.
+            label (Optional[str]): Name of the function in the report.
+                Defaults to `Owner.name`.
+        """
+        function = getattr(owner, name)
+        label = label or '{}.{}'.format(owner.__name__, name)
+        target = self.targets[label] = _Target(label)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if (random.random() < self.sample_rate and
+                    _SAMPLING.acquire(blocking=False)):
+                try:
+                    return self._profile(target, function, args, kwargs)
+                finally:
+                    _SAMPLING.release()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._record(target, time.perf_counter() - start)
+
+        self._originals.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, wrapper)
+
+    def _profile(self, target, function, args, kwargs):
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            self._record(target, time.perf_counter() - start, profile)
+
+    def _record(self, target, seconds, profile=None):
+        with self._lock:
+            target.calls += 1
+            target.seconds += seconds
+            if profile is None:
+                return
+            target.sampled += 1
+            if target.stats is None:
+                target.stats = pstats.Stats(profile)
+            else:
+                target.stats.add(profile)
+
+    def start(self):
+        """Start tracing allocations, unless tracemalloc already is."""
+        if self.trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            self._started_tracing = True
+        if tracemalloc.is_tracing():
+            self._baseline = tracemalloc.take_snapshot()
+
+    def stop(self):
+        """Restore the wrapped functions and stop tracing allocations."""
+        for owner, name, original in reversed(self._originals):
+            setattr(owner, name, original)
+        self._originals = []
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self):
+        """Return the profiling report.
+
+        Returns:
+            str: Call timings, hot spots and allocations.
+        """
+        out = io.StringIO()
+        out.write('auto_emailer profile, sample rate {}\n\n'
+                  .format(self.sample_rate))
+        out.write('{:<28}{:>10}{:>12}{:>12}{:>10}\n'.format(
+            'function', 'calls', 'total s', 'mean ms', 'sampled'))
+        with self._lock:
+            targets = list(self.targets.values())
+            for target in targets:
+                mean = target.seconds / target.calls if target.calls else 0.0
+                out.write('{:<28}{:>10}{:>12.3f}{:>12.3f}{:>10}\n'.format(
+                    target.label, target.calls, target.seconds, mean * 1000,
+                    target.sampled))
+            for target in targets:
+                if target.stats is None:
+                    continue
+                out.write('\nHot spots of {}, {} sampled calls\n'
+                          .format(target.label, target.sampled))
+                target.stats.stream = out
+                target.stats.sort_stats('cumulative').print_stats(self.top)
+
+        if self._baseline is not None and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)])
+            out.write('\nAllocations since profiling started\n')
+            for stat in snapshot.compare_to(self._baseline,
+                                            'lineno')[:self.top]:
+                out.write('{}\n'.format(stat))
+        return out.getvalue()
+
+    def dump(self, path):
+        """Write the report to `path`, or to standard error for `-`.
+
+        Args:
+            path (str): File path of the report.
+        """
+        report = self.report()
+        if path == '-':
+            sys.stderr.write(report)
+        else:
+            with open(path, 'w') as file:
+                file.write(report)
+
+
+def install(path, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Profile the send pipeline and write the report to `path` at exit.
+
+    Args:
+        path (str): File path of the report, or `-` for standard error.
+        sample_rate (float): Fraction of the calls run under cProfile.
+
+    Returns:
+        auto_emailer.profiling.Profiler: The profiler.
+    """
+    global _profiler
+    from .emailer import Emailer
+    from .emailer import Message
+
+    uninstall()
+    profiler = Profiler(sample_rate)
+    profiler.wrap(Message, 'draft_message')
+    profiler.wrap(Message, 'attach')
+    profiler.wrap(Message, 'as_bytes')
+    profiler.wrap(Emailer, 'send_email')
+    profiler.start()
+    atexit.register(profiler.dump, path)
+    _profiler = profiler
+    return profiler
+
+
+def uninstall():
+    """Stop profiling without writing a report."""
+    global _profiler
+    if _profiler is not None:
+        atexit.unregister(_profiler.dump)
+        _profiler.stop()
+        _profiler = None
+
+
+def install_from_environment():
+    """Call :func:`install` if `EMAILER_PROFILE` is set.
+
+    Returns:
+        Optional[auto_emailer.profiling.Profiler]: The profiler, if any.
+
+    Raises:
+        ValueError: If `EMAILER_PROFILE_RATE` is not a number.
+    """
+    path = os.environ.get(environment_vars.EMAILER_PROFILE)
+    if not path:
+        return None
+    rate = os.environ.get(environment_vars.EMAILER_PROFILE_RATE)
+    try:
+        rate = DEFAULT_SAMPLE_RATE if rate is None else float(rate)
+    except ValueError:
+        raise ValueError('{} must be a number between 0 and 1, not {!r}.'
+                         .format(environment_vars.EMAILER_PROFILE_RATE, rate))
+    return install(path, rate)
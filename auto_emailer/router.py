@@ -0,0 +1,224 @@
+"""Spread messages across several sending accounts.
+
+Providers cap how much a single mailbox may send. An :class:`AccountRouter`
+holds several accounts, each a :class:`~auto_emailer.config.Credentials`
+with a weight and an optional quota, and picks one per message with smooth
+weighted round robin. Accounts that hit their quota, or that the server
+throttles, are skipped until they recover. :class:`RoutedTransport` plugs
+the router into :class:`~auto_emailer.emailer.Emailer`::
+
+    router = AccountRouter.from_files(['/path/a.json', '/path/b.json'],
+                                      quotas=[2000, 2000])
+    emailer = Emailer(transport=RoutedTransport(router))
+"""
+import smtplib
+import threading
+import time
+
+from .concurrency import is_congestion
+from .config import Credentials
+from .transport import SMTPTransport
+from .transport import Transport
+from .transport import TransportStats
+
+THROTTLE_CODES = (421, 450, 451, 452, 454)
+"""SMTP reply codes on which an account is rested for a cool down."""
+
+
+def is_throttled(error):
+    """Return True if an exception means the account should rest.
+
+    Args:
+        error (Exception): An exception raised while sending.
+
+    Returns:
+        bool: If the account is throttled or over its provider quota.
+    """
+    if is_congestion(error):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        reply = error.smtp_error
+        if isinstance(reply, str):
+            reply = reply.encode('utf-8')
+        return error.smtp_code in THROTTLE_CODES or b'quota' in reply.lower()
+    return False
+
+
+class Account:
+    """A sending account with its weight and quota."""
+
+    def __init__(self, credentials, weight=1, quota=None, quota_period=86400):
+        """
+        Args:
+            credentials (config.credentials.Credentials): The account.
+            weight (int): Share of the messages relative to other accounts.
+            quota (Optional[int]): Messages the account may send per
+                `quota_period`. Unlimited if None.
+            quota_period (float): Length of the quota period in seconds.
+        """
+        self.credentials = credentials
+        self.weight = weight
+        self.quota = quota
+        self.quota_period = quota_period
+        self.stats = TransportStats()
+        self.used = 0
+        self.throttled_until = 0.0
+        self._period_start = time.monotonic()
+        self._current_weight = 0
+
+    @property
+    def name(self):
+        """str: Sender address of the account."""
+        return self.credentials.sender_email
+
+    def available(self, now):
+        """Return: bool: If the account may send at monotonic time `now`."""
+        if now - self._period_start >= self.quota_period:
+            self._period_start = now
+            self.used = 0
+        if now < self.throttled_until:
+            return False
+        return self.quota is None or self.used < self.quota
+
+
+class AccountRouter:
+    """Pick the sending account of every message."""
+
+    def __init__(self, accounts, cooldown=300.0):
+        """
+        Args:
+            accounts (Sequence[Union[Account, Credentials]]): The accounts.
+                Plain credentials get a weight of 1 and no quota.
+            cooldown (float): Seconds a throttled account is rested.
+
+        Raises:
+            ValueError: If no accounts are given.
+        """
+        if not accounts:
+            raise ValueError('AccountRouter needs at least one account.')
+        self.accounts = [account if isinstance(account, Account)
+                         else Account(account) for account in accounts]
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_files(cls, file_names, weights=None, quotas=None, **kwargs):
+        """Creates an AccountRouter from authorized user json files, in the
+        `EMAILER_CREDS` format.
+
+        Args:
+            file_names (Sequence[str]): Paths of the json files.
+            weights (Optional(Sequence[int])): Weight of each account.
+            quotas (Optional(Sequence[int])): Quota of each account.
+            **kwargs: Passed to AccountRouter.
+
+        Returns:
+            auto_emailer.router.AccountRouter: The router.
+        """
+        weights = weights or [1] * len(file_names)
+        quotas = quotas or [None] * len(file_names)
+        accounts = [Account(Credentials.from_authorized_user_file(name),
+                            weight=weight, quota=quota)
+                    for name, weight, quota
+                    in zip(file_names, weights, quotas)]
+        return cls(accounts, **kwargs)
+
+    def select(self):
+        """Pick the next account with smooth weighted round robin.
+
+        Returns:
+            auto_emailer.router.Account: The account to send with.
+
+        Raises:
+            smtplib.SMTPResponseException: A 421 reply if every account is
+                throttled or over its quota.
+        """
+        with self._lock:
+            now = time.monotonic()
+            total = 0
+            best = None
+            for account in self.accounts:
+                if not account.available(now):
+                    continue
+                account._current_weight += account.weight
+                total += account.weight
+                if (best is None or
+                        account._current_weight > best._current_weight):
+                    best = account
+            if best is None:
+                raise smtplib.SMTPResponseException(
+                    421, b'All accounts are throttled or over their quota')
+            best._current_weight -= total
+            best.used += 1
+            return best
+
+    def throttle(self, account, seconds=None):
+        """Rest an account.
+
+        Args:
+            account (auto_emailer.router.Account): The account.
+            seconds (Optional[float]): How long. Defaults to `cooldown`.
+        """
+        with self._lock:
+            account.throttled_until = time.monotonic() + (
+                self.cooldown if seconds is None else seconds)
+
+
+class RoutedTransport(Transport):
+    """Deliver every message through the account its router picks.
+
+    One SMTP session per account is opened on demand. A message refused
+    because its account is throttled is retried on the next account.
+    """
+
+    def __init__(self, router, rewrite_sender=True, stats=None,
+                 session_factory=SMTPTransport):
+        """
+        Args:
+            router (auto_emailer.router.AccountRouter): The accounts.
+            rewrite_sender (bool): If True, the envelope sender is the
+                address of the account sending the message, which most
+                providers require.
+            stats (Optional[TransportStats]): Counters to record deliveries
+                in.
+            session_factory (Callable): Builds the transport of an account
+                from its credentials and stats.
+        """
+        super().__init__(stats)
+        self.router = router
+        self.rewrite_sender = rewrite_sender
+        self.session_factory = session_factory
+        self._sessions = {}
+
+    def spawn(self):
+        return RoutedTransport(self.router, self.rewrite_sender, self.stats,
+                               self.session_factory)
+
+    def _session(self, account):
+        session = self._sessions.get(account.name)
+        if session is None:
+            session = self._sessions[account.name] = self.session_factory(
+                account.credentials, stats=account.stats)
+        return session
+
+    def _close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def _deliver(self, message, from_addr, to_addrs):
+        for _ in range(len(self.router.accounts)):
+            account = self.router.select()
+            session = self._session(account)
+            sender = account.name if self.rewrite_sender else from_addr
+            try:
+                # counted in the metrics by RoutedTransport.send only
+                return session._send(message, sender, to_addrs, False)
+            except smtplib.SMTPException as error:
+                if not is_throttled(error):
+                    raise
+                self.router.throttle(account)
+                del self._sessions[account.name]
+                session.close()
+        raise smtplib.SMTPResponseException(
+            421, b'All accounts are throttled or over their quota')
@@ -0,0 +1,257 @@
+"""Suppression lists of bounced and unsubscribed addresses.
+
+A :class:`SuppressionIndex` is a file of sorted, fixed size digests of the
+suppressed addresses. It is memory-mapped and searched with a binary search,
+so it costs no memory beyond the pages the operating system caches. Most
+recipients are not suppressed, and a :class:`BloomFilter` built over the same
+digests answers those lookups without touching the file at all. The filter is
+written next to the index, as ``<path>.bloom``, and memory-mapped as well, so
+opening an index takes the same time whatever the size of the list.
+
+The index plugs into :func:`auto_emailer.bulk.send_bulk` as a stage::
+
+    index = SuppressionIndex('/path/to/suppressed.idx')
+    send_bulk(transport, rows, sender, subject, text,
+              stages=[index.filter])
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+DIGEST_SIZE = 16
+
+# magic, bits, hashes, then the inode, size and modification time of the
+# index the filter was built for
+_BLOOM_HEADER = struct.Struct('<8sQQQQq')
+_BLOOM_MAGIC = b'AEBLOOM1'
+
+
+def address_digest(address):
+    """Return the digest an address is stored under.
+
+    Args:
+        address (str): Email address. Surrounding whitespace and case are
+            ignored.
+
+    Returns:
+        bytes: `DIGEST_SIZE` bytes.
+    """
+    return hashlib.blake2b(address.strip().lower().encode('utf-8'),
+                           digest_size=DIGEST_SIZE).digest()
+
+
+class BloomFilter:
+    """Probabilistic set of digests, without false negatives."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Args:
+            capacity (int): Number of items the filter is sized for.
+            error_rate (float): Wanted false positive rate at `capacity`.
+        """
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @classmethod
+    def from_buffer(cls, size, hashes, bits):
+        """Return a filter over existing bits, such as a memory map.
+
+        Args:
+            size (int): Number of bits of the filter.
+            hashes (int): Number of positions per digest.
+            bits (Union[bytearray, memoryview]): The bits.
+
+        Returns:
+            auto_emailer.suppression.BloomFilter: The filter.
+        """
+        bloom = cls.__new__(cls)
+        bloom.size = size
+        bloom.hashes = hashes
+        bloom._bits = bits
+        return bloom
+
+    def to_bytes(self):
+        """Return: bytes: The bits of the filter."""
+        return bytes(self._bits)
+
+    def _positions(self, digest):
+        # double hashing over the two halves of the digest
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, digest):
+        """Add a digest from :func:`address_digest` to the filter."""
+        for position in self._positions(digest):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(digest))
+
+
+class SuppressionIndex:
+    """Read-only, memory-mapped index of suppressed addresses."""
+
+    def __init__(self, path, error_rate=0.01):
+        """
+        Args:
+            path (str): Path of an index written by
+                :meth:`SuppressionIndex.build`.
+            error_rate (float): False positive rate of the Bloom filter,
+                if it is built here because the index has no up to date
+                filter file.
+
+        Raises:
+            ValueError: If the file is not a suppression index.
+        """
+        self.path = path
+        self.dropped = 0
+        self._map = None
+        self._bloom_map = None
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size % DIGEST_SIZE:
+                raise ValueError('File {} is not a valid suppression index.'
+                                 .format(path))
+            self._count = stat.st_size // DIGEST_SIZE
+            if self._count:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        self._bloom = self._load_bloom(stat)
+        if self._bloom is None:
+            self._bloom = BloomFilter(self._count, error_rate)
+            for digest in self._digests():
+                self._bloom.add(digest)
+
+    def _load_bloom(self, stat):
+        """Map the filter file of the index, or return None if it is
+        missing or was not built for this version of the index.
+        """
+        try:
+            with open(_bloom_path(self.path), 'rb') as file:
+                bloom_map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(bloom_map) >= _BLOOM_HEADER.size:
+            magic, size, hashes, *index = _BLOOM_HEADER.unpack(
+                bloom_map[:_BLOOM_HEADER.size])
+            if (magic == _BLOOM_MAGIC and index == _identity(stat) and
+                    len(bloom_map) == _BLOOM_HEADER.size + (size + 7) // 8):
+                self._bloom_map = bloom_map
+                return BloomFilter.from_buffer(
+                    size, hashes,
+                    memoryview(bloom_map)[_BLOOM_HEADER.size:])
+        bloom_map.close()
+        return None
+
+    @classmethod
+    def build(cls, path, addresses, merge=True, error_rate=0.01):
+        """Write an index of `addresses` to `path`, and its Bloom filter to
+        `<path>.bloom`.
+
+        The files are replaced atomically, so readers never see a partial
+        index. The filter records the inode, size and modification time of
+        the index it was built for, and a reader opening the index between the
+        two replacements builds the filter itself.
+
+        Args:
+            path (str): Path of the index file.
+            addresses (Iterable[str]): Addresses to suppress.
+            merge (bool): If True, keep the entries of an existing index
+                at `path`.
+            error_rate (float): False positive rate of the Bloom filter.
+
+        Returns:
+            auto_emailer.suppression.SuppressionIndex: The new index.
+        """
+        digests = {address_digest(address) for address in addresses}
+        if merge and os.path.exists(path):
+            existing = cls(path)
+            digests.update(existing._digests())
+            existing.close()
+
+        bloom = BloomFilter(len(digests), error_rate)
+        for digest in digests:
+            bloom.add(digest)
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as file:
+            file.write(b''.join(sorted(digests)))
+        stat = os.stat(temp_path)
+        bloom_path = _bloom_path(path)
+        temp_bloom_path = '{}.tmp'.format(bloom_path)
+        with open(temp_bloom_path, 'wb') as file:
+            file.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, bloom.size,
+                                          bloom.hashes, *_identity(stat)))
+            file.write(bloom.to_bytes())
+        os.replace(temp_bloom_path, bloom_path)
+        os.replace(temp_path, path)
+        return cls(path, error_rate)
+
+    def _digests(self):
+        for offset in range(0, self._count * DIGEST_SIZE, DIGEST_SIZE):
+            yield self._map[offset:offset + DIGEST_SIZE]
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, address):
+        digest = address_digest(address)
+        if digest not in self._bloom:
+            return False
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * DIGEST_SIZE
+            found = self._map[offset:offset + DIGEST_SIZE]
+            if found < digest:
+                low = middle + 1
+            elif found > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def filter(self, rows, address_key='email'):
+        """Drop the rows of suppressed recipients from a row stream.
+
+        Args:
+            rows (Iterable[dict]): The recipient rows.
+            address_key (str): Key of the recipient address in each row.
+
+        Yields:
+            dict: The rows whose recipient is not suppressed.
+        """
+        for row in rows:
+            if row[address_key] in self:
+                self.dropped += 1
+                continue
+            yield row
+
+    def close(self):
+        """Unmap the index and filter files."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._bloom_map is not None:
+            self._bloom._bits.release()
+            self._bloom_map.close()
+            self._bloom_map = None
+
+
+def _bloom_path(path):
+    """Return the path of the Bloom filter file of an index."""
+    return '{}.bloom'.format(path)
+
+
+def _identity(stat):
+    """Return what tells a version of an index file from another."""
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
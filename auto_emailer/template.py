@@ -0,0 +1,280 @@
+"""Template engine for email message bodies.
+
+Templates are compiled once into a Python code object, so rendering is a
+plain function call with no parsing involved. :func:`load_template` caches
+the compiled template of a file until the file is modified.
+
+The syntax is a small subset of Jinja::
+
+    Hello {{ name }},
+    {% if coupon %}
+    Use {{ coupon.code|upper }} for {{ coupon.discount }}% off.
+    {% endif %}
+    {% for item in items %}
+    * {{ item.name }}: {{ item.price }}
+    {% endfor %}
+    {# comments are left out #}
+
+Values are looked up as keys first and attributes second. A missing value
+raises `KeyError` in `{{ }}` output, just like `str.format`, but is falsy in
+`{% if %}` conditions so that optional sections can simply be left out of
+the template arguments. A newline right after a `{% %}` or `{# #}` tag is
+removed, so block tags on their own line leave no blank lines behind.
+
+Filters are `e` (or `escape`) for HTML escaping, `safe` to opt out of
+`autoescape`, and `upper`, `lower`, `title` and `strip`.
+"""
+import functools
+import html
+import os
+import re
+
+_TOKEN = re.compile(r'({{.*?}}|{%.*?%}|{#.*?#})', re.DOTALL)
+_NAME = re.compile(r'^[A-Za-z_]\w*(\.\w+)*$')
+_FOR = re.compile(r'^for\s+([A-Za-z_]\w*)\s+in\s+(\S+)$')
+_MISSING = object()
+
+
+def _lookup(obj, key, path, default=_MISSING):
+    """Return `obj[key]` or `obj.key`, else `default` or KeyError(path)."""
+    try:
+        return obj[key]
+    except (KeyError, IndexError, TypeError):
+        pass
+    try:
+        return getattr(obj, key)
+    except AttributeError:
+        pass
+    if default is _MISSING:
+        raise KeyError(path)
+    return default
+
+
+def _escape(value):
+    return html.escape(str(value))
+
+
+_RUNTIME = {'_lookup': _lookup,
+            '_escape': _escape,
+            '_str': str,
+            '_f_upper': lambda value: str(value).upper(),
+            '_f_lower': lambda value: str(value).lower(),
+            '_f_title': lambda value: str(value).title(),
+            '_f_strip': lambda value: str(value).strip()}
+
+
+class _Compiler:
+    """Translate template source into the source of a `_render` function."""
+
+    def __init__(self, source, name, autoescape):
+        self.source = source
+        self.name = name
+        self.autoescape = autoescape
+        self.lines = ['def _render(_ctx):',
+                      '    _out = []',
+                      '    _write = _out.append']
+        self.depth = 1
+        self.blocks = []
+        self.scopes = []
+        self.counter = 0
+
+    def error(self, message):
+        return ValueError('{} in template {}'.format(message, self.name))
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def value(self, path, strict=True):
+        """Python expression looking up a dotted name."""
+        if not _NAME.match(path):
+            raise self.error('Invalid name {!r}'.format(path))
+        head, *attributes = path.split('.')
+        for scope in reversed(self.scopes):
+            if head in scope:
+                expression = scope[head]
+                break
+        else:
+            expression = ('_ctx[{!r}]' if strict
+                          else '_ctx.get({!r})').format(head)
+        for attribute in attributes:
+            expression = '_lookup({}, {!r}, {!r}{})'.format(
+                expression, attribute, path, '' if strict else ', None')
+        return expression
+
+    def condition(self, text):
+        words = text.split()
+        if not words:
+            raise self.error('Empty condition')
+        return ' '.join(word if word in ('and', 'or', 'not')
+                        else self.value(word, strict=False)
+                        for word in words)
+
+    def output(self, text):
+        path, *filters = [part.strip() for part in text.split('|')]
+        expression = self.value(path)
+        escape = self.autoescape
+        for name in filters:
+            if name == 'safe':
+                escape = False
+            elif name in ('e', 'escape'):
+                escape = True
+            elif '_f_{}'.format(name) in _RUNTIME:
+                expression = '_f_{}({})'.format(name, expression)
+            else:
+                raise self.error('Unknown filter {!r}'.format(name))
+        if escape:
+            return '_escape({})'.format(expression)
+        return '_str({})'.format(expression)
+
+    def open_block(self, kind, line):
+        self.emit(line)
+        self.depth += 1
+        self.emit('pass')
+        self.blocks.append(kind)
+
+    def close_block(self, kind):
+        if not self.blocks or self.blocks[-1] != kind:
+            raise self.error('Unexpected end{}'.format(kind))
+        self.blocks.pop()
+        self.depth -= 1
+        if kind == 'for':
+            self.scopes.pop()
+
+    def statement(self, text):
+        keyword = text.split(None, 1)[0] if text else ''
+        argument = text[len(keyword):].strip()
+        if keyword == 'if':
+            self.open_block('if', 'if {}:'.format(self.condition(argument)))
+        elif keyword in ('elif', 'else'):
+            if not self.blocks or self.blocks[-1] != 'if':
+                raise self.error('Unexpected {}'.format(keyword))
+            self.depth -= 1
+            self.blocks.pop()
+            line = ('elif {}:'.format(self.condition(argument))
+                    if keyword == 'elif' else 'else:')
+            self.open_block('if', line)
+        elif keyword == 'endif':
+            self.close_block('if')
+        elif keyword == 'for':
+            match = _FOR.match(text)
+            if not match:
+                raise self.error('Invalid loop {!r}'.format(text))
+            self.counter += 1
+            local = '_v{}'.format(self.counter)
+            iterable = self.value(match.group(2))
+            self.scopes.append({match.group(1): local})
+            self.open_block('for', 'for {} in {}:'.format(local, iterable))
+        elif keyword == 'endfor':
+            self.close_block('for')
+        else:
+            raise self.error('Unknown tag {!r}'.format(text))
+
+    def compile(self):
+        trim = False
+        for index, token in enumerate(_TOKEN.split(self.source)):
+            if index % 2 == 0:
+                if trim and token.startswith('\n'):
+                    token = token[1:]
+                if token:
+                    self.emit('_write({!r})'.format(token))
+                continue
+            trim = not token.startswith('{{')
+            if token.startswith('{{'):
+                self.emit('_write({})'.format(self.output(token[2:-2])))
+            elif token.startswith('{%'):
+                self.statement(token[2:-2].strip())
+        if self.blocks:
+            raise self.error('Unclosed {}'.format(self.blocks[-1]))
+        self.emit("return ''.join(_out)")
+        return '\n'.join(self.lines)
+
+
+class Template:
+    """A compiled template."""
+
+    def __init__(self, source, name='<string>', autoescape=False):
+        """
+        Args:
+            source (str): Text of the template.
+            name (str): Name of the template used in error messages.
+            autoescape (bool): If True, HTML escape every value that is not
+                marked `safe`.
+
+        Raises:
+            ValueError: If the template has a syntax error.
+        """
+        self.source = source
+        self.name = name
+        self.python_source = _Compiler(source, name, autoescape).compile()
+        self.code = compile(self.python_source, name, 'exec')
+        namespace = dict(_RUNTIME)
+        exec(self.code, namespace)
+        self._render = namespace['_render']
+
+    def render(self, *args, **kwargs):
+        """Render the template.
+
+        Args:
+            *args: An optional mapping of template values.
+            **kwargs: Template values.
+
+        Returns:
+            str: The rendered text.
+
+        Raises:
+            KeyError: If a value used in `{{ }}` output is missing.
+        """
+        if len(args) == 1 and not kwargs:
+            return self._render(args[0])
+        return self._render(dict(*args, **kwargs))
+
+
+@functools.lru_cache(maxsize=256)
+def compile_string(source, autoescape=False):
+    """Return the compiled template of `source`, cached by its text.
+
+    Args:
+        source (str): Text of the template.
+        autoescape (bool): If True, HTML escape every value.
+
+    Returns:
+        auto_emailer.template.Template: The compiled template.
+    """
+    return Template(source, autoescape=autoescape)
+
+
+_file_cache = {}
+
+
+def load_template(template_path, autoescape=False):
+    """Return the compiled template of a file.
+
+    The template is compiled on first use and again only after the file's
+    modification time changes.
+
+    Args:
+        template_path (str): File path of the template.
+        autoescape (bool): If True, HTML escape every value.
+
+    Returns:
+        auto_emailer.template.Template: The compiled template.
+
+    Raises:
+        FileNotFoundError: If cannot find the file from given
+            `template_path`.
+    """
+    key = (str(template_path), autoescape)
+    try:
+        mtime = os.stat(template_path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError('File path not found: {}'
+                                .format(template_path))
+    cached = _file_cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(template_path, encoding='utf-8') as file:
+        template = Template(file.read(), name=str(template_path),
+                            autoescape=autoescape)
+    _file_cache[key] = (mtime, template)
+    return template
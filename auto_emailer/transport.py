@@ -0,0 +1,516 @@
+"""Delivery backends for :class:`auto_emailer.emailer.Emailer`.
+
+A :class:`Transport` receives a message together with its envelope sender
+and recipients and delivers it somewhere. :class:`SMTPTransport` is the
+default and talks to the configured SMTP server; the other transports write
+to local sinks so that message production can be measured and exercised
+without an SMTP server in the loop.
+
+Every transport shares the batching (:meth:`Transport.send_many`) and the
+instrumentation (:class:`TransportStats`) of the base class.
+"""
+import collections
+import mailbox
+import re
+import smtplib
+import threading
+import time
+
+from . import metrics
+from .config.rotation import CredentialSource
+
+Envelope = collections.namedtuple('Envelope', 'message from_addr to_addrs')
+Envelope.__doc__ = """A message and its envelope sender and recipients."""
+
+_MBOX_FROM = re.compile(rb'^From ', re.MULTILINE)
+
+
+def _flatten(message):
+    """Return the bytes of `message` as they would be written to a sink.
+
+    Args:
+        message (Union[bytes, str, email.message.Message]): The message.
+
+    Returns:
+        bytes: The serialized message.
+    """
+    if isinstance(message, bytes):
+        return message
+    if isinstance(message, str):
+        return message.encode('utf-8')
+    if hasattr(message, 'as_bytes'):
+        return message.as_bytes()
+    raise ValueError('Transports only support bytes, str or '
+                     'email.message.Message objects.')
+
+
+def _wire_size(message):
+    """Return the size of `message` once its line endings are CRLF, as
+    counted against the SIZE limit of an SMTP server.
+    """
+    data = _flatten(message)
+    return len(data) + data.count(b'\n') - data.count(b'\r\n')
+
+
+class TransportStats:
+    """Delivery counters shared by a transport and the sessions it spawns."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Set every counter back to zero."""
+        with self._lock:
+            self.messages = 0
+            self.failures = 0
+            self.bytes = 0
+            self.batches = 0
+            self.seconds = 0.0
+
+    def record(self, size, seconds):
+        """Record a delivered message.
+
+        Args:
+            size (int): Number of bytes delivered, 0 if unknown.
+            seconds (float): Time spent delivering the message.
+        """
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            self.seconds += seconds
+
+    def record_failure(self, seconds):
+        """Record a failed delivery attempt.
+
+        Args:
+            seconds (float): Time spent before the attempt failed.
+        """
+        with self._lock:
+            self.failures += 1
+            self.seconds += seconds
+
+    def record_batch(self):
+        """Record a completed :meth:`Transport.send_many` call."""
+        with self._lock:
+            self.batches += 1
+
+    @property
+    def throughput(self):
+        """float: Delivered messages per second spent in delivery."""
+        if not self.seconds:
+            return 0.0
+        return self.messages / self.seconds
+
+    def snapshot(self):
+        """Return: dict: A consistent copy of the counters."""
+        with self._lock:
+            return {'messages': self.messages,
+                    'failures': self.failures,
+                    'bytes': self.bytes,
+                    'batches': self.batches,
+                    'seconds': self.seconds}
+
+
+class Transport:
+    """Base class for message delivery backends.
+
+    Subclasses implement :meth:`_deliver` and, if they hold a connection or
+    file handle, :meth:`_open` and :meth:`_close`.
+    """
+
+    def __init__(self, stats=None):
+        """
+        Args:
+            stats (Optional[TransportStats]): Counters to record deliveries
+                in. A new instance is created if None.
+        """
+        self.stats = stats if stats is not None else TransportStats()
+        self._lock = threading.Lock()
+        self._connected = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def connected(self):
+        """Return: bool: If the transport is open or not."""
+        return self._connected
+
+    def open(self):
+        """Open the transport if it is not already open."""
+        if not self._connected:
+            self._open()
+            self._connected = True
+
+    def close(self):
+        """Close the transport if it is open."""
+        if self._connected:
+            try:
+                self._close()
+            finally:
+                self._connected = False
+
+    def spawn(self):
+        """Return a transport usable as an independent, concurrent session.
+
+        Transports whose sink is safe to share between threads return
+        themselves; connection based transports return a new instance
+        sharing the same :attr:`stats`.
+
+        Returns:
+            auto_emailer.transport.Transport: The session transport.
+        """
+        return self
+
+    def send(self, message, from_addr=None, to_addrs=None):
+        """Deliver a single message, opening the transport if needed.
+
+        Args:
+            message (Union[bytes, str, email.message.Message]): The message.
+            from_addr (Optional[str]): The envelope sender.
+            to_addrs (Optional(Sequence[str])): The envelope recipients.
+
+        Returns:
+            int: Number of bytes delivered, 0 if unknown.
+        """
+        return self._send(message, from_addr, to_addrs, metrics.ENABLED)
+
+    def _send(self, message, from_addr, to_addrs, record_metrics):
+        """Deliver a message as :meth:`send` does, recording it in the
+        metrics only if `record_metrics` is True. Transports delivering
+        through other transports call it on them with False, so that a
+        message is counted once.
+        """
+        if not self._connected:
+            self.open()
+        start = time.perf_counter()
+        try:
+            size = self._deliver(message, from_addr, to_addrs)
+        except Exception:
+            self.stats.record_failure(time.perf_counter() - start)
+            if record_metrics:
+                metrics.MESSAGES_FAILED.inc()
+            raise
+        seconds = time.perf_counter() - start
+        self.stats.record(size, seconds)
+        if record_metrics:
+            metrics.MESSAGES_SENT.inc()
+            metrics.BYTES_SENT.inc(size)
+            metrics.SEND_SECONDS.observe(seconds)
+        return size
+
+    def check_size(self, message, from_addr=None):
+        """Raise if `message` is known to exceed what the transport
+        accepts. The base class accepts any size.
+
+        Args:
+            message (Union[bytes, str, email.message.Message]): The message.
+            from_addr (Optional[str]): The envelope sender.
+
+        Raises:
+            smtplib.SMTPSenderRefused: If the message is too large.
+        """
+
+    def send_many(self, envelopes):
+        """Deliver a batch of messages over a single open transport.
+
+        The transport is closed afterwards only if it was opened here.
+
+        Args:
+            envelopes (Iterable[auto_emailer.transport.Envelope]): The
+                messages to deliver.
+
+        Returns:
+            int: The number of messages delivered.
+        """
+        opened = not self._connected
+        self.open()
+        count = 0
+        try:
+            for message, from_addr, to_addrs in envelopes:
+                self.send(message, from_addr, to_addrs)
+                count += 1
+        finally:
+            if opened:
+                self.close()
+        self.stats.record_batch()
+        return count
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _deliver(self, message, from_addr, to_addrs):
+        """Deliver `message` and return the number of bytes written."""
+        raise NotImplementedError
+
+
+class SMTPTransport(Transport):
+    """Deliver messages to the SMTP server described by a Credentials.
+
+    The SIZE limit a server advertises in its EHLO reply is remembered for
+    every server. Once it is known, messages over the limit are refused by
+    :meth:`check_size`, which :meth:`Emailer.send_email
+    <auto_emailer.emailer.Emailer.send_email>` calls before a session is
+    opened, rather than by the server after the message was uploaded. The
+    first connection to a server learns the limit, and the message is then
+    checked before DATA.
+    """
+
+    # (host, port) of every server connected to -> its SIZE limit
+    _size_limits = {}
+
+    def __init__(self, config, stats=None, endpoints=None, starttls=True,
+                 authenticate=True, timeout=None):
+        """
+        Args:
+            config (Union[config.credentials.Credentials,
+                config.rotation.CredentialSource]): The credentials used to
+                connect and log in to the SMTP server. With a
+                CredentialSource, every session logs in with the credentials
+                current when it connects.
+            stats (Optional[TransportStats]): Counters to record deliveries
+                in.
+            endpoints (Optional[auto_emailer.endpoints.EndpointSet]): Relays
+                to connect to instead of the host and port of `config`.
+            starttls (bool): If False, the session is not encrypted, for
+                local relays and test servers without TLS.
+            authenticate (bool): If False, the session does not log in, for
+                relays that accept mail without authentication.
+            timeout (Optional[float]): Socket timeout of the sessions, in
+                seconds. Defaults to the socket module default. Through
+                `endpoints`, connecting is bounded by the connect timeout
+                of the EndpointSet instead.
+        """
+        super().__init__(stats)
+        self._config = config
+        self._smtp = None
+        self.endpoints = endpoints
+        self.starttls = starttls
+        self.authenticate = authenticate
+        self.timeout = timeout
+        self.endpoint = None
+        self.refused = {}
+        # the last message measured and its size on the wire
+        self._measured = None
+
+    @property
+    def config(self):
+        """config.credentials.Credentials: The SMTP credentials new sessions
+        log in with.
+        """
+        if isinstance(self._config, CredentialSource):
+            return self._config.current()
+        return self._config
+
+    def spawn(self):
+        return SMTPTransport(self._config, stats=self.stats,
+                             endpoints=self.endpoints, starttls=self.starttls,
+                             authenticate=self.authenticate,
+                             timeout=self.timeout)
+
+    def _open(self):
+        try:
+            self._connect()
+        except Exception:
+            # the transport is not open, close would not quit the session
+            if self._smtp is not None:
+                self._smtp.close()
+                self._smtp = None
+            raise
+
+    def _connect(self):
+        config = self.config
+        if self.endpoints is not None:
+            # connects and says 'hello' to the best endpoint that answers
+            self._smtp, self.endpoint = self.endpoints.connect(self.timeout)
+        else:
+            kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+            self._smtp = smtplib.SMTP(host=config.host, port=config.port,
+                                      **kwargs)
+            # send 'hello' to SMTP server
+            self._smtp.ehlo()
+        # start TLS encryption
+        if self.starttls:
+            self._smtp.starttls()
+        if self.authenticate:
+            self._login(config)
+        # STARTTLS forgets the EHLO reply, login would have repeated it
+        self._smtp.ehlo_or_helo_if_needed()
+        size = self._smtp.esmtp_features.get('size')
+        if isinstance(size, str) and size.isdigit() and int(size):
+            self._size_limits[self._server()] = int(size)
+
+    def _login(self, config):
+        try:
+            self._smtp.login(config.sender_email, config.password)
+        except smtplib.SMTPAuthenticationError:
+            # the password may have been rotated before the source was polled
+            if not (isinstance(self._config, CredentialSource) and
+                    self._config.refresh()):
+                raise
+            config = self.config
+            self._smtp.login(config.sender_email, config.password)
+
+    def _server(self):
+        if self.endpoint is not None:
+            return self.endpoint.host, self.endpoint.port
+        config = self.config
+        return config.host, config.port
+
+    @property
+    def max_size(self):
+        """Optional[int]: SIZE limit advertised by the server, or None if
+        unknown or unlimited.
+        """
+        return self._size_limits.get(self._server())
+
+    def check_size(self, message, from_addr=None):
+        limit = self.max_size
+        if limit is None:
+            return
+        size = self._measure(message)
+        if size > limit:
+            self._measured = None
+            raise smtplib.SMTPSenderRefused(
+                552, 'Message size {} exceeds the SIZE limit {} of the '
+                     'server'.format(size, limit).encode('ascii'), from_addr)
+
+    def _close(self):
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+        self._smtp = None
+
+    def _measure(self, message):
+        """Return the size of `message` on the wire, measuring it once
+        between the check before connecting and the delivery.
+        """
+        measured = self._measured
+        if measured is not None and measured[0] is message:
+            return measured[1]
+        size = _wire_size(message)
+        self._measured = (message, size)
+        return size
+
+    def _deliver(self, message, from_addr, to_addrs):
+        try:
+            self.check_size(message, from_addr)
+            # recipients refused while others were accepted, by address
+            if isinstance(message, (str, bytes)):
+                self.refused = self._smtp.sendmail(
+                    msg=message, from_addr=from_addr,
+                    to_addrs=to_addrs) or {}
+            else:
+                self.refused = self._smtp.send_message(
+                    msg=message, from_addr=from_addr,
+                    to_addrs=to_addrs) or {}
+            # bytes are sent as they are, strings and message objects are
+            # encoded with CRLF line endings
+            if isinstance(message, bytes):
+                return len(message)
+            return self._measure(message)
+        finally:
+            self._measured = None
+
+
+class NullTransport(Transport):
+    """Serialize and discard every message.
+
+    Useful for measuring how fast messages are produced, since the cost of
+    serialization is kept but nothing is written anywhere.
+    """
+
+    def _deliver(self, message, from_addr, to_addrs):
+        return len(_flatten(message))
+
+
+class MemoryTransport(Transport):
+    """Keep every delivered message in :attr:`outbox`."""
+
+    def __init__(self, stats=None):
+        super().__init__(stats)
+        self.outbox = []
+
+    def _deliver(self, message, from_addr, to_addrs):
+        data = _flatten(message)
+        self.outbox.append(Envelope(data, from_addr, to_addrs))
+        return len(data)
+
+
+class MaildirTransport(Transport):
+    """Write every message as a file in a maildir directory."""
+
+    def __init__(self, path, stats=None):
+        """
+        Args:
+            path (str): Directory of the maildir. Created if missing.
+            stats (Optional[TransportStats]): Counters to record deliveries
+                in.
+        """
+        super().__init__(stats)
+        self.path = path
+        self._maildir = None
+
+    def _open(self):
+        self._maildir = mailbox.Maildir(self.path, create=True)
+
+    def _close(self):
+        self._maildir = None
+
+    def _deliver(self, message, from_addr, to_addrs):
+        data = _flatten(message)
+        with self._lock:
+            self._maildir.add(data)
+        return len(data)
+
+
+class MboxTransport(Transport):
+    """Append every message to a single mbox file.
+
+    Messages are written through a buffered file handle opened in append
+    mode, so a batch costs a handful of write system calls rather than one
+    per message. The buffer is flushed when the transport is closed.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20, stats=None):
+        """
+        Args:
+            path (str): Path of the mbox file. Created if missing.
+            buffer_size (int): Size in bytes of the write buffer.
+            stats (Optional[TransportStats]): Counters to record deliveries
+                in.
+        """
+        super().__init__(stats)
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = None
+
+    def _open(self):
+        self._file = open(self.path, 'ab', buffering=self.buffer_size)
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+
+    def _deliver(self, message, from_addr, to_addrs):
+        data = _flatten(message).replace(b'\r\n', b'\n')
+        # mboxo escaping of body lines that would look like separators
+        data = _MBOX_FROM.sub(b'>From ', data)
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        separator = 'From {} {}\n'.format(from_addr or 'MAILER-DAEMON',
+                                          time.asctime(time.gmtime()))
+        with self._lock:
+            self._file.write(separator.encode('ascii', 'replace'))
+            self._file.write(data)
+            self._file.write(b'\n')
+        return len(data)
@@ -0,0 +1,76 @@
+"""Compare attaching a large file with Message.attach, which memory-maps it
+and base64 encodes it slice by slice, against reading the whole file and
+encoding it with email.encoders.encode_base64, as Message.attach used to.
+
+Each way runs in a fresh process, which reports its peak resident set size
+above the size it had before attaching, and the encoding throughput.
+
+Run from the repository root, optionally with the file size in MB::
+
+    PYTHONPATH=. python benchmarks/bench_attach.py 256
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from email import encoders
+from email.mime.base import MIMEBase
+
+from auto_emailer import Message
+
+SIZE_MB = 128
+
+
+def _peak_rss_mb():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _read_all(path):
+    """The former Message.attach."""
+    part = MIMEBase('application', 'octet-stream')
+    with open(path, 'rb') as file:
+        part.set_payload(file.read())
+    encoders.encode_base64(part)
+    return part
+
+
+def _mapped(path):
+    message = Message('me@example.com', ['you@example.com'], 'Report')
+    return message.attach([path]).message
+
+
+def _child(way, path):
+    attach = {'read-all': _read_all, 'mmap': _mapped}[way]
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    attach(path)
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(path) / 1e6
+    print('{:<10} {:8.1f} MB peak RSS above baseline {:8.3f}s '
+          '{:8.1f} MB/s'.format(way, _peak_rss_mb() - baseline, seconds,
+                                size / seconds))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZE_MB
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'attachment.bin')
+        with open(path, 'wb') as file:
+            for _ in range(size):
+                file.write(os.urandom(1 << 20))
+        print('attaching {} MB, base64 output {:.0f} MB'.format(
+            size, size * 4 / 3 * 77 / 76))
+        for way in ('read-all', 'mmap'):
+            subprocess.check_call([sys.executable, __file__, '--child', way,
+                                   path])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        _child(*sys.argv[2:4])
+    else:
+        main()
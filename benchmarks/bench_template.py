@@ -0,0 +1,71 @@
+"""Compare rendering a receipt body 100k times with a template compiled once
+and cached by auto_emailer.template.load_template, against parsing the
+template again on every render, and against plain str.format.
+
+Run from the repository root::
+
+    PYTHONPATH=. python benchmarks/bench_template.py
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from auto_emailer import template
+
+RENDERS = 100000
+
+SOURCE = """Hello {{ name|title }},
+{% if coupon %}
+Use {{ coupon.code|upper }} for {{ coupon.discount }}% off your next order.
+{% endif %}
+Your order:
+{% for item in items %}
+* {{ item.name }}: {{ item.price }}
+{% endfor %}
+Thanks!
+"""
+
+FORMAT_SOURCE = """Hello {name},
+Use {code} for {discount}% off your next order.
+Your order:
+{items}
+Thanks!
+"""
+
+ARGS = {'name': 'ada lovelace',
+        'coupon': {'code': 'spring', 'discount': 10},
+        'items': [{'name': 'Notebook', 'price': '4.99'},
+                  {'name': 'Pencil', 'price': '0.99'},
+                  {'name': 'Eraser', 'price': '1.49'}]}
+
+
+def _timed(label, render):
+    start = time.perf_counter()
+    for _ in range(RENDERS):
+        render()
+    seconds = time.perf_counter() - start
+    print('{:<28} {:8.3f}s {:>10,.0f} renders/s'.format(
+        label, seconds, RENDERS / seconds))
+    return seconds
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'receipt.txt'
+        path.write_text(SOURCE)
+
+        compiled = _timed('compiled, cached by mtime',
+                          lambda: template.load_template(path).render(ARGS))
+        parsed = _timed('parsed on every render',
+                        lambda: template.Template(path.read_text())
+                        .render(ARGS))
+        _timed('str.format (no loops)',
+               lambda: FORMAT_SOURCE.format(
+                   name=ARGS['name'], code='SPRING', discount=10,
+                   items='\n'.join('* {name}: {price}'.format(**item)
+                                   for item in ARGS['items'])))
+    print('speedup over re-parsing: {:.1f}x'.format(parsed / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,12 @@ setup(name='auto_emailer',
       author='Adam Stueckrath',
       author_email='stueckrath.adam@gmail.com',
       url='https://github.com/adamstueckrath/auto-emailer',
-      packages=['auto_emailer'],
+      packages=['auto_emailer', 'auto_emailer.config'],
       install_requires=['six>=1.9.0'],
+      entry_points={
+            'console_scripts': [
+                  'auto-emailer = auto_emailer.cli:main',
+                  'auto-emailer-load = auto_emailer.cli:load_main']},
       tests_require=['six>=1.9.0'],
       keywords='smtp email',
       license='MIT',
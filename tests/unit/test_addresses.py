@@ -0,0 +1,73 @@
+import unittest
+
+from auto_emailer import Message, addresses, bulk, transport
+
+
+class TestAddresses(unittest.TestCase):
+
+    def test_normalize_address(self):
+        """Test addresses.normalize_address() lower cases and IDNA encodes
+        the domain, keeps the local part and strips display names.
+        """
+        self.assertEqual(addresses.normalize_address(' Friend@GMAIL.com '),
+                         'Friend@gmail.com')
+        self.assertEqual(addresses.normalize_address('Friend <me@bücher.de>'),
+                         'me@xn--bcher-kva.de')
+        self.assertEqual(addresses.normalize_address('first.last+tag@x.co.uk'),
+                         'first.last+tag@x.co.uk')
+
+    def test_normalize_address_invalid(self):
+        """Test addresses.normalize_address() raises ValueError on
+        syntactically invalid addresses.
+        """
+        for address in ['', 'friend', 'friend@', '@gmail.com',
+                        'a..b@gmail.com', 'friend@localhost',
+                        'friend@-gmail.com', 'friend@gmail..com']:
+            with self.assertRaises(ValueError):
+                addresses.normalize_address(address)
+
+    def test_normalize_many(self):
+        """Test addresses.normalize_many() deduplicates normalized
+        addresses in input order and returns the invalid ones.
+        """
+        valid, invalid = addresses.normalize_many(
+            ['b@x.com', 'a@X.com', 'b@x.COM', 'bad'])
+        self.assertEqual(valid, ['b@x.com', 'a@x.com'])
+        self.assertEqual(invalid, ['bad'])
+
+    def test_validate_recipients(self):
+        """Test addresses.validate_recipients() dedupes across To, CC
+        and BCC keeping the first occurrence.
+        """
+        to, cc, bcc, invalid = addresses.validate_recipients(
+            ['a@x.com'], ['A@X.com', 'b@x.com'], ['b@x.com', 'c@x.com', 'bad@'])
+        self.assertEqual((to, cc, bcc, invalid),
+                         (['a@x.com'], ['b@x.com'], ['c@x.com'], ['bad@']))
+
+    def test_message_validate(self):
+        """Test auto_emailer.Message with validate=True normalizes its
+        recipients and raises ValueError on invalid addresses.
+        """
+        message = Message('me@gmail.com', ['a@X.com'], 'Hi',
+                          cc=['a@x.com', 'b@x.com'], validate=True)
+        self.assertEqual(message.recipients, ['a@x.com', 'b@x.com'])
+        with self.assertRaises(ValueError):
+            Message('me@gmail.com', ['not an address'], 'Hi', validate=True)
+
+    def test_address_validator_stage(self):
+        """Test addresses.AddressValidator.filter() used as a
+        bulk.send_bulk() stage drops invalid rows and normalizes the rest.
+        """
+        rows = [{'email': 'A@GMAIL.com'}, {'email': 'nope'},
+                {'email': 'b@gmail.com'}]
+        validator = addresses.AddressValidator()
+        sink = transport.MemoryTransport()
+        report = bulk.send_bulk(sink, rows, 'me@gmail.com', 'Hi', text='Hello',
+                                stages=[validator.filter])
+        self.assertEqual(report.sent, 2)
+        self.assertEqual(validator.rejected, 1)
+        self.assertEqual(sink.outbox[0].to_addrs, ['A@gmail.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
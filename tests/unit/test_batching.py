@@ -0,0 +1,74 @@
+import unittest
+
+from auto_emailer import Message, batching, bulk, transport
+
+
+def _rows(*domains):
+    return [{'email': 'user{}@{}'.format(index, domain)}
+            for index, domain in enumerate(domains)]
+
+
+class _RefusingTransport(transport.MemoryTransport):
+    """MemoryTransport refusing recipients whose address starts with 'x',
+    reporting them like SMTPTransport.refused.
+    """
+
+    def _deliver(self, message, from_addr, to_addrs):
+        self.refused = {address: (550, b'No such user')
+                        for address in to_addrs if address.startswith('x')}
+        return super()._deliver(message, from_addr, to_addrs)
+
+
+class TestBatching(unittest.TestCase):
+
+    def test_batches_interleave(self):
+        """Test batching.DomainBatcher.batches() groups rows by domain in
+        batches of at most batch_size, serving the domains in turn.
+        """
+        rows = _rows('a.com', 'B.com', 'a.com', 'c.com', 'a.com', 'b.com',
+                     'a.com', 'a.com')
+        batcher = batching.DomainBatcher(batch_size=2)
+        batches = [[batching.domain_of(row['email']) for row in batch]
+                   for batch in batcher.batches(rows)]
+        self.assertEqual(batches, [['a.com', 'a.com'], ['b.com', 'b.com'],
+                                   ['c.com'], ['a.com', 'a.com'],
+                                   ['a.com']])
+        self.assertEqual(batcher.rows, 8)
+        self.assertEqual(batcher.mean_batch_size, 1.6)
+
+    def test_window_bounds_grouping(self):
+        """Test batching.DomainBatcher only groups rows within its window
+        and the filter stage keeps every row.
+        """
+        rows = _rows('a.com', 'b.com', 'a.com', 'b.com')
+        batcher = batching.DomainBatcher(window=1, batch_size=10)
+        self.assertEqual(list(batcher.filter(rows)), rows)
+        batcher = batching.DomainBatcher(window=4, batch_size=10)
+        self.assertEqual(list(batcher.filter(rows)),
+                         [rows[0], rows[2], rows[1], rows[3]])
+        with self.assertRaises(ValueError):
+            batching.DomainBatcher(window=0)
+
+    def test_send_batched(self):
+        """Test bulk.send_batched() sends one transaction per domain batch
+        and counts recipients refused within a transaction as failed.
+        """
+        rows = [{'email': address} for address in
+                ('a@gmail.com', 'x@yahoo.com', 'b@gmail.com', 'c@yahoo.com',
+                 'xx@gmail.com', 'a@gmail.com')]
+        message = Message('me@gmail.com', ['undisclosed-recipients:;'],
+                          'News').draft_message(text='Hello')
+        sink = _RefusingTransport()
+        report = bulk.send_batched(sink, rows, message,
+                                   batcher=batching.DomainBatcher())
+        self.assertEqual([envelope.to_addrs for envelope in sink.outbox],
+                         [['a@gmail.com', 'b@gmail.com', 'xx@gmail.com'],
+                          ['x@yahoo.com', 'c@yahoo.com']])
+        self.assertEqual((report.sent, report.failed, report.skipped),
+                         (3, 2, 1))
+        self.assertEqual(report.errors, {'SMTPRecipientsRefused': 2})
+        self.assertFalse(sink.connected)
+
+
+if __name__ == '__main__':
+    unittest.main()
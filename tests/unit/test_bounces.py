@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+
+from auto_emailer import bounces
+
+DSN = '''From MAILER-DAEMON Mon Oct 19 10:00:00 2026
+From: Mail Delivery System <MAILER-DAEMON@relay.example.com>
+To: me@example.com
+Subject: Undelivered Mail Returned to Sender
+MIME-Version: 1.0
+Content-Type: multipart/report; report-type=delivery-status;
+ boundary="BOUNDARY"
+
+--BOUNDARY
+Content-Type: text/plain
+
+The mail system could not deliver your message.
+Final-Recipient: rfc822; decoy@example.com
+Action: failed
+
+--BOUNDARY
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; relay.example.com
+
+Final-Recipient: rfc822; {hard}
+Action: failed
+Status: 5.1.1
+Diagnostic-Code: smtp; 550 5.1.1 User unknown
+
+Final-Recipient: rfc822; <{soft}>
+Action: failed
+Status: 4.2.2
+Diagnostic-Code: smtp; 452 Mailbox full
+
+Final-Recipient: rfc822; {delayed}
+Action: delayed
+Status: 4.4.1
+
+--BOUNDARY
+Content-Type: message/rfc822
+
+From: me@example.com
+To: {hard}
+Subject: Hello
+
+Final-Recipient: rfc822; nobody@example.com
+Action: failed
+Status: 5.0.0
+--BOUNDARY--
+
+'''
+
+PLAIN = '''From me@example.com Mon Oct 19 10:01:00 2026
+From: friend@gmail.com
+To: me@example.com
+Subject: Re: Hello
+Content-Type: text/plain
+
+Final-Recipient: rfc822; fake@example.com
+Action: failed
+Status: 5.1.1
+
+'''
+
+
+def _mbox(directory, linesep='\n'):
+    path = os.path.join(directory, 'bounces.mbox')
+    content = (DSN.format(hard='gone@gmail.com', soft='full@yahoo.com',
+                          delayed='slow@gmail.com') + PLAIN +
+               DSN.format(hard='Moved@Gmail.com', soft='busy@yahoo.com',
+                          delayed='late@gmail.com'))
+    with open(path, 'w', newline='') as file:
+        file.write(content.replace('\n', linesep))
+    return path
+
+
+class TestBounces(unittest.TestCase):
+
+    def test_parse(self):
+        """Test bounces.BounceParser.parse() extracts failed recipients of
+        delivery status parts only, ignoring other parts and messages.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = bounces.BounceParser()
+            records = list(parser.parse(_mbox(tmp)))
+        self.assertEqual([record.recipient for record in records],
+                         ['gone@gmail.com', 'full@yahoo.com',
+                          'Moved@Gmail.com', 'busy@yahoo.com'])
+        self.assertEqual(records[0].status, '5.1.1')
+        self.assertEqual(records[0].diagnostic,
+                         'smtp; 550 5.1.1 User unknown')
+        self.assertEqual(records[0].offset, 0)
+        self.assertGreater(records[2].offset, 0)
+        stats = parser.as_dict()
+        self.assertEqual((stats['messages'], stats['reports'],
+                          stats['records']), (3, 2, 4))
+        self.assertGreater(stats['throughput'], 0)
+
+    def test_hard_only_crlf(self):
+        """Test bounces.BounceParser with hard_only keeps 5.x.x failures,
+        in mbox files with CRLF line endings too.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = bounces.BounceParser(hard_only=True)
+            records = list(parser.parse(_mbox(tmp, linesep='\r\n')))
+            empty = os.path.join(tmp, 'empty.mbox')
+            open(empty, 'w').close()
+            self.assertEqual(list(parser.parse(empty)), [])
+        self.assertEqual([record.recipient for record in records],
+                         ['gone@gmail.com', 'Moved@Gmail.com'])
+
+    def test_suppress(self):
+        """Test bounces.BounceParser.suppress() adds the failed recipients
+        to a suppression index.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = _mbox(tmp)
+            index = bounces.BounceParser(hard_only=True).suppress(
+                [path], os.path.join(tmp, 'suppressed.idx'))
+            self.assertEqual(len(index), 2)
+            self.assertIn('moved@gmail.com', index)
+            self.assertNotIn('full@yahoo.com', index)
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import mailbox
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from auto_emailer import Message, bulk, pipeline, transport
+from auto_emailer.config.credentials import Credentials
+
+ROWS = [{'email': 'friend{}@gmail.com'.format(i), 'name': 'Friend {}'.format(i)}
+        for i in range(10)]
+
+
+class TestDryRun(unittest.TestCase):
+
+    def test_render_row(self):
+        """Test bulk.render_row() drafts a message for the row address
+        with the template formatted from the row values.
+        """
+        message = bulk.render_row(ROWS[0], 'me@gmail.com', 'Hi', 'Hello {name}')
+        self.assertEqual(message.destinations, ['friend0@gmail.com'])
+        self.assertIn(b'Hello Friend 0', message.as_bytes())
+
+    def test_dry_run_missing_keys(self):
+        """Test bulk.dry_run() writes rendered rows to the sink and
+        aggregates template KeyErrors in bulk.RenderReport.
+        """
+        rows = ROWS + [{'email': 'nobody@gmail.com'}] * 3
+        sink = transport.MemoryTransport()
+        report = bulk.dry_run(rows, sink, 'me@gmail.com', 'Hi',
+                              text='Hello {name}', workers=1)
+        self.assertEqual(report.rendered, 10)
+        self.assertEqual(report.failed, 3)
+        self.assertEqual(report.missing_keys, {'name': 3})
+        self.assertEqual(len(sink.outbox), 10)
+        self.assertEqual(sink.outbox[3].to_addrs, ['friend3@gmail.com'])
+        self.assertEqual(report.bytes, sink.stats.bytes)
+
+    def test_dry_run_parallel_mbox(self):
+        """Test bulk.dry_run() renders in worker processes, keeps row
+        order and writes a single mbox file.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'campaign.mbox')
+            report = bulk.dry_run(ROWS, transport.MboxTransport(path),
+                                  'me@gmail.com', 'Hi', text='Hello {name}',
+                                  workers=2, chunksize=2)
+            messages = list(mailbox.mbox(path))
+        self.assertEqual(report.rendered, 10)
+        self.assertEqual([m['To'] for m in messages],
+                         [row['email'] for row in ROWS])
+
+
+class TestSend(unittest.TestCase):
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_send_crlf(self, mock_smtplib):
+        """Test bulk.send_bulk(), bulk.send_batched() and the pipeline pass
+        sendmail messages with CRLF line endings only.
+        """
+        instance = mock_smtplib.return_value
+        instance.sendmail.return_value = {}
+        instance.esmtp_features = {}
+        smtp = transport.SMTPTransport(Credentials(
+            'me@gmail.com', 'password', 587, 'smtp.gmail.com'))
+        bulk.send_bulk(smtp, ROWS[:2], 'me@gmail.com', 'Hi',
+                       text='Hello\n{name}\n')
+        message = Message('me@gmail.com', ['undisclosed-recipients:;'],
+                          'News').draft_message(text='Hello\nall\n')
+        bulk.send_batched(smtp, ROWS[:2], message)
+        pipeline.Pipeline(smtp, workers=1, senders=1).run(
+            ROWS[:2], 'me@gmail.com', 'Hi', text='Hello\n{name}\n')
+        sent = [call[1]['msg'] for call in instance.sendmail.call_args_list]
+        self.assertEqual(len(sent), 5)
+        for data in sent:
+            self.assertIn(b'\r\n\r\nHello\r\n', data)
+            self.assertEqual(data.count(b'\n'), data.count(b'\r\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from auto_emailer import cli
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_load_null(self):
+        """Test cli.load_main() sends the requested messages, with their
+        recipients and attachments, and writes a JSON summary.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'summary.json')
+            status = cli.load_main(['--null', '--count', '20',
+                                    '--concurrency', '3', '--recipients', '2',
+                                    '--attachment-size', '5000',
+                                    '--interval', '0', '--json', path])
+            with open(path) as file:
+                summary = json.load(file)
+        self.assertEqual(status, 0)
+        self.assertEqual((summary['sent'], summary['failed']), (20, 0))
+        self.assertGreater(summary['bytes'], 20 * 5000)
+        self.assertLessEqual(summary['latency_ms']['p50'],
+                             summary['latency_ms']['max'])
+        self.assertEqual(summary['options']['attachment_sizes'], [5000])
+
+    def test_load_rate_progress(self):
+        """Test cli.run_load() paces the messages at the target rate and
+        prints progress lines.
+        """
+        args = cli.load_parser().parse_args(
+            ['--null', '--duration', '0.3', '--rate', '50',
+             '--interval', '0.1'])
+        out = io.StringIO()
+        start = time.perf_counter()
+        stats = cli.run_load(args, out=out)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.3)
+        self.assertLessEqual(stats.sent, 16)
+        self.assertGreaterEqual(stats.sent, 10)
+        self.assertIn('msg/s', out.getvalue())
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_load_smtp_options(self, mock_smtplib):
+        """Test cli.load_main() connects to --host without TLS or login
+        when asked to, and exits with 1 when messages fail.
+        """
+        instance = mock_smtplib.return_value
+        instance.sendmail.side_effect = [{}, OSError('Broken pipe'), {}]
+        with mock.patch('sys.stdout', new=io.StringIO()) as stdout:
+            status = cli.load_main(['--host', 'localhost', '--port', '1025',
+                                    '--no-tls', '--no-auth', '--count', '3',
+                                    '--concurrency', '1', '--interval', '0'])
+        summary = json.loads(stdout.getvalue())
+        mock_smtplib.assert_called_with(host='localhost', port=1025)
+        self.assertEqual(instance.starttls.call_count, 0)
+        self.assertEqual(instance.login.call_count, 0)
+        self.assertEqual(status, 1)
+        self.assertEqual(summary['errors'], {'OSError': 1})
+
+
+class TestSend(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.template = os.path.join(self.tmp, 'template.txt')
+        with open(self.template, 'w') as file:
+            file.write('Hello {name}')
+
+    def _send(self, recipients, *options):
+        out = io.StringIO()
+        with mock.patch('sys.stderr', new=out):
+            status = cli.main(['send', self.template, recipients,
+                               '--subject', 'News', '--sender',
+                               'me@gmail.com', '--workers', '1',
+                               '--interval', '0', '--null'] + list(options))
+        return status, out.getvalue()
+
+    def test_send_resume(self):
+        """Test cli.main() send streams a CSV file through the pipeline,
+        journals the delivered rows and skips them when run again.
+        """
+        recipients = os.path.join(self.tmp, 'recipients.csv')
+        with open(recipients, 'w') as file:
+            file.write('email,name\n')
+            for index in range(5):
+                file.write('friend{0}@gmail.com,Friend {0}\n'.format(index))
+        summary = os.path.join(self.tmp, 'summary.json')
+        status, out = self._send(recipients, '--json', summary)
+        self.assertEqual(status, 0)
+        self.assertIn('Sent 5, skipped 0, failed 0', out)
+        with open(summary) as file:
+            self.assertEqual(json.load(file)['sent'], 5)
+        self.assertTrue(os.path.exists(recipients + '.journal'))
+        status, out = self._send(recipients)
+        self.assertEqual(status, 0)
+        self.assertIn('Sent 0, skipped 5, failed 0', out)
+
+    def test_send_failures(self):
+        """Test cli.main() send reports rows missing template values and
+        exits with 1.
+        """
+        recipients = os.path.join(self.tmp, 'recipients.jsonl')
+        with open(recipients, 'w') as file:
+            file.write('{"email": "a@gmail.com", "name": "A"}\n\n'
+                       '{"email": "b@gmail.com"}\n')
+        status, out = self._send(recipients, '--campaign', 'spring')
+        self.assertEqual(status, 1)
+        self.assertIn('Sent 1, skipped 0, failed 1', out)
+        self.assertIn('KeyError: 1', out)
+        self.assertIn('missing template values: name (1)', out)
+        self.assertIn('run the same command again to resume', out)
+
+    def test_progress_line(self):
+        """Test cli.progress_line() shows the rate and the time left,
+        leaving skipped rows out of the rate.
+        """
+        report = mock.Mock(sent=90, failed=10, skipped=100)
+        self.assertEqual(cli.progress_line(report, 1200, 10.0),
+                         '200/1200 sent 90 skipped 100 failed 10 | '
+                         '10.0 msg/s | ETA 0:01:40')
+        self.assertTrue(cli.progress_line(report, 1200, 0).endswith(
+            'ETA -:--:--'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import smtplib
+import threading
+import unittest
+from unittest import mock
+
+from auto_emailer import bulk, concurrency, transport
+
+ROWS = [{'email': 'friend{}@gmail.com'.format(i)} for i in range(40)]
+
+
+class _SessionTransport(transport.MemoryTransport):
+    """MemoryTransport whose sessions are separate objects sharing the
+    outbox, and which answers 421 to every `reject_every`-th message, or
+    drops the connection if `disconnect` is True, at most once per
+    recipient.
+    """
+
+    def __init__(self, outbox=None, stats=None, reject_every=None,
+                 counter=None, disconnect=False):
+        super().__init__(stats)
+        self.outbox = outbox if outbox is not None else []
+        self.reject_every = reject_every
+        self.disconnect = disconnect
+        self.counter = counter if counter is not None else [0]
+        self.counter_lock = threading.Lock()
+        self.rejected = set()
+
+    def spawn(self):
+        session = _SessionTransport(self.outbox, self.stats,
+                                    self.reject_every, self.counter,
+                                    self.disconnect)
+        session.counter_lock = self.counter_lock
+        session.rejected = self.rejected
+        return session
+
+    def _deliver(self, message, from_addr, to_addrs):
+        with self.counter_lock:
+            self.counter[0] += 1
+            reject = (self.reject_every and
+                      self.counter[0] % self.reject_every == 0 and
+                      tuple(to_addrs) not in self.rejected)
+            if reject:
+                self.rejected.add(tuple(to_addrs))
+        if reject and self.disconnect:
+            raise smtplib.SMTPServerDisconnected('Connection lost')
+        if reject:
+            raise smtplib.SMTPDataError(421, b'Try again later')
+        return super()._deliver(message, from_addr, to_addrs)
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def test_is_congestion(self):
+        """Test concurrency.is_congestion() recognizes 421 and 451
+        replies and disconnects, and not definitive refusals.
+        """
+        self.assertTrue(concurrency.is_congestion(
+            smtplib.SMTPServerDisconnected()))
+        self.assertTrue(concurrency.is_congestion(
+            smtplib.SMTPDataError(451, b'Later')))
+        self.assertTrue(concurrency.is_congestion(
+            smtplib.SMTPRecipientsRefused({'a@x.com': (421, b'Later')})))
+        self.assertFalse(concurrency.is_congestion(
+            smtplib.SMTPDataError(554, b'No')))
+        self.assertFalse(concurrency.is_congestion(ValueError()))
+
+    def test_controller_increase(self):
+        """Test concurrency.AIMDController grows the window by about one
+        per window of sends while latency is flat, up to the maximum.
+        """
+        controller = concurrency.AIMDController(initial=1, maximum=4)
+        for _ in range(3):
+            controller.record_success(0.01)
+        self.assertEqual(controller.window, 2)
+        for _ in range(100):
+            controller.record_success(0.01)
+        self.assertEqual(controller.window, 4)
+
+    def test_controller_latency_hold(self):
+        """Test concurrency.AIMDController stops growing when latency
+        rises well above the best latency.
+        """
+        controller = concurrency.AIMDController(initial=2, smoothing=1.0)
+        controller.record_success(0.01)
+        window = controller.window
+        for _ in range(20):
+            controller.record_success(0.1)
+        self.assertEqual(controller.window, window)
+
+    def test_controller_decrease(self):
+        """Test concurrency.AIMDController halves the window on
+        congestion, once per latency period, down to the minimum.
+        """
+        controller = concurrency.AIMDController(initial=16, minimum=2)
+        controller.record_congestion()
+        self.assertEqual(controller.window, 8)
+        controller._latency = 60.0
+        controller.record_congestion()
+        self.assertEqual(controller.window, 8)
+        controller._latency = 0.0
+        for _ in range(5):
+            controller.record_congestion()
+        self.assertEqual(controller.window, 2)
+        self.assertEqual(controller.congestion_events, 6)
+
+    def test_controller_slot_blocks(self):
+        """Test concurrency.AIMDController.acquire() blocks once the window
+        is full until a slot is released.
+        """
+        controller = concurrency.AIMDController(initial=1)
+        controller.acquire()
+        acquired = threading.Event()
+
+        def wait_for_slot():
+            with controller.slot():
+                acquired.set()
+
+        thread = threading.Thread(target=wait_for_slot)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        controller.release()
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_session_pool(self):
+        """Test concurrency.SessionPool reuses sessions and discards the
+        ones that failed with a congestion error.
+        """
+        pool = concurrency.SessionPool(_SessionTransport())
+        with pool.session() as first:
+            pass
+        with pool.session() as second:
+            self.assertIs(second, first)
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            with pool.session():
+                raise smtplib.SMTPServerDisconnected()
+        with pool.session() as third:
+            self.assertIsNot(third, first)
+        self.assertEqual(pool.created, 2)
+        pool.close()
+        self.assertEqual(pool.sessions, 0)
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_session_pool_login_failure(self, mock_smtplib):
+        """Test concurrency.SessionPool closes and discards a session whose
+        login failed, and keeps sessions after a refusal of the message.
+        """
+        instance = mock_smtplib.return_value
+        instance.esmtp_features = {}
+        instance.login.side_effect = smtplib.SMTPAuthenticationError(
+            535, b'Bad credentials')
+        pool = concurrency.SessionPool(transport.SMTPTransport(mock.Mock()))
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            with pool.session():
+                self.fail('A session that is not logged in was lent.')
+        self.assertEqual(instance.close.call_count, 1)
+        self.assertEqual(pool.sessions, 0)
+
+        instance.login.side_effect = None
+        with self.assertRaises(smtplib.SMTPDataError):
+            with pool.session() as first:
+                raise smtplib.SMTPDataError(550, b'Rejected')
+        with self.assertRaises(smtplib.SMTPHeloError):
+            with pool.session() as second:
+                raise smtplib.SMTPHeloError(501, b'Go away')
+        self.assertIs(second, first)
+        self.assertEqual(pool.sessions, 0)
+
+    def test_send_bulk_controller(self):
+        """Test bulk.send_bulk() with a controller delivers every row
+        concurrently, retrying the ones answered with 421.
+        """
+        sink = _SessionTransport(reject_every=7)
+        controller = concurrency.AIMDController(initial=2, maximum=8)
+        report = bulk.send_bulk(sink, ROWS, 'me@gmail.com', 'Hi', text='Hi',
+                                controller=controller)
+        self.assertEqual(report.sent, 40)
+        self.assertEqual(len(sink.outbox), 40)
+        self.assertGreater(controller.congestion_events, 0)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_send_bulk_controller_disconnect(self):
+        """Test bulk.send_bulk() with a controller reports dropped
+        connections as congestion instead of reconnecting silently, and
+        retries the message on another session.
+        """
+        sink = _SessionTransport(reject_every=7, disconnect=True)
+        controller = concurrency.AIMDController(initial=1, maximum=1)
+        with mock.patch.object(controller, 'record_congestion',
+                               wraps=controller.record_congestion) as cut:
+            report = bulk.send_bulk(sink, ROWS, 'me@gmail.com', 'Hi',
+                                    text='Hi', controller=controller)
+        self.assertEqual(report.sent, 40)
+        self.assertEqual(len(sink.outbox), 40)
+        self.assertEqual(cut.call_count, len(sink.rejected))
+        self.assertGreater(controller.congestion_events, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import random
+import tempfile
+import unittest
+
+from auto_emailer import dedupe
+
+
+def _rows(count):
+    rows = [{'email': 'user{}@domain{}.com'.format(index, index % 7),
+             'index': index} for index in range(count)]
+    # duplicates in another case, after the original
+    rows += [{'email': 'USER{}@Domain{}.COM'.format(index, index % 7),
+              'index': count + index} for index in range(0, count, 3)]
+    random.Random(1).shuffle(rows)
+    return rows
+
+
+class TestDedupe(unittest.TestCase):
+
+    def test_in_memory(self):
+        """Test dedupe.ExternalDeduplicator.filter() normalizes, drops
+        duplicates regardless of case and invalid rows, and sorts by
+        domain without spilling when the rows fit in memory.
+        """
+        rows = [{'email': 'b@B.com', 'n': 1}, {'email': 'a@c.com', 'n': 2},
+                {'email': 'B@b.com', 'n': 3}, {'email': 'nope', 'n': 4},
+                {'email': 'a@b.com', 'n': 5}]
+        deduplicator = dedupe.ExternalDeduplicator()
+        result = list(deduplicator.filter(rows))
+        self.assertEqual([(row['email'], row['n']) for row in result],
+                         [('a@b.com', 5), ('b@b.com', 1), ('a@c.com', 2)])
+        stats = deduplicator.as_dict()
+        self.assertEqual((stats['rows'], stats['unique'], stats['duplicates'],
+                          stats['invalid'], stats['runs']), (5, 3, 1, 1, 0))
+
+    def test_spill_and_merge(self):
+        """Test dedupe.ExternalDeduplicator.filter() gives the same result
+        when spilling many runs and merging them in several passes, and
+        removes its run files.
+        """
+        rows = _rows(600)
+        expected = list(dedupe.ExternalDeduplicator().filter(rows))
+        with tempfile.TemporaryDirectory() as directory:
+            deduplicator = dedupe.ExternalDeduplicator(memory_limit=4096,
+                                                       directory=directory,
+                                                       fan_in=4)
+            result = list(deduplicator.filter(rows))
+            self.assertEqual(os.listdir(directory), [])
+        self.assertEqual(result, expected)
+        self.assertEqual(len(result), 600)
+        first = {}
+        for row in rows:
+            first.setdefault(row['email'].lower(), row['index'])
+        self.assertEqual(sorted(row['index'] for row in result),
+                         sorted(first.values()))
+        domains = [row['email'].rpartition('@')[2] for row in result]
+        self.assertEqual(domains, sorted(domains))
+        self.assertGreater(deduplicator.runs, 8)
+        self.assertEqual(deduplicator.duplicates, 200)
+        self.assertGreater(deduplicator.bytes_spilled, 0)
+        self.assertGreater(deduplicator.throughput, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
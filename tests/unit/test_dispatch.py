@@ -0,0 +1,140 @@
+import queue
+import threading
+import unittest
+
+from auto_emailer import Message, dispatch, transport
+
+
+class _GatedTransport(transport.MemoryTransport):
+    """MemoryTransport holding its first delivery until `gate` is set,
+    setting `started` once that delivery began.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def _deliver(self, message, from_addr, to_addrs):
+        if not self.outbox:
+            self.started.set()
+            self.gate.wait(5)
+        return super()._deliver(message, from_addr, to_addrs)
+
+
+def _submit(dispatcher, lane, count):
+    return [dispatcher.submit('{} {}'.format(lane, index), 'me@gmail.com',
+                              ['a@gmail.com'], lane=lane)
+            for index in range(count)]
+
+
+class TestDispatch(unittest.TestCase):
+
+    def test_transactional_ahead_of_bulk(self):
+        """Test dispatch.Dispatcher sends transactional messages submitted
+        behind a queued campaign right after the message in progress.
+        """
+        sink = _GatedTransport()
+        dispatcher = dispatch.Dispatcher(sink, workers=1)
+        futures = _submit(dispatcher, dispatch.BULK, 1)
+        sink.started.wait(5)
+        futures += _submit(dispatcher, dispatch.BULK, 19)
+        futures += _submit(dispatcher, dispatch.TRANSACTIONAL, 3)
+        sink.gate.set()
+        dispatcher.shutdown()
+        order = [envelope.message.decode().split()[0]
+                 for envelope in sink.outbox]
+        self.assertEqual(order[:4], ['bulk'] + ['transactional'] * 3)
+        self.assertTrue(all(future.done() for future in futures))
+
+    def test_weighted_fair_share(self):
+        """Test dispatch.Dispatcher shares sessions between busy lanes in
+        proportion to their weights.
+        """
+        sink = _GatedTransport()
+        lanes = [dispatch.Lane('high', weight=3), dispatch.Lane('low')]
+        dispatcher = dispatch.Dispatcher(sink, lanes=lanes, workers=1)
+        _submit(dispatcher, 'low', 1)
+        sink.started.wait(5)
+        _submit(dispatcher, 'low', 19)
+        _submit(dispatcher, 'high', 30)
+        sink.gate.set()
+        dispatcher.shutdown()
+        order = [envelope.message.decode().split()[0]
+                 for envelope in sink.outbox[1:17]]
+        self.assertAlmostEqual(order.count('high'), 12, delta=1)
+
+    def test_futures_and_metrics(self):
+        """Test dispatch.Dispatcher.submit() futures resolve to the result
+        or exception of the send, and lanes report SLO metrics.
+        """
+        sink = transport.MemoryTransport()
+        dispatcher = dispatch.Dispatcher(sink, workers=2)
+        message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+        future = dispatcher.submit(message.draft_message(text='Hello'))
+        self.assertGreater(future.result(timeout=5), 0)
+        self.assertEqual(sink.outbox[0].to_addrs, ['a@gmail.com'])
+
+        failing = dispatcher.submit(object())
+        with self.assertRaises(ValueError):
+            failing.result(timeout=5)
+        dispatcher.shutdown()
+
+        metrics = dispatcher.metrics()[dispatch.TRANSACTIONAL]
+        self.assertEqual(metrics['completed'], 1)
+        self.assertEqual(metrics['failed'], 1)
+        self.assertEqual(metrics['slo_attainment'], 1.0)
+        self.assertIsNotNone(metrics['p99'])
+
+    def test_submit_errors(self):
+        """Test dispatch.Dispatcher.submit() raises ValueError for unknown
+        lanes and RuntimeError after shutdown.
+        """
+        dispatcher = dispatch.Dispatcher(transport.NullTransport(), workers=1)
+        with self.assertRaises(ValueError):
+            dispatcher.submit('Hi', lane='nope')
+        dispatcher.shutdown()
+        with self.assertRaises(RuntimeError):
+            dispatcher.submit('Hi')
+
+    def test_bounded_queue(self):
+        """Test dispatch.Dispatcher.submit() raises queue.Full, or blocks
+        until a worker makes room, once max_queue messages are queued.
+        """
+        sink = _GatedTransport()
+        dispatcher = dispatch.Dispatcher(sink, workers=1, max_queue=2,
+                                         overflow='raise')
+        _submit(dispatcher, 'transactional', 1)
+        sink.started.wait(5)
+        _submit(dispatcher, 'transactional', 2)
+        with self.assertRaises(queue.Full):
+            _submit(dispatcher, 'bulk', 1)
+        self.assertEqual(dispatcher.queue_depth(), 2)
+
+        dispatcher.overflow = 'block'
+        with self.assertRaises(queue.Full):
+            dispatcher.submit('Hi', lane='bulk', timeout=0.05)
+        sink.gate.set()
+        future = dispatcher.submit('Hi', 'me@gmail.com', ['a@gmail.com'],
+                                   timeout=5)
+        dispatcher.shutdown()
+        self.assertTrue(future.done())
+        self.assertEqual(len(sink.outbox), 4)
+
+    def test_shutdown_cancel(self):
+        """Test dispatch.Dispatcher.shutdown(cancel=True) cancels queued
+        messages and completes the one in progress.
+        """
+        sink = _GatedTransport()
+        dispatcher = dispatch.Dispatcher(sink, workers=1)
+        futures = _submit(dispatcher, 'bulk', 4)
+        sink.started.wait(5)
+        threading.Timer(0.05, sink.gate.set).start()
+        dispatcher.shutdown(cancel=True)
+        self.assertEqual(futures[0].result(), len(sink.outbox[0].message))
+        self.assertTrue(all(future.cancelled() for future in futures[1:]))
+        self.assertEqual(dispatcher.queue_depth(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
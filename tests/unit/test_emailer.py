@@ -1,11 +1,18 @@
+import base64
+import gc
+import gzip
 import json
+import os
+import tempfile
 import unittest
 from unittest import mock
 from pathlib import Path
 
 import smtplib
+from email.mime.image import MIMEImage
 
-from auto_emailer import Emailer, Message
+from auto_emailer import Emailer, Message, emailer
+from auto_emailer.emailer import RenderCache
 from auto_emailer.config import credentials
 
 DATA_DIR = Path(__file__).resolve().parents[1] / 'data'
@@ -184,6 +191,78 @@ class TestEmailer(unittest.TestCase):
         self.assertEqual(instance.sendmail.call_count, 2)
         self.assertEqual(mock_smtplib.call_count, 2)
 
+    @mock.patch('auto_emailer.emailer.smtplib.SMTP')
+    def test_emailer_send_email_retry_cached(self, mock_smtplib):
+        """Test class method: Emailer.send_email() sends the same cached
+        bytes of a Message again after a dropped connection, without
+        serializing it twice.
+        """
+        instance = mock_smtplib.return_value
+        instance.sendmail.side_effect = [
+            smtplib.SMTPServerDisconnected('Connection lost'), {}]
+        test_emailer = Emailer(config=_make_credentials())
+        message = Message('me@gmail.com', ['yotest@gmail.com'], 'Hi',
+                          bcc=['boss@gmail.com'])
+        message.draft_message(text='Hello')
+        with mock.patch.object(Message, 'render_cache', RenderCache()), \
+                mock.patch.object(Message, '_serialize',
+                                  wraps=message._serialize) as serialize:
+            test_emailer.send_email(message)
+        self.assertEqual(serialize.call_count, 1)
+        first, second = instance.sendmail.call_args_list
+        self.assertIs(first[1]['msg'], second[1]['msg'])
+        self.assertEqual(second[1]['to_addrs'],
+                         ['yotest@gmail.com', 'boss@gmail.com'])
+
+    @mock.patch('auto_emailer.emailer.smtplib.SMTP')
+    def test_emailer_send_email_crlf(self, mock_smtplib):
+        """Test class method: Emailer.send_email() passes sendmail the
+        bytes of a Message with CRLF line endings only, as send_message
+        would have written them.
+        """
+        instance = mock_smtplib.return_value
+        test_emailer = Emailer(config=_make_credentials())
+        message = Message('me@gmail.com', ['yotest@gmail.com'], 'Hi')
+        message.draft_message(text='Hello\nFriend\n', html='<b>Hi</b>')
+        test_emailer.send_email(message)
+        data = instance.sendmail.call_args[1]['msg']
+        self.assertGreater(data.count(b'\r\n'), 10)
+        self.assertEqual(data.count(b'\n'), data.count(b'\r\n'))
+        self.assertIn(b'\r\n\r\nHello\r\nFriend\r\n', data)
+
+    @mock.patch('auto_emailer.emailer.smtplib.SMTP')
+    def test_emailer_submit(self, mock_smtplib):
+        """Test class method: Emailer.submit() sends in the background over
+        one reused session, runs callbacks with the future and drains the
+        queue on Emailer.shutdown().
+        """
+        instance = mock_smtplib.return_value
+        test_emailer = Emailer(config=_make_credentials(), workers=1)
+        done = []
+        futures = [test_emailer.submit('My test email {}'.format(index),
+                                       'me@gmail.com', ['yotest@gmail.com'],
+                                       callback=done.append)
+                   for index in range(5)]
+        test_emailer.shutdown()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(done), 5)
+        self.assertEqual(instance.sendmail.call_count, 5)
+        self.assertEqual(mock_smtplib.call_count, 1)
+        with self.assertRaises(RuntimeError):
+            test_emailer.submit('Late', 'me@gmail.com', ['yotest@gmail.com'])
+
+    def test_emailer_submit_message_type(self):
+        """Test class method: Emailer.submit() raises ValueError at once
+        for messages Emailer.send_email() would refuse.
+        """
+        test_emailer = Emailer(config=_make_credentials())
+        with self.assertRaises(ValueError):
+            test_emailer.submit('My test email')
+        with self.assertRaises(ValueError):
+            test_emailer.submit({'Subject': 'Test'}, 'me@gmail.com',
+                                ['yotest@gmail.com'])
+        self.assertIsNone(test_emailer._dispatcher)
+
 
 class TestMessage(unittest.TestCase):
 
@@ -271,6 +350,137 @@ class TestMessage(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             test_message.body_template("test/bad/path")
 
+    def test_emailer_message_draft_message_html(self):
+        """Test class method: Message.draft_message() with html and
+        inline_images nests multipart/alternative text and html bodies
+        in a multipart/related part with the images.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            logo = Path(tmp) / 'logo.png'
+            logo.write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 16)
+            test_message = Message('my_email@gmail.com',
+                                   ['my_friend@gmail.com'],
+                                   'Hello Friend!')
+            test_message.draft_message(text='Hi Friend!',
+                                       html='<img src="cid:logo.png">',
+                                       inline_images=[str(logo)])
+        related = test_message.message.get_payload(0)
+        self.assertEqual(related.get_content_type(), 'multipart/related')
+        alternative, image = related.get_payload()
+        self.assertEqual([part.get_content_type()
+                          for part in alternative.get_payload()],
+                         ['text/plain', 'text/html'])
+        self.assertEqual(image.get_content_type(), 'image/png')
+        self.assertEqual(image['Content-ID'], '<logo.png>')
+
+    def test_emailer_message_inline_image_shared(self):
+        """Test class method: InlineImage.cached() encodes an image once
+        and shares the same MIME part across messages.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            logo = Path(tmp) / 'logo.png'
+            logo.write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 16)
+            with mock.patch('auto_emailer.emailer.MIMEImage',
+                            wraps=MIMEImage) as mock_image:
+                parts = []
+                for name in ['a', 'b', 'c']:
+                    test_message = Message('my_email@gmail.com',
+                                           ['{}@gmail.com'.format(name)],
+                                           'Hello Friend!')
+                    test_message.draft_message(text='Hi', html='<b>Hi</b>',
+                                               inline_images=[str(logo)])
+                    parts.append(test_message.message.get_payload(0)
+                                 .get_payload(1))
+                    self.assertIn(b'Content-ID: <logo.png>',
+                                  test_message.as_bytes())
+        self.assertEqual(mock_image.call_count, 1)
+        self.assertIs(parts[0], parts[2])
+
+    def test_emailer_message_attach_compress(self):
+        """Test class method: Message.attach() gzips compressible files
+        above compress_threshold, and Message.encoded_size() reflects it.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            report = Path(tmp) / 'report.csv'
+            report.write_text('id,name\n' + 'x,friend\n' * 5000)
+            image = Path(tmp) / 'logo.png'
+            image.write_bytes(b'\x89PNG' + b'\x00' * 5000)
+            plain = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+            plain.draft_message(text='Hi').attach([str(report)])
+            message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+            message.draft_message(text='Hi').attach(
+                [str(report), str(image)], compress_threshold=1024)
+
+        parts = message.message.get_payload()
+        self.assertEqual(parts[1].get_content_type(), 'application/gzip')
+        self.assertEqual(parts[1].get_filename(), 'report.csv.gz')
+        self.assertEqual(gzip.decompress(parts[1].get_payload(decode=True)),
+                         b'id,name\n' + b'x,friend\n' * 5000)
+        self.assertEqual(parts[2].get_filename(), 'logo.png')
+        self.assertLess(message.encoded_size() * 5, plain.encoded_size())
+
+    def test_emailer_message_attach_mapped(self):
+        """Test class method: Message.attach() encodes memory-mapped files
+        exactly like email.encoders.encode_base64, including files larger
+        than an encoding slice and empty files.
+        """
+        content = os.urandom(emailer._ENCODE_STEP + 1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            large = Path(tmp) / 'large.bin'
+            large.write_bytes(content)
+            empty = Path(tmp) / 'empty.bin'
+            empty.write_bytes(b'')
+            message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+            message.draft_message(text='Hi').attach([str(large), str(empty)])
+
+        parts = message.message.get_payload()
+        self.assertEqual(parts[1]['Content-Transfer-Encoding'], 'base64')
+        self.assertEqual(parts[1].get_payload(),
+                         base64.encodebytes(content).decode('ascii'))
+        self.assertEqual(parts[1].get_payload(decode=True), content)
+        self.assertEqual(parts[2].get_payload(decode=True), b'')
+
+    def test_emailer_message_render_cache(self):
+        """Test class method: Message.as_bytes() serializes once, again
+        after a header or part changed, and the shared RenderCache evicts
+        the least recently used messages beyond its budget.
+        """
+        cache = RenderCache(max_bytes=2000)
+        with mock.patch.object(Message, 'render_cache', cache):
+            message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+            message.draft_message(text='Hello')
+            data = message.as_bytes()
+            self.assertIs(message.as_bytes(), data)
+            message.message.get_payload()[0].set_payload('Bye')
+            self.assertIn(b'Bye', message.as_bytes())
+            message.message.replace_header('Subject', 'Hey')
+            self.assertIn(b'Subject: Hey', message.as_bytes())
+            self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+            others = [Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+                      .draft_message(text='x' * 600) for _ in range(3)]
+            for other in others:
+                other.as_bytes()
+            self.assertLessEqual(cache.bytes, 2000)
+            self.assertEqual(cache.evictions, 2)
+            self.assertEqual(len(cache), 2)
+            del others, other
+            gc.collect()
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.bytes, 0)
+
+    def test_emailer_message_render_cache_nested(self):
+        """Test class method: Message.as_bytes() of a multipart/alternative
+        message serializes once and returns identical bytes again.
+        """
+        cache = RenderCache()
+        with mock.patch.object(Message, 'render_cache', cache):
+            message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+            message.draft_message(text='Hello', html='<b>Hello</b>')
+            data = message.as_bytes()
+            self.assertEqual(message.as_bytes(), data)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
     # @mock.patch('auto_emailer.emailer.smtplib.SMTP')
     # def test_emailer_send_email_attachments(self, mock_smtplib):
     #     """Test class method: Emailer.send_email() is sent with
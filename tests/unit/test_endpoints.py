@@ -0,0 +1,129 @@
+import smtplib
+import unittest
+from unittest import mock
+
+from auto_emailer import endpoints, transport
+
+
+def _smtp_factory(down):
+    """Return a fake smtplib.SMTP class refusing connections to the
+    hosts in `down`.
+    """
+    def connect(host, port, **kwargs):
+        if host in down:
+            raise ConnectionRefusedError(host)
+        return mock.Mock(host=host)
+    return connect
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def test_endpoint_parsing(self):
+        """Test endpoints.EndpointSet accepts Endpoint, (host, port) and
+        'host:port' endpoints, and raises ValueError without any.
+        """
+        relays = endpoints.EndpointSet([endpoints.Endpoint('a'), ('b', 25),
+                                        'c:2525', 'd'])
+        self.assertEqual([(e.host, e.port) for e in relays.endpoints],
+                         [('a', 587), ('b', 25), ('c', 2525), ('d', 587)])
+        with self.assertRaises(ValueError):
+            endpoints.EndpointSet([])
+
+    def test_select_latency(self):
+        """Test endpoints.EndpointSet.select() prefers the lowest latency
+        for the weight, or the first endpoint when ordered.
+        """
+        relays = endpoints.EndpointSet(['a:25', 'b:25'])
+        relays.record_success(relays.endpoints[0], 0.2)
+        relays.record_success(relays.endpoints[1], 0.1)
+        self.assertIs(relays.select(), relays.endpoints[1])
+        relays.endpoints[0].weight = 4
+        self.assertIs(relays.select(), relays.endpoints[0])
+        relays.ordered = True
+        relays.endpoints[0].weight = 1
+        self.assertIs(relays.select(), relays.endpoints[0])
+
+    def test_eject_and_readmit(self):
+        """Test endpoints.EndpointSet ejects an endpoint after max_failures
+        and a successful probe re-admits it.
+        """
+        relays = endpoints.EndpointSet(['a:25', 'b:25'], max_failures=2)
+        first = relays.endpoints[0]
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        side_effect=_smtp_factory({'a'})):
+            self.assertFalse(relays.probe(first))
+            self.assertIn(first, relays.healthy())
+            self.assertFalse(relays.probe(first))
+        self.assertNotIn(first, relays.healthy())
+        self.assertIs(relays.select(), relays.endpoints[1])
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        side_effect=_smtp_factory(set())):
+            relays.probe_all()
+        self.assertIn(first, relays.healthy())
+
+    def test_connect_failover(self):
+        """Test endpoints.EndpointSet.connect() fails over to the next
+        endpoint and raises smtplib.SMTPConnectError if none answers.
+        """
+        relays = endpoints.EndpointSet(['a:25', 'b:25'], ordered=True)
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        side_effect=_smtp_factory({'a'})):
+            smtp, endpoint = relays.connect()
+        self.assertEqual(smtp.host, 'b')
+        self.assertEqual(relays.endpoints[0].failures, 1)
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        side_effect=_smtp_factory({'a', 'b'})):
+            with self.assertRaises(smtplib.SMTPConnectError):
+                relays.connect()
+
+    def test_connect_timeout_ehlo_failure(self):
+        """Test endpoints.EndpointSet.connect() bounds connecting by
+        connect_timeout, then applies the session timeout, and closes
+        connections whose EHLO fails, as probe() does.
+        """
+        relays = endpoints.EndpointSet(['a:25', 'b:25'], ordered=True,
+                                       connect_timeout=2.0)
+        silent = mock.Mock()
+        silent.ehlo.side_effect = smtplib.SMTPServerDisconnected('EHLO')
+        answering = mock.Mock()
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        side_effect=[silent, answering]) as mock_smtp:
+            smtp, endpoint = relays.connect(timeout=30.0)
+        self.assertIs(smtp, answering)
+        self.assertEqual([call[1]['timeout'] for call in
+                          mock_smtp.call_args_list], [2.0, 2.0])
+        answering.sock.settimeout.assert_called_once_with(30.0)
+        self.assertEqual(silent.close.call_count, 1)
+
+        silent.reset_mock()
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        return_value=silent):
+            self.assertFalse(relays.probe(endpoint))
+        self.assertEqual(silent.close.call_count, 1)
+
+    def test_background_probes(self):
+        """Test endpoints.EndpointSet.start() probes endpoints in a
+        background thread until stop() is called.
+        """
+        relays = endpoints.EndpointSet(['a:25'], probe_interval=60)
+        with mock.patch.object(relays, 'probe_all') as mock_probe:
+            relays.start()
+            relays.stop()
+        self.assertEqual(mock_probe.call_count, 1)
+
+    def test_smtp_transport_endpoints(self):
+        """Test transport.SMTPTransport connects through its EndpointSet
+        and logs in on the chosen endpoint.
+        """
+        relays = endpoints.EndpointSet(['a:25', 'b:25'], ordered=True)
+        session = transport.SMTPTransport(mock.Mock(), endpoints=relays)
+        with mock.patch('auto_emailer.endpoints.smtplib.SMTP',
+                        side_effect=_smtp_factory({'a'})):
+            session.open()
+        self.assertEqual(session.endpoint.host, 'b')
+        self.assertEqual(session._smtp.login.call_count, 1)
+        self.assertIs(session.spawn().endpoints, relays)
+
+
+if __name__ == '__main__':
+    unittest.main()
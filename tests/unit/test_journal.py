@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from auto_emailer import bulk, journal, transport
+
+ROWS = [{'email': 'friend{}@gmail.com'.format(i), 'name': 'Friend {}'.format(i)}
+        for i in range(10)]
+
+
+class _FailingTransport(transport.MemoryTransport):
+    """MemoryTransport that dies with an OSError after `limit` messages."""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def _deliver(self, message, from_addr, to_addrs):
+        if len(self.outbox) == self.limit:
+            raise OSError('Connection lost')
+        return super()._deliver(message, from_addr, to_addrs)
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self._tmp.name) / 'campaign.journal')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_idempotency_key(self):
+        """Test journal.idempotency_key() ignores recipient case and
+        whitespace but depends on the campaign.
+        """
+        key = journal.idempotency_key('Friend@Gmail.com ', 'spring')
+        self.assertEqual(key, journal.idempotency_key('friend@gmail.com',
+                                                      'spring'))
+        self.assertNotEqual(key, journal.idempotency_key('friend@gmail.com',
+                                                         'summer'))
+        self.assertEqual(len(key), 32)
+
+    def test_journal_reload(self):
+        """Test journal.SendJournal loads recorded keys when reopened."""
+        with journal.SendJournal(self.path, fsync_every=2) as log:
+            log.record('a' * 32)
+            log.record('b' * 32)
+            log.record('c' * 32)
+        with journal.SendJournal(self.path) as log:
+            self.assertEqual(len(log), 3)
+            self.assertIn('b' * 32, log)
+
+    def test_journal_partial_line(self):
+        """Test journal.SendJournal drops a partially written last key
+        and appends new keys on a fresh line.
+        """
+        Path(self.path).write_bytes(b'a' * 32 + b'\n' + b'b' * 10)
+        with journal.SendJournal(self.path) as log:
+            self.assertEqual(len(log), 1)
+            log.record('c' * 32)
+        with journal.SendJournal(self.path) as log:
+            self.assertEqual(len(log), 2)
+            self.assertIn('c' * 32, log)
+
+    def test_send_bulk_resume(self):
+        """Test bulk.send_bulk() with a journal skips rows delivered by a
+        previous, interrupted run of the same campaign.
+        """
+        failing = _FailingTransport(limit=4)
+        with journal.SendJournal(self.path) as log:
+            with self.assertRaises(OSError):
+                bulk.send_bulk(failing, ROWS, 'me@gmail.com', 'Hi',
+                               text='Hello {name}', journal=log,
+                               campaign='spring')
+        sink = transport.MemoryTransport()
+        with journal.SendJournal(self.path) as log:
+            report = bulk.send_bulk(sink, ROWS, 'me@gmail.com', 'Hi',
+                                    text='Hello {name}', journal=log,
+                                    campaign='spring')
+        self.assertEqual(report.skipped, 4)
+        self.assertEqual(report.sent, 6)
+        self.assertEqual(sink.outbox[0].to_addrs, ['friend4@gmail.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
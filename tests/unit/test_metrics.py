@@ -0,0 +1,132 @@
+import threading
+import unittest
+import urllib.request
+
+from auto_emailer import dispatch, metrics, transport
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.REGISTRY.reset()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.REGISTRY.reset()
+
+    def test_counter_threads(self):
+        """Test metrics.Counter sums the shards of every thread."""
+        counter = metrics.Counter('test_total', 'Test.')
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(5)
+        self.assertEqual(counter.value, 4005)
+        counter.reset()
+        self.assertEqual(counter.value, 0)
+
+    def test_exited_thread_shards(self):
+        """Test metrics shards of exited threads are folded into a base
+        total instead of accumulating.
+        """
+        histogram = metrics.Histogram('test_seconds', 'Test.')
+        for _ in range(20):
+            thread = threading.Thread(target=histogram.observe, args=(0.2,))
+            thread.start()
+            thread.join()
+        histogram.observe(0.2)
+        self.assertEqual(len(histogram._shards), 1)
+        self.assertEqual(histogram.count, 21)
+        histogram.reset()
+        self.assertEqual(histogram.count, 0)
+        self.assertEqual(histogram._shards, [])
+
+    def test_histogram_render(self):
+        """Test metrics.Registry.render() exposes cumulative histogram
+        buckets in the Prometheus text format.
+        """
+        registry = metrics.Registry()
+        histogram = registry.histogram('test_seconds', 'Test.',
+                                       buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[:2], ['# HELP test_seconds Test.',
+                                     '# TYPE test_seconds histogram'])
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum 4.25', lines)
+        self.assertIn('test_seconds_count 4', lines)
+        with self.assertRaises(ValueError):
+            registry.counter('test_seconds', 'Again.')
+
+    def test_transport_hooks(self):
+        """Test metrics record transport sends only once enabled."""
+        sink = transport.MemoryTransport()
+        sink.send(b'Hi', 'me@gmail.com', ['a@gmail.com'])
+        self.assertEqual(metrics.MESSAGES_SENT.value, 0)
+
+        metrics.enable()
+        sink.send(b'Hello', 'me@gmail.com', ['a@gmail.com'])
+        with self.assertRaises(ValueError):
+            sink.send(object())
+        self.assertEqual(metrics.MESSAGES_SENT.value, 1)
+        self.assertEqual(metrics.MESSAGES_FAILED.value, 1)
+        self.assertEqual(metrics.BYTES_SENT.value, 5)
+        self.assertEqual(metrics.SEND_SECONDS.count, 1)
+
+    def test_http_server(self):
+        """Test metrics.start_http_server() serves the registry, including
+        the queue depth of tracked dispatchers.
+        """
+        dispatcher = dispatch.Dispatcher(transport.NullTransport(),
+                                         workers=1)
+        server = metrics.start_http_server(0, addr='127.0.0.1')
+        try:
+            dispatcher.submit(b'Hi').result(timeout=5)
+            url = 'http://127.0.0.1:{}/metrics'.format(server.server_port)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual(response.headers['Content-Type'],
+                                 metrics.CONTENT_TYPE)
+                body = response.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+            dispatcher.shutdown()
+        self.assertTrue(metrics.ENABLED)
+        self.assertIn('auto_emailer_messages_sent_total 1\n', body)
+        self.assertIn('auto_emailer_queue_depth 0\n', body)
+
+    def test_lane_metrics(self):
+        """Test dispatcher lanes export their latency, SLO attainment and
+        failures labelled with the lane name.
+        """
+        metrics.enable()
+        dispatcher = dispatch.Dispatcher(transport.NullTransport(),
+                                         workers=1)
+        dispatcher.submit(b'Hi').result(timeout=5)
+        dispatcher.submit(b'Hi', lane=dispatch.BULK).result(timeout=5)
+        dispatcher.submit(object()).exception(timeout=5)
+        dispatcher.shutdown()
+        lines = metrics.REGISTRY.render().splitlines()
+        self.assertIn('# TYPE auto_emailer_lane_seconds histogram', lines)
+        self.assertIn('auto_emailer_lane_seconds_bucket'
+                      '{lane="transactional",le="1"} 1', lines)
+        self.assertIn('auto_emailer_lane_seconds_count{lane="bulk"} 1',
+                      lines)
+        self.assertIn('auto_emailer_lane_slo_met_total'
+                      '{lane="transactional"} 1', lines)
+        self.assertIn('auto_emailer_lane_failed_total'
+                      '{lane="transactional"} 1', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import smtplib
+import tempfile
+import unittest
+
+from auto_emailer import journal, pipeline, transport
+from auto_emailer.journal import idempotency_key
+
+ROWS = [{'email': 'friend{}@gmail.com'.format(i), 'name': 'Friend {}'.format(i)}
+        for i in range(30)]
+
+
+class _FailingTransport(transport.MemoryTransport):
+    """MemoryTransport dropping the connection on one recipient, and
+    refusing another.
+    """
+
+    def _deliver(self, message, from_addr, to_addrs):
+        if to_addrs == ['friend5@gmail.com']:
+            raise smtplib.SMTPServerDisconnected('Connection lost')
+        if to_addrs == ['friend3@gmail.com']:
+            raise smtplib.SMTPRecipientsRefused(
+                {'friend3@gmail.com': (550, b'No such user')})
+        return super()._deliver(message, from_addr, to_addrs)
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_run(self):
+        """Test pipeline.Pipeline.run() renders and sends every row, counts
+        missing template values, and records statistics for every stage.
+        """
+        rows = ROWS + [{'email': 'nobody@gmail.com'}]
+        sink = transport.MemoryTransport()
+        runner = pipeline.Pipeline(sink, workers=1, senders=3, queue_size=4,
+                                   chunksize=2)
+        report = runner.run(rows, 'me@gmail.com', 'Hi', text='Hello {name}')
+        self.assertEqual((report.sent, report.failed), (30, 1))
+        self.assertEqual(report.missing_keys, {'name': 1})
+        self.assertEqual(sorted(envelope.to_addrs[0]
+                                for envelope in sink.outbox),
+                         sorted(row['email'] for row in ROWS))
+        self.assertIn(b'Hello Friend 7', next(
+            envelope.message for envelope in sink.outbox
+            if envelope.to_addrs == ['friend7@gmail.com']))
+        stats = runner.as_dict()
+        self.assertEqual(list(stats), ['source', 'render', 'send'])
+        self.assertEqual(stats['source']['items'], 31)
+        self.assertEqual(stats['render']['items'], 31)
+        self.assertEqual(stats['send']['items'], 30)
+        self.assertLessEqual(stats['send']['max_depth'], 4)
+        self.assertIn(runner.bottleneck, stats)
+        self.assertFalse(sink.connected)
+
+    def test_render_processes_journal(self):
+        """Test pipeline.Pipeline.run() renders in worker processes and
+        skips and records rows in the journal.
+        """
+        sink = transport.MemoryTransport()
+        with tempfile.TemporaryDirectory() as tmp:
+            with journal.SendJournal(os.path.join(tmp, 'journal')) as log:
+                log.record(idempotency_key('friend0@gmail.com', 'news'))
+                report = pipeline.Pipeline(sink, workers=2).run(
+                    ROWS, 'me@gmail.com', 'Hi', text='Hello {name}',
+                    journal=log, campaign='news')
+                self.assertEqual((report.sent, report.skipped), (29, 1))
+                self.assertEqual(len(log), 30)
+
+    def test_stop(self):
+        """Test pipeline.Pipeline.stop() stops reading rows but sends the
+        rows already read.
+        """
+        sink = transport.MemoryTransport()
+        runner = pipeline.Pipeline(sink, workers=1, senders=2, chunksize=1)
+
+        def rows():
+            for index, row in enumerate(ROWS):
+                if index == 5:
+                    # the row being read is still sent
+                    runner.stop()
+                yield row
+
+        report = runner.run(rows(), 'me@gmail.com', 'Hi', text='Hello {name}')
+        self.assertEqual(report.sent, 6)
+        self.assertIs(runner.report, report)
+        self.assertEqual(len(sink.outbox), 6)
+
+    def test_errors(self):
+        """Test pipeline.Pipeline.run() counts refused messages and raises
+        a connection error after the stages have drained.
+        """
+        sink = _FailingTransport()
+        runner = pipeline.Pipeline(sink, workers=1, senders=1, chunksize=1)
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            runner.run(ROWS, 'me@gmail.com', 'Hi', text='Hello {name}')
+        self.assertEqual(len(sink.outbox), 4)
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline(sink, senders=0)
+
+    def test_journal_error(self):
+        """Test pipeline.Pipeline.run() raises a journal write error after
+        the stages have drained instead of hanging.
+        """
+        class FullJournal(set):
+            def record(self, key):
+                raise OSError('No space left on device')
+
+        sink = transport.MemoryTransport()
+        runner = pipeline.Pipeline(sink, workers=1, senders=1, queue_size=1,
+                                   chunksize=1)
+        with self.assertRaises(OSError):
+            runner.run(ROWS, 'me@gmail.com', 'Hi', text='Hello {name}',
+                       journal=FullJournal(), campaign='news')
+        self.assertLess(len(sink.outbox), len(ROWS))
+
+
+if __name__ == '__main__':
+    unittest.main()
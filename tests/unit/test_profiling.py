@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from auto_emailer import Message, profiling
+from auto_emailer.emailer import Emailer
+
+
+class TestProfiling(unittest.TestCase):
+
+    def tearDown(self):
+        profiling.uninstall()
+
+    def test_install_report(self):
+        """Test profiling.install() wraps the send pipeline, and the report
+        lists call timings, hot spots and allocations.
+        """
+        original = Message.draft_message
+        profiler = profiling.install('-', sample_rate=1.0)
+        self.assertIsNot(Message.draft_message, original)
+        for _ in range(3):
+            message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+            message.draft_message(text='Hello').as_bytes()
+
+        report = profiler.report()
+        self.assertEqual(profiler.targets['Message.draft_message'].calls, 3)
+        self.assertEqual(profiler.targets['Message.as_bytes'].sampled, 3)
+        self.assertEqual(profiler.targets['Emailer.send_email'].calls, 0)
+        self.assertIn('Hot spots of Message.as_bytes, 3 sampled calls',
+                      report)
+        self.assertIn('Allocations since profiling started', report)
+
+        profiling.uninstall()
+        self.assertIs(Message.draft_message, original)
+
+    def test_dump(self):
+        """Test profiling.Profiler.dump() writes the report to a file."""
+        profiler = profiling.Profiler(sample_rate=0.0, trace_frames=0)
+        profiler.wrap(Emailer, '_check_message')
+        Emailer._check_message('Hi', 'me@gmail.com', ['a@gmail.com'])
+        profiler.stop()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.txt')
+            profiler.dump(path)
+            with open(path) as file:
+                report = file.read()
+        self.assertIn('Emailer._check_message', report)
+        self.assertNotIn('Hot spots', report)
+
+    def test_install_from_environment(self):
+        """Test profiling.install_from_environment() only installs when
+        EMAILER_PROFILE is set, and validates EMAILER_PROFILE_RATE.
+        """
+        with mock.patch.dict('os.environ', clear=True):
+            self.assertIsNone(profiling.install_from_environment())
+        with mock.patch.dict('os.environ', {'EMAILER_PROFILE': '-',
+                                            'EMAILER_PROFILE_RATE': '0.5'}):
+            profiler = profiling.install_from_environment()
+        self.assertEqual(profiler.sample_rate, 0.5)
+        with mock.patch.dict('os.environ', {'EMAILER_PROFILE': '-',
+                                            'EMAILER_PROFILE_RATE': 'x'}):
+            with self.assertRaises(ValueError):
+                profiling.install_from_environment()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import os
+import smtplib
+import tempfile
+import unittest
+from unittest import mock
+
+from auto_emailer import Emailer
+from auto_emailer.config import credentials, environment_vars, rotation
+
+
+def _info(password):
+    return {'EMAILER_SENDER': 'test@gmail.com',
+            'EMAILER_PASSWORD': password,
+            'EMAILER_HOST': 'smtp.gmail.com',
+            'EMAILER_PORT': 587}
+
+
+def _write(path, content, mtime):
+    with open(path, 'w') as file:
+        file.write(content)
+    os.utime(path, ns=(mtime, mtime))
+
+
+class TestRotation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'creds.json')
+        _write(self.path, json.dumps(_info('first')), 1000000000)
+
+    def test_file_source(self):
+        """Test rotation.FileCredentialSource reloads the file once its
+        modification time changed, and keeps the previous credentials
+        while the file does not parse.
+        """
+        with mock.patch.dict(os.environ,
+                             {environment_vars.EMAILER_CREDS: self.path}):
+            source = rotation.FileCredentialSource(interval=0)
+        self.assertEqual(source.password, 'first')
+        _write(self.path, '{"EMAILER_SENDER": ', 2000000000)
+        self.assertEqual(source.password, 'first')
+        self.assertEqual(source.errors, 1)
+        _write(self.path, json.dumps(_info('second')), 3000000000)
+        self.assertEqual(source.current().password, 'second')
+        self.assertEqual(source.rotations, 1)
+        self.assertFalse(source.refresh())
+        with mock.patch.dict(os.environ, clear=True):
+            with self.assertRaises(EnvironmentError):
+                rotation.FileCredentialSource()
+
+    def test_callable_source_interval(self):
+        """Test rotation.CredentialSource calls its provider at most once
+        per interval.
+        """
+        provider = mock.Mock(side_effect=[
+            credentials.Credentials.from_authorized_user_info(_info(word))
+            for word in ('first', 'second')])
+        source = rotation.CredentialSource(provider, interval=3600)
+        self.assertEqual(source.password, 'first')
+        self.assertEqual(source.password, 'first')
+        self.assertEqual(provider.call_count, 1)
+        self.assertTrue(source.refresh())
+        self.assertEqual(source.password, 'second')
+
+    def test_callable_source_errors(self):
+        """Test rotation.CredentialSource keeps the last good credentials
+        whatever error its provider raises.
+        """
+        provider = mock.Mock(side_effect=[
+            credentials.Credentials.from_authorized_user_info(_info('first')),
+            KeyError('EMAILER_PASSWORD'), TypeError('Not a mapping'),
+            credentials.Credentials.from_authorized_user_info(_info('second'))
+        ])
+        source = rotation.CredentialSource(provider, interval=0)
+        self.assertEqual(source.password, 'first')
+        self.assertEqual(source.password, 'first')
+        self.assertEqual(source.errors, 2)
+        self.assertEqual(source.password, 'second')
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_sessions_rotate(self, mock_smtplib):
+        """Test a transport.SMTPTransport with a source logs new sessions in
+        with the rotated credentials while open sessions keep sending, and
+        refreshes the source when a login is refused.
+        """
+        instance = mock_smtplib.return_value
+        source = rotation.FileCredentialSource(self.path, interval=3600)
+        emailer = Emailer(config=source)
+        sink = emailer.transport
+        sink.open()
+        instance.login.assert_called_with('test@gmail.com', 'first')
+
+        _write(self.path, json.dumps(_info('second')), 2000000000)
+        session = sink.spawn()
+        instance.login.side_effect = [
+            smtplib.SMTPAuthenticationError(535, b'Bad password'), None]
+        session.open()
+        instance.login.assert_called_with('test@gmail.com', 'second')
+        sink.send('Test', 'test@gmail.com', ['b@gmail.com'])
+        self.assertEqual(mock_smtplib.call_count, 2)
+        self.assertEqual(source.rotations, 1)
+
+        instance.login.side_effect = smtplib.SMTPAuthenticationError(
+            535, b'Bad password')
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            sink.spawn().open()
+
+
+if __name__ == '__main__':
+    unittest.main()
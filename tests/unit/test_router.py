@@ -0,0 +1,120 @@
+import collections
+import smtplib
+import unittest
+from pathlib import Path
+
+from auto_emailer import Emailer, metrics, router, transport
+from auto_emailer.config import credentials
+
+DATA_DIR = Path(__file__).resolve().parents[1] / 'data'
+MOCK_ENVIR_JSON_FILE = DATA_DIR / 'mock_envir_credentials.json'
+
+
+def _make_credentials(name):
+    return credentials.Credentials(sender_email='{}@gmail.com'.format(name),
+                                   password='mypassword',
+                                   host='smtp.gmail.com', port=587)
+
+
+class _FakeSession(transport.MemoryTransport):
+    """Account session recording sends in a shared log, optionally
+    answering every message with a quota error.
+    """
+    log = []
+    over_quota = set()
+
+    def __init__(self, config, stats=None):
+        super().__init__(stats)
+        self.config = config
+
+    def _deliver(self, message, from_addr, to_addrs):
+        if self.config.sender_email in self.over_quota:
+            raise smtplib.SMTPDataError(
+                550, b'5.4.5 Daily user sending quota exceeded')
+        self.log.append(from_addr)
+        return super()._deliver(message, from_addr, to_addrs)
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        _FakeSession.log = []
+        _FakeSession.over_quota = set()
+
+    def test_router_weighted_round_robin(self):
+        """Test router.AccountRouter.select() spreads picks by weight and
+        interleaves accounts smoothly.
+        """
+        accounts = [router.Account(_make_credentials('a'), weight=3),
+                    router.Account(_make_credentials('b'), weight=1)]
+        account_router = router.AccountRouter(accounts)
+        picks = [account_router.select().name for _ in range(8)]
+        self.assertEqual(collections.Counter(picks),
+                         {'a@gmail.com': 6, 'b@gmail.com': 2})
+        self.assertNotEqual(picks[:3], ['a@gmail.com'] * 3)
+
+    def test_router_quota(self):
+        """Test router.AccountRouter.select() skips accounts over quota and
+        raises a 421 smtplib.SMTPResponseException when all are.
+        """
+        accounts = [router.Account(_make_credentials('a'), quota=1),
+                    router.Account(_make_credentials('b'), quota=2)]
+        account_router = router.AccountRouter(accounts)
+        picks = [account_router.select().name for _ in range(3)]
+        self.assertEqual(sorted(picks), ['a@gmail.com', 'b@gmail.com',
+                                         'b@gmail.com'])
+        with self.assertRaises(smtplib.SMTPResponseException) as context:
+            account_router.select()
+        self.assertEqual(context.exception.smtp_code, 421)
+
+    def test_router_from_files(self):
+        """Test router.AccountRouter.from_files() loads credentials from
+        EMAILER_CREDS style json files.
+        """
+        account_router = router.AccountRouter.from_files(
+            [MOCK_ENVIR_JSON_FILE], quotas=[10])
+        self.assertEqual(account_router.accounts[0].name, 'test@gmail.com')
+        self.assertEqual(account_router.accounts[0].quota, 10)
+        with self.assertRaises(ValueError):
+            router.AccountRouter([])
+
+    def test_routed_transport_failover(self):
+        """Test router.RoutedTransport fails over to the next account when
+        one is throttled, and rests the throttled account.
+        """
+        account_router = router.AccountRouter(
+            [_make_credentials('a'), _make_credentials('b')])
+        _FakeSession.over_quota.add('a@gmail.com')
+        routed = router.RoutedTransport(account_router,
+                                        session_factory=_FakeSession)
+        test_emailer = Emailer(transport=routed)
+        for _ in range(4):
+            test_emailer.send_email('Hi', 'me@gmail.com', ['x@gmail.com'])
+        self.assertEqual(_FakeSession.log, ['b@gmail.com'] * 4)
+        self.assertGreater(account_router.accounts[0].throttled_until, 0)
+        self.assertEqual(routed.stats.messages, 4)
+        self.assertEqual(account_router.accounts[1].stats.messages, 4)
+
+    def test_routed_transport_metrics(self):
+        """Test router.RoutedTransport records a routed message once in
+        the metrics, failed attempts on throttled accounts included.
+        """
+        metrics.REGISTRY.reset()
+        metrics.enable()
+        self.addCleanup(metrics.REGISTRY.reset)
+        self.addCleanup(metrics.disable)
+        account_router = router.AccountRouter(
+            [_make_credentials('a'), _make_credentials('b')])
+        _FakeSession.over_quota.add('a@gmail.com')
+        routed = router.RoutedTransport(account_router,
+                                        session_factory=_FakeSession)
+        size = routed.send(b'Hello', 'me@gmail.com', ['x@gmail.com'])
+        self.assertGreater(account_router.accounts[0].throttled_until, 0)
+        self.assertEqual(metrics.MESSAGES_SENT.value, 1)
+        self.assertEqual(metrics.MESSAGES_FAILED.value, 0)
+        self.assertEqual(metrics.BYTES_SENT.value, size)
+        self.assertEqual(metrics.SEND_SECONDS.count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
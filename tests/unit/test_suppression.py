@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from auto_emailer import bulk, suppression, transport
+
+ROWS = [{'email': 'friend{}@gmail.com'.format(i), 'name': 'Friend {}'.format(i)}
+        for i in range(10)]
+
+
+class TestSuppression(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self._tmp.name) / 'suppressed.idx')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_bloom_filter(self):
+        """Test suppression.BloomFilter has no false negatives and a
+        false positive rate close to the configured rate.
+        """
+        bloom = suppression.BloomFilter(1000, error_rate=0.01)
+        added = [suppression.address_digest('a{}@x.com'.format(i))
+                 for i in range(1000)]
+        for digest in added:
+            bloom.add(digest)
+        self.assertTrue(all(digest in bloom for digest in added))
+        false_positives = sum(suppression.address_digest('b{}@x.com'.format(i))
+                              in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_index_lookup(self):
+        """Test suppression.SuppressionIndex.build() writes an index
+        that finds suppressed addresses regardless of case.
+        """
+        index = suppression.SuppressionIndex.build(
+            self.path, ['friend{}@gmail.com'.format(i) for i in range(0, 100, 3)])
+        self.assertEqual(len(index), 34)
+        self.assertIn('Friend3@GMAIL.com', index)
+        self.assertNotIn('friend4@gmail.com', index)
+        index.close()
+
+    def test_index_merge(self):
+        """Test suppression.SuppressionIndex.build() keeps existing
+        entries when merge is True and drops them otherwise.
+        """
+        suppression.SuppressionIndex.build(self.path, ['a@x.com']).close()
+        index = suppression.SuppressionIndex.build(self.path, ['b@x.com'])
+        self.assertIn('a@x.com', index)
+        index.close()
+        index = suppression.SuppressionIndex.build(self.path, ['c@x.com'],
+                                                   merge=False)
+        self.assertNotIn('a@x.com', index)
+        index.close()
+
+    def test_index_bloom_file(self):
+        """Test suppression.SuppressionIndex maps the Bloom filter written
+        by build() instead of rebuilding it, and rebuilds it when the
+        filter file is missing or belongs to another version of the index.
+        """
+        addresses = ['friend{}@gmail.com'.format(i) for i in range(50)]
+        suppression.SuppressionIndex.build(self.path, addresses).close()
+        with mock.patch.object(suppression.BloomFilter, 'add') as add:
+            index = suppression.SuppressionIndex(self.path)
+        self.assertEqual(add.call_count, 0)
+        self.assertTrue(all(address in index for address in addresses))
+        self.assertNotIn('nobody@gmail.com', index)
+        index.close()
+
+        # the same digests in another file, as if copied over the index
+        Path(self.path + '.new').write_bytes(Path(self.path).read_bytes())
+        os.replace(self.path + '.new', self.path)
+        with mock.patch.object(suppression.BloomFilter, 'add',
+                               autospec=True,
+                               side_effect=suppression.BloomFilter.add) as add:
+            index = suppression.SuppressionIndex(self.path)
+        self.assertEqual(add.call_count, 50)
+        index.close()
+        os.remove(self.path + '.bloom')
+        index = suppression.SuppressionIndex(self.path)
+        self.assertIn('friend7@gmail.com', index)
+        index.close()
+
+    def test_index_empty(self):
+        """Test suppression.SuppressionIndex of an empty list suppresses
+        nothing, and a file of the wrong size raises ValueError.
+        """
+        index = suppression.SuppressionIndex.build(self.path, [])
+        self.assertNotIn('a@x.com', index)
+        Path(self.path).write_bytes(b'broken')
+        with self.assertRaises(ValueError):
+            suppression.SuppressionIndex(self.path)
+
+    def test_send_bulk_filter_stage(self):
+        """Test suppression.SuppressionIndex.filter() used as a
+        bulk.send_bulk() stage drops suppressed recipients.
+        """
+        index = suppression.SuppressionIndex.build(
+            self.path, ['friend1@gmail.com', 'friend7@gmail.com'])
+        sink = transport.MemoryTransport()
+        report = bulk.send_bulk(sink, ROWS, 'me@gmail.com', 'Hi',
+                                text='Hello {name}', stages=[index.filter])
+        self.assertEqual(report.sent, 8)
+        self.assertEqual(index.dropped, 2)
+        self.assertNotIn(['friend1@gmail.com'],
+                         [envelope.to_addrs for envelope in sink.outbox])
+        index.close()
+
+    def test_send_bulk_filter_stage_address_key(self):
+        """Test bulk.send_bulk() passes its address_key to the stages."""
+        index = suppression.SuppressionIndex.build(
+            self.path, ['friend1@gmail.com'])
+        rows = [{'to': row['email'], 'name': row['name']} for row in ROWS]
+        sink = transport.MemoryTransport()
+        report = bulk.send_bulk(sink, rows, 'me@gmail.com', 'Hi',
+                                text='Hello {name}', address_key='to',
+                                stages=[index.filter])
+        self.assertEqual(report.sent, 9)
+        self.assertEqual(index.dropped, 1)
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from auto_emailer import Message, template
+
+RECEIPT = """Hello {{ name }},
+{% if coupon %}
+Use {{ coupon.code|upper }}.
+{% else %}
+No coupon.
+{% endif %}
+{% for item in items %}
+* {{ item.name }}
+{% endfor %}
+"""
+
+
+class TestTemplate(unittest.TestCase):
+
+    def test_template_render(self):
+        """Test template.Template renders variables, filters,
+        conditionals and loops without blank lines from block tags.
+        """
+        tmpl = template.Template(RECEIPT)
+        text = tmpl.render(name='Ada', coupon={'code': 'spring'},
+                           items=[{'name': 'Pen'}, {'name': 'Ink'}])
+        self.assertEqual(text, 'Hello Ada,\nUse SPRING.\n* Pen\n* Ink\n')
+
+    def test_template_optional_section(self):
+        """Test template.Template treats missing values as false in
+        conditions but raises KeyError when they are output.
+        """
+        tmpl = template.Template(RECEIPT)
+        self.assertEqual(tmpl.render(name='Ada', items=[]),
+                         'Hello Ada,\nNo coupon.\n')
+        with self.assertRaises(KeyError):
+            tmpl.render(items=[])
+
+    def test_template_escape(self):
+        """Test template.Template escapes values with autoescape or the
+        `e` filter, and not with the `safe` filter.
+        """
+        value = {'html': '<b>&</b>'}
+        self.assertEqual(template.Template('{{ html|e }}').render(value),
+                         '&lt;b&gt;&amp;&lt;/b&gt;')
+        tmpl = template.Template('{{ html }}{{ html|safe }}', autoescape=True)
+        self.assertEqual(tmpl.render(value), '&lt;b&gt;&amp;&lt;/b&gt;<b>&</b>')
+
+    def test_template_syntax_error(self):
+        """Test template.Template raises ValueError on malformed
+        templates.
+        """
+        for source in ['{% if a %}', '{% endfor %}', '{{ a|nope }}',
+                       '{% for a of b %}{% endfor %}', '{{ a b }}',
+                       '{% while a %}']:
+            with self.assertRaises(ValueError):
+                template.Template(source)
+
+    def test_load_template_cache(self):
+        """Test template.load_template() returns the cached template until
+        the file modification time changes.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'body.txt'
+            path.write_text('Hi {{ name }}')
+            first = template.load_template(path)
+            self.assertIs(template.load_template(path), first)
+            path.write_text('Bye {{ name }}')
+            stat = path.stat()
+            os.utime(str(path), ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10 ** 9))
+            second = template.load_template(path)
+            self.assertIsNot(second, first)
+            self.assertEqual(second.render(name='Ada'), 'Bye Ada')
+        with self.assertRaises(FileNotFoundError):
+            template.load_template(path)
+
+    def test_message_draft_compiled(self):
+        """Test auto_emailer.Message.draft_message() with compiled=True
+        renders the text with auto_emailer.template.
+        """
+        message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+        message.draft_message(text='{% for n in names %}{{ n }} {% endfor %}',
+                              template_args={'names': ['a', 'b']},
+                              compiled=True)
+        self.assertIn(b'a b ', message.as_bytes())
+
+    def test_message_draft_compiled_html_only(self):
+        """Test auto_emailer.Message.draft_message() with compiled=True and
+        only an html body renders it, escaped, without a text body.
+        """
+        message = Message('me@gmail.com', ['a@gmail.com'], 'Hi')
+        message.draft_message(html='<b>{{ x }}</b>', compiled=True,
+                              template_args={'x': '1 < 2'})
+        body = message.message.get_payload(0)
+        self.assertEqual([part.get_content_type()
+                          for part in body.get_payload()], ['text/html'])
+        self.assertEqual(body.get_payload(0).get_payload(),
+                         '<b>1 &lt; 2</b>')
+
+
+if __name__ == '__main__':
+    unittest.main()
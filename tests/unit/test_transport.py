@@ -0,0 +1,174 @@
+import mailbox
+import smtplib
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from auto_emailer import Emailer, Message
+from auto_emailer import transport
+
+
+def _make_message():
+    """Used for creating a drafted Message for test cases."""
+    return Message('my_email@gmail.com',
+                   ['my_friend@gmail.com'],
+                   'Hello Friend!').draft_message(text='Hi Friend!From here')
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_transport_send_many_stats(self):
+        """Test transport.Transport.send_many() delivers every envelope,
+        closes the transport it opened and records counters in
+        transport.TransportStats.
+        """
+        sink = transport.NullTransport()
+        envelopes = [transport.Envelope('message {}'.format(i),
+                                        'a@gmail.com', ['b@gmail.com'])
+                     for i in range(5)]
+        self.assertEqual(sink.send_many(envelopes), 5)
+        self.assertFalse(sink.connected)
+        stats = sink.stats.snapshot()
+        self.assertEqual(stats['messages'], 5)
+        self.assertEqual(stats['bytes'], 5 * len('message 0'))
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['failures'], 0)
+
+    def test_transport_send_failure_stats(self):
+        """Test transport.Transport.send() records a failure and
+        re-raises the exception when delivery fails.
+        """
+        sink = transport.NullTransport()
+        with self.assertRaises(ValueError):
+            sink.send({'Subject': 'Test'})
+        self.assertEqual(sink.stats.failures, 1)
+        self.assertEqual(sink.stats.messages, 0)
+
+    def test_memory_transport_outbox(self):
+        """Test transport.MemoryTransport keeps serialized messages
+        with their envelope in MemoryTransport.outbox.
+        """
+        sink = transport.MemoryTransport()
+        sink.send(_make_message().message, 'a@gmail.com', ['b@gmail.com'])
+        self.assertEqual(len(sink.outbox), 1)
+        envelope = sink.outbox[0]
+        self.assertIsInstance(envelope.message, bytes)
+        self.assertIn(b'Subject: Hello Friend!', envelope.message)
+        self.assertEqual(envelope.to_addrs, ['b@gmail.com'])
+
+    def test_maildir_transport(self):
+        """Test transport.MaildirTransport writes one file per message
+        readable by mailbox.Maildir.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'outbox')
+            with transport.MaildirTransport(path) as sink:
+                sink.send(_make_message().message)
+                sink.send(_make_message().message)
+            self.assertEqual(len(mailbox.Maildir(path)), 2)
+
+    def test_mbox_transport(self):
+        """Test transport.MboxTransport appends messages to a single mbox
+        file readable by mailbox.mbox, across separate opens.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'outbox.mbox')
+            with transport.MboxTransport(path) as sink:
+                sink.send(_make_message().message, 'a@gmail.com')
+            with transport.MboxTransport(path) as sink:
+                sink.send('From the start\nbody', 'a@gmail.com')
+            messages = list(mailbox.mbox(path))
+            self.assertEqual(len(messages), 2)
+            self.assertEqual(messages[0]['Subject'], 'Hello Friend!')
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_smtp_transport_spawn(self, mock_smtplib):
+        """Test transport.SMTPTransport.spawn() returns a new session
+        sharing the same transport.TransportStats.
+        """
+        sink = transport.SMTPTransport(config=mock.Mock())
+        session = sink.spawn()
+        self.assertIsNot(session, sink)
+        self.assertIs(session.stats, sink.stats)
+        session.send('Test', 'a@gmail.com', ['b@gmail.com'])
+        self.assertEqual(mock_smtplib.return_value.sendmail.call_count, 1)
+        self.assertEqual(sink.stats.messages, 1)
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_smtp_transport_bytes(self, mock_smtplib):
+        """Test transport.SMTPTransport counts the encoded bytes sent for
+        bytes, str and email.message.Message messages.
+        """
+        sink = transport.SMTPTransport(config=mock.Mock())
+        self.assertEqual(sink.send(b'Hi\r\n', 'a@gmail.com'), 4)
+        self.assertEqual(sink.send('Hi\nthere\n', 'a@gmail.com'), 11)
+        message = _make_message().message
+        size = sink.send(message, 'a@gmail.com', ['b@gmail.com'])
+        self.assertEqual(size, len(message.as_bytes()) +
+                         message.as_bytes().count(b'\n'))
+        self.assertEqual(sink.stats.bytes, 15 + size)
+        self.assertEqual(mock_smtplib.return_value.send_message.call_count,
+                         1)
+
+    @mock.patch('auto_emailer.transport.smtplib.SMTP')
+    def test_smtp_transport_size_limit(self, mock_smtplib):
+        """Test transport.SMTPTransport remembers the EHLO SIZE limit of
+        the server and refuses larger messages before connecting again,
+        measuring each message once.
+        """
+        instance = mock_smtplib.return_value
+        instance.esmtp_features = {'size': '100'}
+        config = mock.Mock(host='smtp.size.test', port=587)
+        self.addCleanup(transport.SMTPTransport._size_limits.pop,
+                        ('smtp.size.test', 587), None)
+        sink = transport.SMTPTransport(config)
+        self.assertIsNone(sink.max_size)
+        sink.send('Small', 'a@gmail.com', ['b@gmail.com'])
+        sink.close()
+        self.assertEqual(sink.max_size, 100)
+
+        emailer = Emailer(transport=transport.SMTPTransport(config))
+        with mock.patch('auto_emailer.transport._wire_size',
+                        wraps=transport._wire_size) as wire_size:
+            with self.assertRaises(smtplib.SMTPSenderRefused) as refused:
+                emailer.send_email('x\n' * 60, 'a@gmail.com',
+                                   ['b@gmail.com'])
+        self.assertEqual(refused.exception.smtp_code, 552)
+        self.assertEqual(wire_size.call_count, 1)
+        self.assertEqual(mock_smtplib.call_count, 1)
+        self.assertEqual(instance.sendmail.call_count, 1)
+
+        # under the limit, measured before connecting and not again
+        with mock.patch('auto_emailer.transport._wire_size',
+                        wraps=transport._wire_size) as wire_size:
+            emailer.send_email('x\n' * 10, 'a@gmail.com', ['b@gmail.com'])
+        self.assertEqual(wire_size.call_count, 1)
+        self.assertEqual(instance.sendmail.call_count, 2)
+
+    def test_emailer_transport(self):
+        """Test auto_emailer.Emailer delivers through a given transport
+        without credentials and closes it after auto_emailer.Emailer.send_email().
+        """
+        sink = transport.MemoryTransport()
+        test_emailer = Emailer(transport=sink)
+        test_emailer.send_email(_make_message())
+        self.assertEqual(len(sink.outbox), 1)
+        self.assertFalse(test_emailer.connected)
+
+    def test_emailer_transport_retry(self):
+        """Test auto_emailer.Emailer.send_email() reopens the transport
+        and retries once on smtplib.SMTPServerDisconnected.
+        """
+        sink = transport.MemoryTransport()
+        with mock.patch.object(sink, '_deliver',
+                               side_effect=[smtplib.SMTPServerDisconnected,
+                                            0]) as mock_deliver:
+            Emailer(transport=sink).send_email(_make_message())
+        self.assertEqual(mock_deliver.call_count, 2)
+        self.assertEqual(sink.stats.failures, 1)
+        self.assertEqual(sink.stats.messages, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()